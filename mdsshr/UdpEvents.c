@@ -51,6 +51,11 @@ extern int UdpEventGetLoop(char *loop);
 extern int UdpEventGetInterface(struct in_addr **interface_addr);
 
 #define MAX_MSG_LEN 4096
+#define MAX_EVENT_LEN 0x4000000 /* 64 MB, largest fragmented payload */
+#define FRAGMENT_FLAG 0x80000000u
+#define BATCH_FLAG 0x40000000u
+#define MAX_ASSEMBLIES 4 /* fragmented payloads received concurrently */
+#define RECEIVE_BUFFER_SIZE 0x100000 /* requested SO_RCVBUF, may be capped */
 #define MAX_EVENTS \
   1000000 /*Maximum number of events handled by a single process */
 
@@ -86,8 +91,145 @@ static pthread_mutex_t sendEventMutex = PTHREAD_MUTEX_INITIALIZER;
 - buf len (4 byte int)
 - buf (buf len chars)
 
+ Payloads that do not fit into one message are sent as fragments:
+
+- event name len | FRAGMENT_FLAG (4 byte int)
+- event name (event name len bytes)
+- buf len (4 byte int)
+- message id (4 byte int)
+- offset of the fragment in buf (4 byte int)
+- fragment (MAX_MSG_LEN - 16 - event name len chars, except the last one)
+
+ Publishers may batch several small events into one message:
+
+- number of events | BATCH_FLAG (4 byte int)
+- the events, each structured as a message
+
+ Receivers without fragment or batch support ignore them because of the
+ flags.
+
 ***********************/
 
+typedef struct
+{
+  struct sockaddr_in sender;
+  uint32_t id;
+  uint32_t total;
+  uint32_t received;
+  char *buf;
+  unsigned char *have; /* bitmap of the fragments received */
+} Assembly;
+
+typedef struct
+{
+  Assembly slot[MAX_ASSEMBLIES];
+  int next;
+} Assemblies;
+
+static void freeAssemblies(void *arg)
+{
+  Assemblies *assemblies = (Assemblies *)arg;
+  int i;
+  for (i = 0; i < MAX_ASSEMBLIES; i++)
+  {
+    free(assemblies->slot[i].buf);
+    assemblies->slot[i].buf = NULL;
+    free(assemblies->slot[i].have);
+    assemblies->slot[i].have = NULL;
+  }
+}
+
+/* Copies a fragment into the buffer of its message, returns the assembly
+   when all fragments have been received. Fragments are chunk bytes long
+   except the last one, duplicates are ignored. The oldest incomplete
+   message is dropped when fragments of more than MAX_ASSEMBLIES messages
+   are interleaved. */
+static Assembly *addFragment(Assemblies *assemblies,
+                             struct sockaddr_in const *sender, uint32_t id,
+                             uint32_t total, uint32_t offset, uint32_t chunk,
+                             char const *fragment, uint32_t fragLen)
+{
+  Assembly *assembly = NULL;
+  uint32_t idx;
+  int i;
+  if (total > MAX_EVENT_LEN || offset > total || fragLen > total - offset ||
+      chunk == 0 || offset % chunk != 0 ||
+      (fragLen != chunk && fragLen != total - offset))
+    return NULL;
+  for (i = 0; i < MAX_ASSEMBLIES; i++)
+  {
+    Assembly *slot = &assemblies->slot[i];
+    if (slot->buf && slot->id == id &&
+        slot->sender.sin_addr.s_addr == sender->sin_addr.s_addr &&
+        slot->sender.sin_port == sender->sin_port)
+    {
+      assembly = slot;
+      break;
+    }
+  }
+  if (!assembly)
+  {
+    assembly = &assemblies->slot[assemblies->next];
+    assemblies->next = (assemblies->next + 1) % MAX_ASSEMBLIES;
+    free(assembly->buf);
+    free(assembly->have);
+    assembly->buf = malloc(total);
+    assembly->have = calloc((total / chunk + 8) / 8, 1);
+    if (!assembly->buf || !assembly->have)
+    {
+      free(assembly->buf);
+      free(assembly->have);
+      assembly->buf = NULL;
+      assembly->have = NULL;
+      return NULL;
+    }
+    assembly->sender = *sender;
+    assembly->id = id;
+    assembly->total = total;
+    assembly->received = 0;
+  }
+  if (assembly->total != total)
+    return NULL;
+  idx = offset / chunk;
+  if (assembly->have[idx / 8] & (1u << (idx % 8)))
+    return NULL;
+  assembly->have[idx / 8] |= (unsigned char)(1u << (idx % 8));
+  memcpy(assembly->buf + offset, fragment, fragLen);
+  assembly->received += fragLen;
+  return (assembly->received == assembly->total) ? assembly : NULL;
+}
+
+/* Calls astadr for each event of a batch that matches the event name */
+static void dispatchBatch(char *msg, size_t msgLen, char const *thisEventName,
+                          size_t thisNameLen,
+                          void (*astadr)(void *, int, char *), void *arg)
+{
+  uint32_t swap, count, nameLen, bufLen;
+  size_t pos = sizeof(int);
+  memcpy(&swap, msg, sizeof(swap));
+  count = ntohl(swap) & ~BATCH_FLAG;
+  for (; count > 0; count--)
+  {
+    if (msgLen - pos < sizeof(int))
+      return;
+    memcpy(&swap, msg + pos, sizeof(swap));
+    nameLen = ntohl(swap);
+    pos += sizeof(int);
+    if (nameLen > msgLen - pos || msgLen - pos - nameLen < sizeof(int))
+      return;
+    char *eventName = msg + pos;
+    pos += nameLen;
+    memcpy(&swap, msg + pos, sizeof(swap));
+    bufLen = ntohl(swap);
+    pos += sizeof(int);
+    if (bufLen > msgLen - pos)
+      return;
+    if (nameLen == thisNameLen && !strncmp(thisEventName, eventName, nameLen))
+      astadr(arg, (int)bufLen, msg + pos);
+    pos += bufLen;
+  }
+}
+
 static void *handleMessage(void *info_in)
 {
 
@@ -100,7 +242,10 @@ static void *handleMessage(void *info_in)
   free(info->eventName);
   free(info);
   INIT_AND_FREE_ON_EXIT(char *, recBuf);
-  struct sockaddr clientAddr;
+  Assemblies assemblies;
+  memset(&assemblies, 0, sizeof(assemblies));
+  pthread_cleanup_push(freeAssemblies, &assemblies);
+  struct sockaddr_in clientAddr;
   recBuf = malloc(MAX_MSG_LEN);
   for (;;)
   {
@@ -126,6 +271,14 @@ static void *handleMessage(void *info_in)
     uint32_t swap;
     memcpy(&swap, currPtr, sizeof(swap));
     uint32_t nameLen = ntohl(swap);
+    if (nameLen & BATCH_FLAG)
+    {
+      dispatchBatch(recBuf, (size_t)recBytes, thisEventName, thisNameLen,
+                    astadr, arg);
+      continue;
+    }
+    const int isFragment = (nameLen & FRAGMENT_FLAG) != 0;
+    nameLen &= ~FRAGMENT_FLAG;
     if (nameLen != thisNameLen)
       continue;
     currPtr += sizeof(int);
@@ -134,14 +287,39 @@ static void *handleMessage(void *info_in)
     memcpy(&swap, currPtr, sizeof(swap));
     uint32_t bufLen = ntohl(swap);
     currPtr += sizeof(int);
-    // check for invalid buffer
-    if ((size_t)recBytes != (nameLen + bufLen + 2 * sizeof(int)))
-      continue;
     // check to see if this message matches the event name
     if (strncmp(thisEventName, eventName, nameLen))
       continue;
+    if (isFragment)
+    {
+      if ((size_t)recBytes < (nameLen + 4 * sizeof(int)))
+        continue;
+      uint32_t id, offset;
+      memcpy(&id, currPtr, sizeof(id));
+      currPtr += sizeof(int);
+      memcpy(&swap, currPtr, sizeof(swap));
+      offset = ntohl(swap);
+      currPtr += sizeof(int);
+      Assembly *assembly = addFragment(
+          &assemblies, &clientAddr, id, bufLen, offset,
+          MAX_MSG_LEN - (4 * sizeof(int) + nameLen), currPtr,
+          (uint32_t)((size_t)recBytes - (nameLen + 4 * sizeof(int))));
+      if (assembly)
+      {
+        astadr(arg, (int)assembly->total, assembly->buf);
+        free(assembly->buf);
+        assembly->buf = NULL;
+        free(assembly->have);
+        assembly->have = NULL;
+      }
+      continue;
+    }
+    // check for invalid buffer
+    if ((size_t)recBytes != (nameLen + bufLen + 2 * sizeof(int)))
+      continue;
     astadr(arg, (int)bufLen, currPtr);
   }
+  pthread_cleanup_pop(1);
   FREE_NOW(recBuf);
   return NULL;
 }
@@ -198,6 +376,7 @@ int MDSUdpEventAstMask(char const *eventName, void (*astadr)(void *, int, char *
 {
   struct sockaddr_in serverAddr;
   int one = 1;
+  int rcvBuf = RECEIVE_BUFFER_SIZE;
   int udpSocket;
   char ipAddress[64];
   struct ip_mreq ipMreq;
@@ -228,6 +407,9 @@ int MDSUdpEventAstMask(char const *eventName, void (*astadr)(void *, int, char *
     print_socket_error("Cannot set REUSEPORT option");
   }
 #endif
+  // room for the fragments of large payloads, best effort as the kernel
+  // caps it, e.g. at net.core.rmem_max on linux
+  setsockopt(udpSocket, SOL_SOCKET, SO_RCVBUF, (char *)&rcvBuf, sizeof(rcvBuf));
   if (bind(udpSocket, (SOCKADDR *)&serverAddr, sizeof(serverAddr)))
   {
     perror("Cannot bind socket\n");
@@ -340,19 +522,41 @@ static void send_socket_get()
   UdpEventGetPort(&sendPort);
 }
 
+static uint32_t fragmentId = 0; /* protected by sendEventMutex */
+
+static int sendMessage(SOCKET udpSocket, char const *msg, unsigned int msgLen,
+                       struct sockaddr_in const *sin)
+{
+  if (sendto(udpSocket, msg, msgLen, 0, (struct sockaddr *)sin, sizeof(*sin)) ==
+      -1)
+  {
+    print_socket_error("Error sending UDP message");
+    return MDSplusERROR;
+  }
+  return MDSplusSUCCESS;
+}
+
 int MDSUdpEvent(char const *eventName, unsigned int bufLen, char const *buf)
 {
   char multiIp[64];
-  uint32_t buflen_net_order = (uint32_t)htonl(bufLen);
   SOCKET udpSocket;
   struct sockaddr_in sin;
   char *msg = 0, *currPtr;
-  unsigned int msgLen, nameLen = (unsigned int)strlen(eventName), actBufLen;
-  uint32_t namelen_net_order = (uint32_t)htonl(nameLen);
+  unsigned int nameLen = (unsigned int)strlen(eventName);
+  uint32_t buflen_net_order, namelen_net_order;
   int status;
   char ttl, loop;
   struct in_addr *interface_addr = 0;
 
+  if (!buf)
+    bufLen = 0;
+  if (nameLen > MAX_MSG_LEN - 20u || bufLen > MAX_EVENT_LEN)
+  {
+    fprintf(stderr, "Event %s with %u bytes of data is too large\n", eventName,
+            bufLen);
+    return MDSplusERROR;
+  }
+  buflen_net_order = (uint32_t)htonl(bufLen);
   getMulticastAddr(eventName, multiIp);
   pthread_once(&send_socket_once, &send_socket_get);
   udpSocket = send_socket;
@@ -362,26 +566,7 @@ int MDSUdpEvent(char const *eventName, unsigned int bufLen, char const *buf)
   if (_LibGetHostAddr(multiIp, NULL, (struct sockaddr *)&sin))
     return MDSplusERROR;
   sin.sin_port = htons(sendPort);
-  nameLen = (unsigned int)strlen(eventName);
-  if (bufLen < MAX_MSG_LEN - (4u + 4u + nameLen))
-    actBufLen = bufLen;
-  else
-    actBufLen = MAX_MSG_LEN - (4u + 4u + nameLen);
-  msgLen = 4u + nameLen + 4u + actBufLen;
-  msg = malloc(msgLen);
-  currPtr = msg;
-
-  memcpy(currPtr, &namelen_net_order, sizeof(namelen_net_order));
-  currPtr += sizeof(buflen_net_order);
-
-  memcpy(currPtr, eventName, nameLen);
-  currPtr += nameLen;
-
-  memcpy(currPtr, &buflen_net_order, sizeof(buflen_net_order));
-  currPtr += sizeof(buflen_net_order);
-
-  if (buf && bufLen > 0)
-    memcpy(currPtr, buf, bufLen);
+  msg = malloc(MAX_MSG_LEN);
 
   pthread_mutex_lock(&sendEventMutex);
 
@@ -396,14 +581,48 @@ int MDSUdpEvent(char const *eventName, unsigned int bufLen, char const *buf)
     free(interface_addr);
   }
 
-  if (sendto(udpSocket, msg, msgLen, 0, (struct sockaddr *)&sin, sizeof(sin)) ==
-      -1)
+  if (bufLen <= MAX_MSG_LEN - (4u + 4u + nameLen))
   {
-    print_socket_error("Error sending UDP message");
-    status = MDSplusERROR;
+    namelen_net_order = (uint32_t)htonl(nameLen);
+    currPtr = msg;
+    memcpy(currPtr, &namelen_net_order, sizeof(namelen_net_order));
+    currPtr += sizeof(namelen_net_order);
+    memcpy(currPtr, eventName, nameLen);
+    currPtr += nameLen;
+    memcpy(currPtr, &buflen_net_order, sizeof(buflen_net_order));
+    currPtr += sizeof(buflen_net_order);
+    if (bufLen > 0)
+      memcpy(currPtr, buf, bufLen);
+    status = sendMessage(udpSocket, msg, 4u + nameLen + 4u + bufLen, &sin);
   }
   else
+  {
+    const unsigned int chunk = MAX_MSG_LEN - (4u + nameLen + 12u);
+    const uint32_t id_net_order = (uint32_t)htonl(++fragmentId);
+    unsigned int offset, fragLen;
+    namelen_net_order = (uint32_t)htonl(nameLen | FRAGMENT_FLAG);
     status = MDSplusSUCCESS;
+    for (offset = 0; offset < bufLen && status == MDSplusSUCCESS;
+         offset += fragLen)
+    {
+      uint32_t offset_net_order = (uint32_t)htonl(offset);
+      fragLen = (bufLen - offset < chunk) ? bufLen - offset : chunk;
+      currPtr = msg;
+      memcpy(currPtr, &namelen_net_order, sizeof(namelen_net_order));
+      currPtr += sizeof(namelen_net_order);
+      memcpy(currPtr, eventName, nameLen);
+      currPtr += nameLen;
+      memcpy(currPtr, &buflen_net_order, sizeof(buflen_net_order));
+      currPtr += sizeof(buflen_net_order);
+      memcpy(currPtr, &id_net_order, sizeof(id_net_order));
+      currPtr += sizeof(id_net_order);
+      memcpy(currPtr, &offset_net_order, sizeof(offset_net_order));
+      currPtr += sizeof(offset_net_order);
+      memcpy(currPtr, buf + offset, fragLen);
+      status = sendMessage(udpSocket, msg,
+                           (unsigned int)(currPtr - msg) + fragLen, &sin);
+    }
+  }
   free(msg);
   pthread_mutex_unlock(&sendEventMutex);
   return status;
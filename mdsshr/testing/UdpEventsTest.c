@@ -24,6 +24,7 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 */
 #include <stdarg.h>
 #include <stdio.h>
+#include <string.h>
 #include <time.h>
 #include <unistd.h>
 
@@ -66,6 +67,19 @@ void eventAstSecond(void *arg, int len __attribute__((unused)),
   pthread_mutex_unlock(&second_lock);
 }
 
+static pthread_mutex_t large_lock = PTHREAD_MUTEX_INITIALIZER;
+static char large_buf[100000];
+static int large = 0;
+
+void eventAstLarge(void *arg, int len, char *buf)
+{
+  printf("received event in thread %ld, name=%s, len=%d\n", CURRENT_THREAD_ID(), (char *)arg, len);
+  pthread_mutex_lock(&large_lock);
+  if (len == (int)sizeof(large_buf) && !memcmp(buf, large_buf, sizeof(large_buf)))
+    large = len;
+  pthread_mutex_unlock(&large_lock);
+}
+
 static void short_wait()
 {
   static const struct timespec tspec = {0, 100000000};
@@ -129,6 +143,22 @@ int main(int argc, char **args)
   status = MDSEventCan(id1);
   status = MDSEventCan(id2);
 
+  // Testing a payload fragmented over several messages //
+  int id3;
+  for (i = 0; i < (int)sizeof(large_buf); i++)
+    large_buf[i] = (char)(i * 7);
+  sprintf(eventname, "large_event_%d", getpid());
+  status = MDSEventAst(eventname, eventAstLarge, "large", &id3);
+  TEST0(status % 1);
+  short_wait();
+  status = MDSEvent(eventname, sizeof(large_buf), large_buf);
+  TEST0(status % 1);
+  short_wait();
+  pthread_mutex_lock(&large_lock);
+  TEST1(large == (int)sizeof(large_buf));
+  pthread_mutex_unlock(&large_lock);
+  status = MDSEventCan(id3);
+
   END_TESTING;
   return (STATUS_OK) == 0;
 }
@@ -129,6 +129,8 @@ def load_package(gbls, version_check=False):
     loadmod_full('descriptor', gbls)
     loadmod_full('apd', gbls)
     loadmod_full('event', gbls)
+    if sys.version_info >= (3, 5):
+        loadmod_full('aioevent', gbls)
     loadmod_full('tree', gbls)
     loadmod_full('scope', gbls)
     loadmod_full('_mdsshr', gbls)
@@ -136,6 +138,8 @@ def load_package(gbls, version_check=False):
     loadmod_full('mdsdcl', gbls)
     if libs.MdsIpShr is not None:
         loadmod_full('connection', gbls)
+        if sys.version_info >= (3, 5):
+            loadmod_full('aioconnection', gbls)
     gbls["PyLib"] = os.getenv("PyLib")
     return gbls
 
@@ -0,0 +1,274 @@
+#
+# Copyright (c) 2017, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""asyncio client for mdsip servers, requires python 3.5 or newer"""
+
+import asyncio
+import collections
+
+
+def _mimport(name, level=1):
+    try:
+        return __import__(name, globals(), level=level)
+    except Exception:
+        return __import__(name, globals())
+
+
+_exc = _mimport('mdsExceptions')
+_con = _mimport('connection')
+
+MdsIpException = _con.MdsIpException
+
+
+class AsyncConnection(object):
+    """mdsip connection driven by an asyncio event loop.
+
+    async with AsyncConnection('myserver') as con:
+        await con.openTree('mytree', 123)
+        values = await asyncio.gather(*(con.get(e) for e in expressions))
+
+    Requests are written to the socket as soon as they are issued and the
+    answers are matched in order by a reader task, so a single event loop can
+    keep many requests outstanding on many servers. Only tcp hostspecs are
+    supported. Server side state, e.g. open trees, is shared by all requests
+    of the connection and applies in the order the requests were issued.
+    """
+
+    _socket = _con._MdsIpSocket
+
+    def __init__(self, hostspec, depth=255):
+        """
+        @param hostspec: tcp host[:port] of the mdsip server
+        @type hostspec: str
+        @param depth: maximum number of outstanding requests, at most 255
+        message ids are in use at any time
+        @type depth: int
+        """
+        self.hostspec = hostspec
+        self.depth = min(255, max(1, int(depth)))
+        self._reader = self._writer = self._task = None
+        self._pending = collections.deque()
+        self._message_id = 0
+        self._slots = None
+        self._connecting = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
+
+    def __len__(self):
+        """number of outstanding requests"""
+        return len(self._pending)
+
+    @property
+    def connected(self):
+        return self._task is not None and not self._task.done()
+
+    async def connect(self):
+        """Open the connection and log in, does nothing if connected"""
+        if self.connected:
+            return
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._connect())
+        try:
+            await asyncio.shield(self._connecting)
+        finally:
+            if self._connecting is not None and self._connecting.done():
+                self._connecting = None
+
+    async def _connect(self):
+        host, port = self._socket._parse(str(self.hostspec))
+        self._reader, self._writer = await asyncio.open_connection(host, port)
+        try:
+            self._writer.write(self._socket.login_message())
+            header, _ = await self._recv()
+            if not header[1] & 1:
+                raise MdsIpException("Access denied to %s" % (self.hostspec,))
+        except BaseException:
+            self._writer.close()
+            raise
+        self._slots = asyncio.Semaphore(self.depth)
+        self._task = asyncio.ensure_future(self._read_answers())
+
+    async def close(self):
+        """Close the connection, outstanding requests fail"""
+        if self._writer is not None:
+            self._writer.close()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except BaseException:
+                pass
+        self._task = self._writer = self._reader = None
+        self._fail(MdsIpException("Connection to %s closed" % (self.hostspec,)))
+
+    def _fail(self, exc):
+        while self._pending:
+            future = self._pending.popleft()[1]
+            self._slots.release()
+            if not future.done():
+                future.set_exception(exc)
+
+    async def _recv(self):
+        size = self._socket._header.size
+        header = self._socket._header.unpack(
+            await self._reader.readexactly(size))
+        body = bytearray(await self._reader.readexactly(header[0]-size))
+        return header, body
+
+    async def _read_answers(self):
+        try:
+            while True:
+                header, body = await self._recv()
+                message_id, future = self._pending.popleft()
+                self._slots.release()
+                if future.done():  # cancelled by the caller
+                    continue
+                if header[5] != message_id:
+                    future.set_exception(MdsIpException(
+                        "Unexpected answer to message %d" % (header[5],)))
+                    continue
+                try:
+                    future.set_result(self._socket.answer(header, body))
+                except Exception as exc:
+                    future.set_exception(exc)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            if isinstance(exc, asyncio.IncompleteReadError):
+                exc = MdsIpException(
+                    "Connection to %s closed" % (self.hostspec,))
+            self._writer.close()
+            self._fail(exc)
+
+    async def get(self, exp, *args, **kwargs):
+        """Evaluate an expression on the remote server
+        @param exp: TDI expression to be evaluated
+        @type exp: str
+        @param args: optional arguments to be inserted for the placeholders in the expression.
+        @type args: Data
+        @param kwargs: arglist replaces args
+        @return: result of evaluating the expression on the remote server
+        @rtype: Scalar or Array
+        """
+        if 'arglist' in kwargs:
+            args = kwargs['arglist']
+        if not self.connected:
+            await self.connect()
+        await self._slots.acquire()
+        self._message_id = self._message_id % 255 + 1
+        future = asyncio.get_event_loop().create_future()
+        try:
+            message = self._socket.encode(exp, args, self._message_id)
+        except BaseException:
+            self._slots.release()
+            raise
+        self._pending.append((self._message_id, future))
+        self._writer.write(message)
+        await self._writer.drain()
+        return await future
+
+    async def getObject(self, exp, *args, **kwargs):
+        return (await self.get('serializeout(`(%s;))' % exp,
+                               *args, **kwargs)).deserialize()
+
+    async def put(self, node, exp, *args):
+        """Put data into a node in an MDSplus tree
+        @param node: Node name, relative or full path. Include double backslashes in string if node name includes one.
+        @type node: str
+        @param exp: TDI expression with placeholders for any optional args.
+        @type exp: str
+        @param args: optional arguments to be inserted for the placeholders in the expression.
+        @type args: Data
+        @rtype: None
+        """
+        pexp = 'TreePut($,$%s)' % (',$'*len(args),)
+        pargs = [node, exp] + list(args)
+        _exc.checkStatus(await self.get(pexp, arglist=pargs))
+
+    async def openTree(self, tree, shot):
+        """Open an MDSplus tree on the remote server
+        @rtype: None
+        """
+        _exc.checkStatus(await self.get("TreeOpen($,$)", tree, shot))
+
+    async def closeTree(self, tree, shot):
+        """Close an MDSplus tree on the remote server
+        @rtype: None
+        """
+        _exc.checkStatus(await self.get("TreeClose($,$)", tree, shot))
+
+    async def closeAllTrees(self):
+        """Close all open MDSplus trees on the remote server"""
+        return await self.get("_i=0;WHILE(IAND(TreeClose(),1)) _i++;_i")
+
+    async def setDefault(self, path):
+        """Change the current default tree location on the remote server
+        @rtype: None
+        """
+        _exc.checkStatus(await self.get("TreeSetDefault($)", path))
+
+    def getMany(self):
+        """Return an AsyncGetMany bound to this connection"""
+        return AsyncGetMany(self)
+
+    def putMany(self):
+        """Return an AsyncPutMany bound to this connection"""
+        return AsyncPutMany(self)
+
+    GetMany = getMany
+    PutMany = putMany
+
+
+class AsyncGetMany(_con.GetMany):
+    """GetMany for an AsyncConnection, execute() is a coroutine"""
+
+    _connection_class = AsyncConnection
+
+    async def execute(self):
+        """Send the list to the remote server for evaluation and return the answer as a dict instance."""
+        ans = await self.connection.get("GetManyExecute($)", self.serialize())
+        if isinstance(ans, str):
+            raise MdsIpException("Error fetching data: "+ans)
+        self.result = ans.deserialize()
+        return self.result
+
+
+class AsyncPutMany(_con.PutMany):
+    """PutMany for an AsyncConnection, execute() is a coroutine"""
+
+    _connection_class = AsyncConnection
+
+    async def execute(self):
+        """Send the puts to the remote server and return the status of each put as a dict instance."""
+        ans = await self.connection.get("PutManyExecute($)", self.serialize())
+        if isinstance(ans, str):
+            raise MdsIpException("Error putting any data: "+ans)
+        self.result = ans.deserialize()
+        return self.result
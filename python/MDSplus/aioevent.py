@@ -0,0 +1,226 @@
+#
+# Copyright (c) 2017, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""asyncio receivers of MDSplus events, requires python 3.5 or newer"""
+
+import asyncio
+import time as _time
+import weakref as _weakref
+
+import numpy as _N
+
+
+def _mimport(name, level=1):
+    try:
+        return __import__(name, globals(), level=level)
+    except Exception:
+        return __import__(name, globals())
+
+
+_evt = _mimport('event')
+_ver = _mimport('version')
+
+
+class _AsyncHub(asyncio.DatagramProtocol):
+    """Event socket of an event loop shared by all its waiters and streams.
+    The socket is opened with the first subscription and closed with the
+    last one. The hub only keeps a weak reference to its loop, so the entry
+    in _hubs goes away with the loop once the hub has no subscribers."""
+    _hubs = _weakref.WeakKeyDictionary()
+
+    @classmethod
+    def get(cls):
+        loop = asyncio.get_event_loop()
+        hub = cls._hubs.get(loop)
+        if hub is None:
+            hub = cls._hubs[loop] = cls(loop)
+        return hub
+
+    def __init__(self, loop):
+        self._loop = _weakref.ref(loop)
+        self._settings = _evt._UdpSettings.get()
+        self._subscribers = {}
+        self._groups = None
+        self._assembler = _evt._Assembler()
+        self._socket = self._transport = self._opening = None
+
+    def __len__(self):
+        return sum(len(callbacks) for callbacks in self._subscribers.values())
+
+    def subscribe(self, name, callback):
+        if self._socket is None:
+            self._socket = _evt._event_socket(self._settings.port)
+            self._socket.setblocking(False)
+            self._groups = _evt._Memberships(self._socket)
+            self._opening = asyncio.ensure_future(
+                self._loop().create_datagram_endpoint(
+                    lambda: self, sock=self._socket))
+        self._groups.add(self._settings.group(name))
+        self._subscribers.setdefault(name, set()).add(callback)
+
+    def unsubscribe(self, name, callback):
+        callbacks = self._subscribers[name]
+        callbacks.discard(callback)
+        if not callbacks:
+            del(self._subscribers[name])
+        self._groups.remove(self._settings.group(name))
+        if not self._subscribers:
+            self._close()
+
+    async def ready(self):
+        """wait until the socket is attached to the event loop"""
+        if self._opening is not None:
+            await asyncio.shield(self._opening)
+
+    def _close(self):
+        self._groups.close()
+        if self._transport is not None:
+            self._transport.close()
+            self._socket = self._transport = self._opening = None
+        # else connection_made closes the socket once it is attached
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._opening = None  # the future refers to the loop
+        if not self._subscribers:
+            self._close()
+
+    def datagram_received(self, data, addr):
+        for name, raw in self._assembler.parse(data, addr):
+            callbacks = self._subscribers.get(name)
+            if not callbacks:
+                continue
+            msg = _evt.EventMessage(name, _N.frombuffer(
+                raw, _N.uint8), _time.time())
+            for callback in list(callbacks):
+                callback(msg)
+
+
+async def wait_event(event, timeout=0):
+    """Wait for the next occurrence of an event without blocking a thread.
+
+    msg = await wait_event('shot_done', 10)
+    data = msg.getData()
+
+    @param event: name of the event
+    @type event: str
+    @param timeout: seconds to wait, 0 waits forever
+    @type timeout: float
+    @rtype: EventMessage
+    """
+    name = _evt._event_name(event)
+    hub = _AsyncHub.get()
+    future = asyncio.Future()
+
+    def callback(msg):
+        if not future.done():
+            future.set_result(msg)
+    hub.subscribe(name, callback)
+    try:
+        await hub.ready()
+        return await asyncio.wait_for(future, timeout or None)
+    except asyncio.TimeoutError:
+        raise _evt.MdsTimeout("Event %s timed out." % (_ver.tostr(event),))
+    finally:
+        hub.unsubscribe(name, callback)
+
+
+class EventStream(object):
+    """Asynchronous iterator over the occurrences of one or more events.
+
+    async with EventStream(['shot_start', 'shot_done']) as events:
+        async for msg in events:
+            print(msg.name, msg.getData())
+
+    All streams and waiters of an event loop share one socket. Messages are
+    dropped and counted in dropped while more than maxsize are unread.
+    """
+
+    def __init__(self, events, maxsize=0):
+        """
+        @param events: name or names of the events
+        @type events: str or list
+        @param maxsize: maximum number of unread messages, 0 for no limit
+        @type maxsize: int
+        """
+        if isinstance(events, (str, bytes)):
+            events = [events]
+        self.names = []
+        for event in events:
+            name = _evt._event_name(event)
+            if name not in self.names:
+                self.names.append(name)
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._hub = self._queue = None
+        self._closed = False
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._queue is None:
+            if self._closed:
+                raise StopAsyncIteration
+            await self.open()
+        msg = await self._queue.get()
+        if msg is None:
+            self._queue.put_nowait(None)
+            raise StopAsyncIteration
+        return msg
+
+    def _put(self, msg):
+        if self.maxsize and self._queue.qsize() >= self.maxsize:
+            self.dropped += 1
+        else:
+            self._queue.put_nowait(msg)
+
+    async def open(self):
+        """Subscribe to the events, done by the first iteration if needed"""
+        if self._queue is not None or self._closed:
+            return
+        self._queue = asyncio.Queue()
+        self._hub = _AsyncHub.get()
+        for name in self.names:
+            self._hub.subscribe(name, self._put)
+        await self._hub.ready()
+
+    def close(self):
+        """Unsubscribe, an ongoing iteration ends after the unread messages"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._hub is not None:
+            for name in self.names:
+                self._hub.unsubscribe(name, self._put)
+            self._hub = None
+            self._queue.put_nowait(None)
@@ -25,8 +25,22 @@
 
 
 import threading
+import time
+import os
+import re
+import hashlib
+import collections
+import getpass
+import itertools
+import socket
+import struct
+import zlib
 import numpy
 import ctypes
+try:
+    import queue as _queue
+except ImportError:
+    import Queue as _queue
 
 
 def _mimport(name, level=1):
@@ -43,6 +57,8 @@ _sca = _mimport('mdsscalar')
 _arr = _mimport('mdsarray')
 _dat = _mimport('mdsdata')
 _ver = _mimport('version')
+_cmp = _mimport('compound')
+_evt = _mimport('event')
 
 
 class MdsIpException(_exc.MDSplusException):
@@ -57,6 +73,9 @@ _GetAnswerInfoTO.argtypes = [ctypes.c_int32, ctypes.POINTER(ctypes.c_ubyte), cty
                              ctypes.c_void_p, ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_void_p), ctypes.c_int32]
 _MdsIpFree = __MdsIpShr.MdsIpFree
 _MdsIpFree.argtypes = [ctypes.c_void_p]
+_SetConnectionCompression = __MdsIpShr.SetConnectionCompression
+_SetConnectionCompression.argtypes = [ctypes.c_int32, ctypes.c_int32]
+_SetConnectionCompression.restype = None
 _SendArg = __MdsIpShr.SendArg
 _SendArg.argtypes = [ctypes.c_int32, ctypes.c_ubyte, ctypes.c_ubyte,
                      ctypes.c_ubyte, ctypes.c_ushort, ctypes.c_ubyte, ctypes.c_void_p, ctypes.c_void_p]
@@ -65,12 +84,173 @@ _SendArg.argtypes = [ctypes.c_int32, ctypes.c_ubyte, ctypes.c_ubyte,
 INVALID_CONNECTION_ID = -1
 
 
+class BufferPool(object):
+    """Reusable numpy buffers for Connection.get_into
+
+    pool = BufferPool()
+    frame = con.get_into('\\cam:frames[$]', pool, i)
+    ...
+    pool.give(frame)
+
+    Buffers are reused when an answer has the same dtype and number of
+    elements as a returned one, i.e. the shape may differ.
+    """
+
+    def __init__(self, max_buffers=4):
+        """
+        @param max_buffers: maximum number of idle buffers kept
+        @type max_buffers: int
+        """
+        self.max_buffers = max_buffers
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """number of idle buffers"""
+        return len(self._idle)
+
+    def take(self, shape, dtype):
+        """Return an uninitialized array, reusing an idle buffer if possible
+        @rtype: numpy.ndarray
+        """
+        dtype = numpy.dtype(dtype)
+        size = 1
+        for dim in shape:
+            size *= int(dim)
+        with self._lock:
+            for i, buf in enumerate(self._idle):
+                if buf.dtype == dtype and buf.size == size:
+                    del(self._idle[i])
+                    return buf.reshape(shape)
+        return numpy.empty(shape, dtype)
+
+    def give(self, array):
+        """Return an array obtained by take() for reuse"""
+        while array.base is not None and isinstance(array.base, numpy.ndarray):
+            array = array.base
+        with self._lock:
+            if len(self._idle) < self.max_buffers and not any(
+                    buf is array for buf in self._idle):
+                self._idle.append(array.reshape(-1))
+
+    def clear(self):
+        with self._lock:
+            self._idle = []
+
+
+class _Compression(object):
+    """zlib compression settings and byte counters of a _Connection.
+
+    A fixed level applies to the requests sent by the client and, through
+    MdsSetCompression, to the answers of the server. Note that the server
+    keeps that level process wide, i.e. it applies to all its clients.
+    In auto mode only the requests are compressed and the level is chosen
+    per argument: payloads smaller than min_size are sent plain, larger
+    ones are compressed if the ratio measured on samples of that dtype and
+    the zlib speed make the transfer faster at the throughput measured on
+    the answers. The client library does not report the size of the
+    messages on the wire, so the estimate_* counters derive it from the
+    sampled ratio of the dtype of each compressed message.
+    """
+    min_size = 1 << 14
+    sample_size = 1 << 16
+    sample_every = 16
+
+    def __init__(self, level):
+        self.auto = level == 'auto'
+        self.level = 6 if self.auto else max(0, min(9, int(level)))
+        self.client_level = self.server_level = None
+        self.ratio = {}  # dtype: compressed/raw of the last sample
+        self.samples = {}  # dtype: number of messages since last sample
+        self.zlib_rate = None  # raw bytes per second compressed by zlib
+        self.link_rate = None  # bytes per second of plain answers
+        self.counters = {'raw_sent': 0, 'estimate_sent': 0,
+                         'raw_received': 0, 'estimate_received': 0}
+
+    def choose(self, dtype, nbytes):
+        """level to be used for a payload"""
+        if not self.auto:
+            return self.level
+        if nbytes < self.min_size or dtype not in self.ratio:
+            return 0
+        if self.zlib_rate is None or self.link_rate is None:
+            return self.level
+        # compress and uncompress vs. sending the saved bytes
+        saved = (1.-self.ratio[dtype])/self.link_rate
+        cost = 2./self.zlib_rate
+        return self.level if saved > cost else 0
+
+    def _sample(self, dtype, nbytes, pointer):
+        count = self.samples.get(dtype, 0)
+        self.samples[dtype] = count+1
+        if nbytes < self.min_size or (
+                dtype in self.ratio and count % self.sample_every):
+            return
+        size = min(nbytes, self.sample_size)
+        data = ctypes.string_at(pointer, size)
+        start = time.time()
+        ratio = len(zlib.compress(data, self.level or 1))/float(size)
+        seconds = time.time()-start
+        self.ratio[dtype] = ratio
+        if seconds > 0:
+            self.zlib_rate = size/seconds
+
+    def _count(self, key, dtype, nbytes, level):
+        self.counters['raw_'+key] += nbytes
+        if level:  # zlib output is only sent if it is smaller
+            ratio = min(1., self.ratio.get(dtype, 1.))
+            self.counters['estimate_'+key] += int(nbytes*ratio)
+        else:
+            self.counters['estimate_'+key] += nbytes
+
+    def sent(self, dtype, nbytes, pointer):
+        self._sample(dtype, nbytes, pointer)
+        self._count('sent', dtype, nbytes, self.client_level)
+
+    def received(self, dtype, nbytes, pointer, seconds):
+        self._sample(dtype, nbytes, pointer)
+        level = self.server_level
+        self._count('received', dtype, nbytes, level)
+        if not level and nbytes >= self.min_size and seconds > 0:
+            rate = nbytes/seconds
+            self.link_rate = rate if self.link_rate is None else (
+                .8*self.link_rate+.2*rate)
+
+
+def _answer_array(out, dtype, ndims, dims, numbytes):
+    """Internal routine to check or take the target array of an answer"""
+    cls = _dsc.dtypeToArrayClass.get(
+        {10: 52, 11: 53, 12: 54, 13: 55}.get(dtype, dtype), None)
+    ntype = getattr(cls, 'ntype', None)
+    if ntype is None or dtype == 14:
+        raise MdsIpException(
+            "Answer of dtype %d cannot be received into an array" % (dtype,))
+    shape = tuple(int(dims[i]) for i in range(ndims-1, -1, -1))
+    if isinstance(out, BufferPool):
+        out = out.take(shape, ntype)
+    if not isinstance(out, numpy.ndarray):
+        raise TypeError("out must be a numpy.ndarray or a BufferPool")
+    if out.dtype != numpy.dtype(ntype) or out.nbytes != numbytes:
+        raise MdsIpException(
+            "Answer of %s%s does not fit into array of %s%s" % (
+                numpy.dtype(ntype).name, shape, out.dtype.name, out.shape))
+    if not (out.flags.c_contiguous and out.flags.writeable):
+        raise MdsIpException("out must be a writeable contiguous array")
+    return out
+
+
 class _Connection:
 
     _conid = INVALID_CONNECTION_ID
+    _compression = None
+    # (tree, shot) and default node set through Connection
+    _tree = None
+    _default = None
 
-    def __init__(self, hostspec):
+    def __init__(self, hostspec, compression=None):
         self.hostspec = _ver.tobytes(hostspec)
+        if compression is not None:
+            self._compression = _Compression(compression)
 
     @property
     def conid(self):
@@ -83,11 +263,29 @@ class _Connection:
             if self._conid == INVALID_CONNECTION_ID:
                 raise MdsIpException("Error connecting to %s" %
                                      _ver.tostr(self.hostspec))
+            if self._compression is not None:
+                self._compression.client_level = None
+                self._compression.server_level = None
+                if not self._compression.auto:
+                    self._setCompression(self._compression.level)
+
+    def _setCompression(self, level):
+        """set level of client and server unless already set"""
+        cmp = self._compression
+        if cmp.client_level != level:
+            _SetConnectionCompression(self._conid, level)
+            cmp.client_level = level
+        if cmp.server_level != level:
+            cmp.server_level = level
+            self._request = None
+            self._send_plain("MdsSetCompression($)", (_sca.Int32(level),))
+            self._get_answer()
 
     def disconnect(self):
         if self._conid != INVALID_CONNECTION_ID:
             _DisconnectFromMds(self._conid)
             self._conid = INVALID_CONNECTION_ID
+        self._tree = self._default = None
 
     def __enter__(self, *a):
         self.connect()
@@ -130,6 +328,40 @@ class _Connection:
             dtype = 13
         return {'dtype': dtype, 'length': length, 'dimct': dimct, 'dims': dims, 'address': pointer}
 
+    @staticmethod
+    def _answer_value(dtype, length, ndims, dims, numbytes, pointer):
+        """Internal routine to convert an answer buffer into Data"""
+        if dtype == 10:
+            dtype = 52
+        elif dtype == 11:
+            dtype = 53
+        elif dtype == 12:
+            dtype = 54
+        elif dtype == 13:
+            dtype = 55
+        if ndims == 0:
+            d = _dsc.DescriptorS()
+            d.dtype = dtype
+            d.length = length
+            d.pointer = pointer
+            return d.value
+        val = _dsc.DescriptorA()
+        val.dtype = dtype
+        val.dclass = 4
+        val.length = length
+        val.pointer = pointer
+        val.scale = 0
+        val.digits = 0
+        val.aflags = 0
+        val.dimct = ndims
+        val.arsize = numbytes
+        val.a0 = val.pointer
+        if val.dimct > 1:
+            val.coeff = 1
+            for i in range(val.dimct):
+                val.coeff_and_bounds[i] = int(dims[i])
+        return val.value
+
     def _get_answer(self, to_msec=-1):
         dtype = ctypes.c_ubyte(0)
         length = ctypes.c_ushort(0)
@@ -139,39 +371,14 @@ class _Connection:
         ans = ctypes.c_void_p(0)
         mem = ctypes.c_void_p(0)
         try:
-            _exc.checkStatus(_GetAnswerInfoTO(self.conid, dtype, length, ndims,
-                                              dims.ctypes.data, numbytes, ctypes.byref(ans), ctypes.byref(mem), int(to_msec)))
-            dtype = dtype.value
-            if dtype == 10:
-                dtype = 52
-            elif dtype == 11:
-                dtype = 53
-            elif dtype == 12:
-                dtype = 54
-            elif dtype == 13:
-                dtype = 55
-            if ndims.value == 0:
-                d = _dsc.DescriptorS()
-                d.dtype = dtype
-                d.length = length.value
-                d.pointer = ans
-                return d.value
-            val = _dsc.DescriptorA()
-            val.dtype = dtype
-            val.dclass = 4
-            val.length = length.value
-            val.pointer = ans
-            val.scale = 0
-            val.digits = 0
-            val.aflags = 0
-            val.dimct = ndims.value
-            val.arsize = numbytes.value
-            val.a0 = val.pointer
-            if val.dimct > 1:
-                val.coeff = 1
-                for i in range(val.dimct):
-                    val.coeff_and_bounds[i] = int(dims[i])
-            return val.value
+            status = _GetAnswerInfoTO(self.conid, dtype, length, ndims,
+                                      dims.ctypes.data, numbytes, ctypes.byref(ans), ctypes.byref(mem), int(to_msec))
+            self._answered(numbytes.value)
+            _exc.checkStatus(status)
+            if self._compression is not None and self._request is not None:
+                self._received(dtype.value, numbytes.value, ans)
+            return self._answer_value(dtype.value, length.value, ndims.value,
+                                      dims, numbytes.value, ans)
         except _exc.MDSplusException:
             if ndims.value == 0 and dtype == _sca.String.dtype_id:
                 d = _dsc.DescriptorS()
@@ -184,12 +391,66 @@ class _Connection:
             if mem.value is not None:
                 _MdsIpFree(mem)
 
+    def _get_answer_into(self, out, to_msec=-1):
+        dtype = ctypes.c_ubyte(0)
+        length = ctypes.c_ushort(0)
+        ndims = ctypes.c_ubyte(0)
+        dims = numpy.array([0, 0, 0, 0, 0, 0, 0, 0], dtype=numpy.uint32)
+        numbytes = ctypes.c_ulong(0)
+        ans = ctypes.c_void_p(0)
+        mem = ctypes.c_void_p(0)
+        try:
+            status = _GetAnswerInfoTO(self.conid, dtype, length, ndims,
+                                      dims.ctypes.data, numbytes, ctypes.byref(ans), ctypes.byref(mem), int(to_msec))
+            self._answered(numbytes.value)
+            if not status & 1:
+                if ndims.value == 0 and dtype.value == _sca.String.dtype_id:
+                    d = _dsc.DescriptorS()
+                    d.dtype = dtype.value
+                    d.length = length.value
+                    d.pointer = ans
+                    raise MdsIpException(str(d.value))
+                _exc.checkStatus(status)
+            if self._compression is not None and self._request is not None:
+                self._received(dtype.value, numbytes.value, ans)
+            out = _answer_array(out, dtype.value, ndims.value, dims,
+                                numbytes.value)
+            if numbytes.value:
+                ctypes.memmove(out.ctypes.data, ans, numbytes.value)
+            return out
+        finally:
+            if mem.value is not None:
+                _MdsIpFree(mem)
+
+    # size of the mdsip message header
+    _header_size = 48
+    _answer_time = _answer_bytes = _request_bytes = 0
+
+    def _answered(self, numbytes):
+        self._answer_time = time.time()
+        self._answer_bytes = numbytes+self._header_size
+
+    def _received(self, dtype, numbytes, pointer):
+        start, self._request = self._request, None
+        self._compression.received(dtype, numbytes, pointer,
+                                   time.time()-start)
+
     def _send_arg(self, value, idx, num):
         """Internal routine to send argument to mdsip server"""
         val = _dat.Data(value)
         if not isinstance(val, _sca.Scalar) and not isinstance(val, _arr.Array):
             val = _dat.Data(val.data())
         info = self._inspect(val)
+        nbytes = int(info['length']*numpy.prod(
+            info['dims'].reshape(-1)[:info['dimct']]))
+        if self._compression is not None and self._request is not None:
+            cmp = self._compression
+            if cmp.auto:
+                level = cmp.choose(info['dtype'], nbytes)
+                if level != cmp.client_level:
+                    _SetConnectionCompression(self.conid, level)
+                    cmp.client_level = level
+            cmp.sent(info['dtype'], nbytes, info['address'])
         _exc.checkStatus(
             _SendArg(self.conid,
                      idx,
@@ -199,19 +460,809 @@ class _Connection:
                      info['dimct'],
                      info['dims'].ctypes.data,
                      info['address']))
+        return nbytes
 
-    def get(self, exp, *args, **kwargs):
-        if 'arglist' in kwargs:
-            args = kwargs['arglist']
-        timeout = kwargs.get('timeout', -1)
+    _request = None
+
+    def _send_request(self, exp, args):
+        if self._compression is not None:
+            self._request = time.time()
+        self._send_plain(exp, args)
+
+    def _send_plain(self, exp, args):
         num = len(args)+1
         exp = _ver.tobytes(exp)
         _exc.checkStatus(_SendArg(self.conid, 0, 14, num,
                                   len(exp), 0, 0, ctypes.c_char_p(exp)))
+        nbytes = len(exp)+num*self._header_size
         for i, arg in enumerate(args):
-            self._send_arg(arg, i+1, num)
+            nbytes += self._send_arg(arg, i+1, num)
+        self._request_bytes = nbytes
+
+    def _measure(self, metrics, exp, args, receive):
+        """Send a request and receive its answer recording RequestMetrics"""
+        rec = RequestMetrics(exp)
+        start = time.time()
+        try:
+            if self._conid == INVALID_CONNECTION_ID:
+                self.connect()
+                rec.connect = time.time()-start
+            sent = time.time()
+            self._send_request(exp, args)
+            self._answer_time = 0
+            rec.request_bytes = self._request_bytes
+            waited = time.time()
+            rec.send = waited-sent
+            try:
+                return receive()
+            finally:
+                if self._answer_time:
+                    rec.wait = self._answer_time-waited
+                    rec.decode = time.time()-self._answer_time
+                    rec.response_bytes = self._answer_bytes
+        except Exception as exc:
+            rec.error = str(exc)
+            raise
+        finally:
+            rec.total = time.time()-start
+            metrics.record(rec)
+
+    def get(self, exp, *args, **kwargs):
+        if 'arglist' in kwargs:
+            args = kwargs['arglist']
+        timeout = kwargs.get('timeout', -1)
+        metrics = kwargs.get('metrics', None)
+        if metrics is not None:
+            return self._measure(metrics, exp, args,
+                                 lambda: self._get_answer(timeout))
+        self._send_request(exp, args)
         return self._get_answer(timeout)
 
+    def get_into(self, exp, out, args=(), timeout=-1, metrics=None):
+        if metrics is not None:
+            return self._measure(metrics, exp, args,
+                                 lambda: self._get_answer_into(out, timeout))
+        self._send_request(exp, args)
+        return self._get_answer_into(out, timeout)
+
+
+class RequestMetrics(object):
+    """Timing and size of one request, see Connection.enableMetrics.
+    Times are in seconds: connect if the request had to connect first,
+    send to pass the request to the socket, wait until the answer has been
+    received completely as the client library does not tell when it starts
+    arriving, and decode to convert it. Bytes include the message headers.
+    """
+    __slots__ = ('expression', 'time', 'request_bytes', 'response_bytes',
+                 'connect', 'send', 'wait', 'decode', 'total', 'error')
+    fields = ('connect', 'send', 'wait', 'decode', 'total',
+              'request_bytes', 'response_bytes')
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.time = time.time()
+        self.request_bytes = self.response_bytes = 0
+        self.connect = self.send = self.wait = self.decode = self.total = 0.
+        self.error = None
+
+    def __repr__(self):
+        return 'RequestMetrics(%r, total=%.6f, send=%.6f, wait=%.6f, decode=%.6f, bytes=%d/%d%s)' % (
+            self.expression, self.total, self.send, self.wait, self.decode,
+            self.request_bytes, self.response_bytes,
+            '' if self.error is None else ', error=%r' % (self.error,))
+
+    def asDict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class RequestStats(object):
+    """Recent RequestMetrics of one or more connections.
+    Hooks added with addHook are called with each RequestMetrics as it is
+    recorded, e.g. to export it to a monitoring system. They run in the
+    thread of the request and must not raise.
+    @ivar count: number of requests recorded
+    @ivar errors: number of requests that failed
+    """
+
+    def __init__(self, maxlen=10000):
+        """
+        @param maxlen: number of recent requests kept for percentiles
+        @type maxlen: int
+        """
+        self._recent = collections.deque(maxlen=int(maxlen))
+        self._hooks = []
+        self._lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+
+    def __len__(self):
+        return len(self._recent)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._recent))
+
+    def __repr__(self):
+        return 'RequestStats(count=%d, errors=%d)' % (self.count, self.errors)
+
+    def addHook(self, hook):
+        """Call hook(metrics) for each recorded request"""
+        self._hooks.append(hook)
+
+    def removeHook(self, hook):
+        self._hooks.remove(hook)
+
+    def record(self, metrics):
+        with self._lock:
+            self._recent.append(metrics)
+            self.count += 1
+            if metrics.error is not None:
+                self.errors += 1
+        for hook in self._hooks:
+            hook(metrics)
+
+    def clear(self):
+        """Drop the recent requests, the counters are kept"""
+        with self._lock:
+            self._recent.clear()
+
+    def percentiles(self, field='total', q=(50, 90, 99)):
+        """Return {q: value} of a field over the recent requests
+        @param field: one of RequestMetrics.fields
+        @type field: str
+        @rtype: dict
+        """
+        if field not in RequestMetrics.fields:
+            raise KeyError(field)
+        values = [getattr(m, field) for m in self]
+        if not values:
+            return dict((p, None) for p in q)
+        return dict(zip(q, numpy.percentile(values, q).tolist()))
+
+    def summary(self, q=(50, 90, 99)):
+        """Return count, mean, max and percentiles of each field
+        @rtype: dict
+        """
+        recent = list(self)
+        summary = {'count': self.count, 'errors': self.errors}
+        for field in RequestMetrics.fields:
+            values = numpy.array([getattr(m, field) for m in recent], float)
+            if not len(values):
+                continue
+            entry = {'mean': float(values.mean()), 'max': float(values.max())}
+            for p, value in zip(q, numpy.percentile(values, q).tolist()):
+                entry['p%g' % p] = value
+            summary[field] = entry
+        return summary
+
+
+class ResultCache(object):
+    """LRU cache of Connection.get results, see Connection.enableCache.
+    Entries are keyed on the server, the tree and shot opened with
+    Connection.openTree, the default node, the expression and the
+    serialized arguments. Only expressions evaluated in a pulse > 0 that
+    neither use private variables nor call Tree*, Mds*, Set*, Tcl or Spawn
+    functions are cached, as their result is assumed to depend on the tree
+    data only. The cache may be shared by connections.
+    With a directory the results are also written to disk as serialized
+    data and entries evicted from memory are reloaded from there.
+    @ivar hits: number of results served from the cache
+    @ivar misses: number of results that had to be fetched
+    """
+    _private = re.compile(r'(?<![\w$\\])_\w')
+    _effects = re.compile(r'(?<![\w$\\])(tree|mds|set|tcl|spawn)\w*\s*\(', re.I)
+
+    def __init__(self, max_entries=1024, max_bytes=1 << 28, directory=None):
+        """
+        @param max_entries: maximum number of results kept in memory
+        @type max_entries: int
+        @param max_bytes: maximum size of the results kept in memory
+        @type max_bytes: int
+        @param directory: directory of the on-disk tier or None
+        @type directory: str
+        """
+        self.max_entries = int(max_entries)
+        self.max_bytes = int(max_bytes)
+        self.directory = directory
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._events = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return 'ResultCache(size=%d/%d, bytes=%d/%d, hits=%d, misses=%d)' % (
+            len(self), self.max_entries, self.nbytes, self.max_bytes,
+            self.hits, self.misses)
+
+    def key(self, hostspec, tree, default, exp, args):
+        """Return the key of a request or None if it is not cacheable"""
+        if (tree is None or tree[1] <= 0 or self._private.search(exp) or
+                self._effects.search(exp)):
+            return None
+        digest = hashlib.sha1()
+        for arg in args:
+            digest.update(_dat.Data(arg).serialize().data().tobytes())
+        return (str(hostspec), tree[0].upper(), tree[1], default, exp,
+                digest.hexdigest())
+
+    @staticmethod
+    def _size(value):
+        return getattr(getattr(value, '_value', None), 'nbytes', 0)+64
+
+    def _filename(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, '%s_%d_%s.mds' % (
+            key[1].lower(), key[2], digest))
+
+    def get(self, key):
+        """Return cached result of key or None"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry  # most recently used
+                self.hits += 1
+                return entry[0]
+        value = self._load(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._put(key, value, store=False)
+        return value
+
+    def _load(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._filename(key), 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        return _dat.Data.deserialize(numpy.frombuffer(data, numpy.uint8))
+
+    def put(self, key, value):
+        self._put(key, value, store=True)
+
+    def _put(self, key, value, store):
+        if store and self.directory is not None:
+            self._store(key, value)
+        size = self._size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            while (len(self._entries) > self.max_entries or
+                   self.nbytes > self.max_bytes):
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+
+    def _store(self, key, value):
+        filename = self._filename(key)
+        if os.path.exists(filename):
+            return
+        tmp = '%s.%d.tmp' % (filename, threading.current_thread().ident)
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(_dat.Data(value).serialize().data().tobytes())
+            os.rename(tmp, filename)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def invalidate(self, tree=None, shot=None):
+        """Drop the entries of a tree and/or shot, all if neither is given
+        @param tree: name of the tree or None for any
+        @type tree: str
+        @param shot: shot number or None for any
+        @type shot: int
+        """
+        tree = None if tree is None else str(tree).upper()
+        shot = None if shot is None else int(shot)
+
+        def match(tree_, shot_):
+            return ((tree is None or tree == tree_.upper()) and
+                    (shot is None or shot == shot_))
+        with self._lock:
+            for key in [key for key in self._entries if match(*key[1:3])]:
+                self.nbytes -= self._entries.pop(key)[1]
+        if self.directory is None:
+            return
+        for name in os.listdir(self.directory):
+            parts = name.rsplit('_', 2)
+            if len(parts) == 3 and name.endswith('.mds'):
+                try:
+                    if match(parts[0], int(parts[1])):
+                        os.remove(os.path.join(self.directory, name))
+                except (ValueError, OSError):
+                    pass
+
+    def clear(self):
+        """Drop all entries, the counters are kept"""
+        self.invalidate()
+
+    def invalidateOn(self, event):
+        """Invalidate entries whenever an MDSplus event occurs. The event data
+        selects the entries: a shot number, a tree name, 'tree shot', or
+        nothing to drop all entries.
+        @param event: name of the event
+        @type event: str
+        @rtype: Event
+        """
+        listener = _CacheEvent(self, event)
+        self._events.append(listener)
+        return listener
+
+    def _invalidateWith(self, data):
+        if data is None:
+            return self.invalidate()
+        data = data.data()
+        if isinstance(data, (_ver.basestring, bytes, numpy.bytes_)):
+            parts = _ver.tostr(data).split()
+            if len(parts) > 1:
+                return self.invalidate(parts[0], int(parts[1]))
+            return self.invalidate(parts[0] if parts else None)
+        return self.invalidate(shot=int(data))
+
+
+class _CacheEvent(_evt.Event):
+    """Invalidates a ResultCache on each occurrence of an event"""
+
+    def __init__(self, cache, event):
+        self.cache = cache
+        super(_CacheEvent, self).__init__(event)
+
+    def run(self):
+        try:
+            self.cache._invalidateWith(self.getData())
+        except Exception:
+            self.cache.clear()
+
+
+class _MdsIpSocket(object):
+    """mdsip message framing on a plain tcp socket.
+    The client library serializes request and answer on a connection, this
+    implementation allows to send further requests before the answers of
+    previous ones have been read. Only tcp hostspecs are supported."""
+
+    _header = struct.Struct('<iiHBBBBbB8i')
+    # IEEE_CLIENT, server converts to little endian
+    client_type = 2 | 0x40
+    # flag of client_type of zlib compressed messages, the body is prefixed
+    # with the message length before compression
+    COMPRESSED = 0x20
+    version = 3  # MDSIP_VERSION_DSC_ANS
+    default_port = 8000
+
+    def __init__(self, hostspec, timeout=None):
+        self.hostspec = hostspec
+        host, port = self._parse(_ver.tostr(hostspec))
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._message_id = 0
+        try:
+            self._login()
+        except Exception:
+            self.close()
+            raise
+
+    @classmethod
+    def _parse(cls, hostspec):
+        if '://' in hostspec:
+            protocol, hostspec = hostspec.split('://', 1)
+            if protocol.lower() != 'tcp':
+                raise MdsIpException(
+                    "Protocol %s is not supported, use tcp" % (protocol,))
+        hostspec = hostspec.strip()
+        if hostspec.startswith('['):  # [ipv6]:port
+            host, _, port = hostspec[1:].partition(']')
+            port = port.lstrip(':')
+        elif hostspec.count(':') == 1:
+            host, port = hostspec.split(':')
+        else:
+            host, port = hostspec, ''
+        return host, int(port) if port else cls.default_port
+
+    @classmethod
+    def login_message(cls):
+        try:
+            user = getpass.getuser()
+        except Exception:
+            user = '?'
+        return cls.pack(0, 0, 14, _ver.tobytes(user), dims=(cls.version,),
+                        ndims=1, message_id=0)
+
+    def _login(self):
+        self.sock.sendall(self.login_message())
+        header, _ = self.recv()
+        if not header[1] & 1:
+            raise MdsIpException("Access denied to %s" % (self.hostspec,))
+
+    def close(self):
+        self.sock.close()
+
+    @classmethod
+    def pack(cls, idx, nargs, dtype, data, length=None, ndims=0, dims=(),
+             message_id=0):
+        """Return message with header"""
+        dims = list(dims)+[0]*(8-len(dims))
+        return cls._header.pack(
+            cls._header.size+len(data), 0,
+            len(data) if length is None else length, nargs, idx,
+            message_id, dtype, cls.client_type, ndims, *dims)+data
+
+    def _recv_bytes(self, num):
+        buf = bytearray(num)
+        self._recv_into(memoryview(buf), num)
+        return buf
+
+    def _recv_into(self, view, num):
+        while num:
+            got = self.sock.recv_into(view, num)
+            if not got:
+                raise MdsIpException("Connection to %s closed" % (self.hostspec,))
+            view = view[got:]
+            num -= got
+
+    def recv_header(self):
+        return self._header.unpack(bytes(self._recv_bytes(self._header.size)))
+
+    def recv(self):
+        """Return (header, body) of the next message, see inflate"""
+        header = self.recv_header()
+        return header, self._recv_bytes(header[0]-self._header.size)
+
+    @classmethod
+    def inflate(cls, header, body):
+        """Return the body of a message uncompressed"""
+        if not header[7] & cls.COMPRESSED:
+            return body
+        msglen = struct.unpack('<i', bytes(body[:4]))[0]
+        try:
+            body = zlib.decompress(bytes(body[4:]))
+        except zlib.error as exc:
+            raise MdsIpException("Corrupt compressed answer: %s" % (exc,))
+        if len(body) != msglen-cls._header.size:
+            raise MdsIpException("Compressed answer has %d instead of %d bytes"
+                                 % (len(body), msglen-cls._header.size))
+        return bytearray(body)
+
+    def recv_into(self, header, out):
+        """Read the body of an answer directly into an array and return it.
+        Errors and mismatching answers are read and raised."""
+        status, dtype, ndims = header[1], header[6], header[8]
+        numbytes = header[0]-self._header.size
+        if status & 1 and header[7] & self.COMPRESSED:
+            body = self.inflate(header, self._recv_bytes(numbytes))
+            out = _answer_array(out, dtype, ndims, header[9:9+ndims],
+                                len(body))
+            if body:
+                out.reshape(-1).view(numpy.uint8)[:] = numpy.frombuffer(
+                    body, numpy.uint8)
+            return out
+        if status & 1:
+            try:
+                out = _answer_array(out, dtype, ndims, header[9:9+ndims],
+                                    numbytes)
+            except Exception:
+                self._recv_bytes(numbytes)
+                raise
+            if numbytes:
+                self._recv_into(memoryview(out.reshape(-1).view(numpy.uint8)),
+                                numbytes)
+            return out
+        self.answer(header, self._recv_bytes(numbytes))
+
+    def request(self, exp, args):
+        """Send expression and arguments without waiting for the answer"""
+        self._message_id = self._message_id % 255 + 1
+        self.sock.sendall(self.encode(exp, args, self._message_id))
+        return self._message_id
+
+    @classmethod
+    def encode(cls, exp, args, message_id):
+        """Return the messages of a request"""
+        num = len(args)+1
+        msgs = [cls.pack(0, num, 14, _ver.tobytes(exp), message_id=message_id)]
+        for idx, arg in enumerate(args):
+            val = _dat.Data(arg)
+            if not isinstance(val, _sca.Scalar) and not isinstance(val, _arr.Array):
+                val = _dat.Data(val.data())
+            info = _Connection._inspect(val)
+            dims = [int(d) for d in info['dims'].reshape(-1)][:info['dimct']]
+            nbytes = info['length']
+            for d in dims:
+                nbytes *= d
+            address = ctypes.cast(info['address'], ctypes.c_void_p).value
+            data = ctypes.string_at(address, nbytes) if nbytes else b''
+            msgs.append(cls.pack(idx+1, num, info['dtype'], data,
+                                 info['length'], info['dimct'], dims,
+                                 message_id))
+        return b''.join(msgs)
+
+    @classmethod
+    def answer(cls, header, body):
+        """Convert an answer message into Data or raise its error"""
+        status, length, dtype, ndims = header[1], header[2], header[6], header[8]
+        body = cls.inflate(header, body)
+        if not status & 1:
+            if ndims == 0 and dtype == 14:
+                raise MdsIpException(_ver.tostr(bytes(body)))
+            _exc.checkStatus(status)
+        buf = (ctypes.c_char*max(1, len(body))).from_buffer(
+            body if len(body) else bytearray(1))
+        return _Connection._answer_value(
+            dtype, length, ndims, header[9:9+ndims], len(body),
+            ctypes.cast(buf, ctypes.c_void_p))
+
+
+class PipelineResult(object):
+    """Future like handle of a request sent through a Pipeline"""
+
+    def __init__(self, pipeline, message_id, out=None):
+        self._pipeline = pipeline
+        self.message_id = message_id
+        self._out = out
+        self._done = False
+        self._value = None
+        self._exception = None
+
+    def _set(self, value=None, exception=None):
+        self._value, self._exception, self._done = value, exception, True
+
+    def done(self):
+        return self._done
+
+    def exception(self):
+        """Wait for the answer and return its exception or None"""
+        while not self._done:
+            self._pipeline._receive()
+        return self._exception
+
+    def result(self):
+        """Wait for the answer and return its value or raise its error"""
+        if self.exception() is not None:
+            raise self._exception
+        return self._value
+
+
+class _SerialResult(object):
+    """PipelineResult like request evaluated when its result is requested"""
+
+    def __init__(self, connection, exp, args):
+        self._request = connection, exp, args
+
+    def result(self):
+        if self._request is not None:
+            connection, exp, args = self._request
+            self._request = None
+            self._value = connection.get(exp, *args)
+        return self._value
+
+
+class Pipeline(object):
+    """Send requests back to back on a dedicated mdsip connection.
+
+    with Connection('myserver').pipeline() as pipe:
+        results = [pipe.get('$*2', i) for i in range(100)]
+        values = [r.result() for r in results]
+
+    get() returns immediately unless depth requests are outstanding.
+    The answers are read in order when results are requested. The pipeline
+    does not share server state, e.g. open trees, with its Connection.
+    """
+
+    def __init__(self, hostspec, depth=64, timeout=None):
+        """
+        @param hostspec: tcp host[:port] of the mdsip server
+        @type hostspec: str
+        @param depth: maximum number of outstanding requests
+        @type depth: int
+        @param timeout: socket timeout in seconds
+        @type timeout: float
+        """
+        self.hostspec = hostspec
+        self.depth = max(1, int(depth))
+        self._sock = _MdsIpSocket(hostspec, timeout)
+        self._pending = []
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        try:
+            if type is None:
+                self.flush()
+        finally:
+            self.close()
+
+    def __len__(self):
+        """number of outstanding requests"""
+        return len(self._pending)
+
+    def get(self, exp, *args):
+        """Queue an expression for evaluation on the server
+        @rtype: PipelineResult
+        """
+        with self._lock:
+            while len(self._pending) >= self.depth:
+                self._receive()
+            return self._request(exp, args)
+
+    def get_into(self, exp, out, *args):
+        """Queue an expression whose answer is read directly into out
+        @param out: numpy array matching the answer or a BufferPool
+        @type out: numpy.ndarray or BufferPool
+        @rtype: PipelineResult
+        """
+        with self._lock:
+            while len(self._pending) >= self.depth:
+                self._receive()
+            return self._request(exp, args, out)
+
+    def _request(self, exp, args, out=None):
+        result = PipelineResult(self, self._sock.request(exp, args), out)
+        self._pending.append(result)
+        return result
+
+    def _receive(self):
+        """read the answer of the oldest outstanding request"""
+        with self._lock:
+            if not self._pending:
+                return
+            result = self._pending[0]
+            header = self._sock.recv_header()
+            del(self._pending[0])
+            if header[5] != result.message_id:
+                self._sock._recv_bytes(header[0]-self._sock._header.size)
+                result._set(exception=MdsIpException(
+                    "Unexpected answer to message %d" % (header[5],)))
+                return
+            try:
+                if result._out is None:
+                    result._set(self._sock.answer(
+                        header, self._sock._recv_bytes(
+                            header[0]-self._sock._header.size)))
+                else:
+                    result._set(self._sock.recv_into(header, result._out))
+            except Exception as exc:
+                result._set(exception=exc)
+
+    def flush(self):
+        """Wait for all outstanding answers"""
+        with self._lock:
+            while self._pending:
+                self._receive()
+
+    def close(self):
+        with self._lock:
+            for result in self._pending:
+                result._set(exception=MdsIpException("Pipeline closed"))
+            self._pending = []
+            self._sock.close()
+
+
+class _SocketConnection(object):
+    """_Connection like client on an _MdsIpSocket.
+    Connections of the client library are only valid in the thread that
+    opened them, this one may be used by any thread. Requests are
+    serialized and the socket is dropped if an exchange breaks off, so the
+    next request reconnects. Only tcp hostspecs are supported."""
+
+    _compression = None
+    # (tree, shot) and default node set through Connection
+    _tree = None
+    _default = None
+    _sock = None
+
+    def __init__(self, hostspec, timeout=None):
+        self.hostspec = hostspec
+        self.timeout = timeout
+        self._lock = threading.Lock()
+
+    def connect(self):
+        with self._lock:
+            self._connect()
+
+    def _connect(self):
+        if self._sock is None:
+            self._sock = _MdsIpSocket(self.hostspec, self.timeout)
+            return True
+        return False
+
+    def disconnect(self):
+        with self._lock:
+            sock, self._sock = self._sock, None
+            self._tree = self._default = None
+        if sock is not None:
+            sock.close()
+
+    def _drop(self, sock):
+        """close a socket whose message stream is out of sync"""
+        if self._sock is sock:
+            self._sock = None
+            self._tree = self._default = None
+        sock.close()
+
+    def _exchange(self, exp, args, timeout, receive, rec=None):
+        """send a request and pass the header of its answer to receive"""
+        with self._lock:
+            start = time.time()
+            if self._connect() and rec is not None:
+                rec.connect = time.time()-start
+            sock = self._sock
+            try:
+                sock.sock.settimeout(
+                    self.timeout if timeout < 0 else timeout/1000.)
+                message_id = sock._message_id % 255 + 1
+                message = sock.encode(exp, args, message_id)
+                sent = time.time()
+                sock.sock.sendall(message)
+                sock._message_id = message_id
+                waited = time.time()
+                header = sock.recv_header()
+                if header[5] != message_id:
+                    raise MdsIpException(
+                        "Unexpected answer to message %d" % (header[5],))
+            except Exception:
+                self._drop(sock)
+                raise
+            try:
+                return receive(sock, header)
+            except EnvironmentError:
+                self._drop(sock)
+                raise
+            finally:
+                if rec is not None:
+                    rec.send = waited-sent
+                    rec.wait = time.time()-waited
+                    rec.request_bytes = len(message)
+                    rec.response_bytes = header[0]
+
+    def _measure(self, metrics, exp, args, timeout, receive):
+        rec = RequestMetrics(exp)
+        start = time.time()
+        try:
+            return self._exchange(exp, args, timeout, receive, rec)
+        except Exception as exc:
+            rec.error = str(exc)
+            raise
+        finally:
+            rec.total = time.time()-start
+            metrics.record(rec)
+
+    @staticmethod
+    def _receive(sock, header):
+        return sock.answer(header, sock._recv_bytes(
+            header[0]-sock._header.size))
+
+    def get(self, exp, *args, **kwargs):
+        if 'arglist' in kwargs:
+            args = kwargs['arglist']
+        timeout = kwargs.get('timeout', -1)
+        metrics = kwargs.get('metrics', None)
+        if metrics is not None:
+            return self._measure(metrics, exp, args, timeout, self._receive)
+        return self._exchange(exp, args, timeout, self._receive)
+
+    def get_into(self, exp, out, args=(), timeout=-1, metrics=None):
+        def receive(sock, header):
+            return sock.recv_into(header, out)
+        if metrics is not None:
+            return self._measure(metrics, exp, args, timeout, receive)
+        return self._exchange(exp, args, timeout, receive)
+
 
 class Connection(object):
     """Implements an MDSip connection to an MDSplus server"""
@@ -221,7 +1272,8 @@ class Connection(object):
         try:
             conn = self._local.conn
         except AttributeError:
-            conn = self._local.conn = _Connection(self.hostspec)
+            conn = self._local.conn = _Connection(
+                self.hostspec, self.compression)
         return conn
 
     @conn.deleter
@@ -243,11 +1295,36 @@ class Connection(object):
         """ Cleanup for with statement. """
         self.disconnect()
 
-    def __init__(self, hostspec):
+    compression = None
+    cache = None
+    metrics = None
+
+    def __init__(self, hostspec, compression=None):
+        """
+        @param hostspec: mdsip server to connect to
+        @type hostspec: str
+        @param compression: zlib level 0-9 of the messages of both sides,
+        the level of the server applies to all its clients, 'auto' to
+        choose it per request argument, or None to keep the default
+        @type compression: int or str
+        """
         self._local = threading.local()
         self.hostspec = hostspec
+        self.compression = compression
         self.connect()
 
+    def compressionStats(self):
+        """Return the byte counters of the connection of this thread:
+        raw_sent and raw_received count the payload bytes, estimate_sent
+        and estimate_received estimate them on the wire from sampled
+        compression ratios as the client library does not report them.
+        @rtype: dict
+        """
+        cmp = self.conn._compression
+        if cmp is None:
+            raise MdsIpException("Compression has not been configured")
+        return dict(cmp.counters)
+
     def connect(self):
         self.conn.connect()
 
@@ -258,11 +1335,45 @@ class Connection(object):
         self.disconnect()
         self.connect()
 
+    def enableCache(self, max_entries=1024, max_bytes=1 << 28, directory=None,
+                    cache=None):
+        """Cache the results of get, see ResultCache. Use it for expressions
+        that only read tree data of a pulse opened with openTree.
+        @param cache: ResultCache to use, e.g. one shared by connections,
+        otherwise one is created with the other arguments
+        @type cache: ResultCache
+        @rtype: ResultCache
+        """
+        if cache is None:
+            cache = ResultCache(max_entries, max_bytes, directory)
+        self.cache = cache
+        return cache
+
+    def disableCache(self):
+        self.cache = None
+
+    def enableMetrics(self, maxlen=10000, stats=None):
+        """Record timing and size of each request, see RequestStats
+        @param stats: RequestStats to record to, e.g. one shared by
+        connections, otherwise one is created keeping maxlen requests
+        @type stats: RequestStats
+        @rtype: RequestStats
+        """
+        if stats is None:
+            stats = RequestStats(maxlen)
+        self.metrics = stats
+        return stats
+
+    def disableMetrics(self):
+        self.metrics = None
+
     def closeAllTrees(self):
         """Close all open MDSplus trees
         @rtype: number of closed trees
         """
-        self.get("_i=0;WHILE(IAND(TreeClose(),1)) _i++;_i")
+        conn = self.conn
+        conn._tree = conn._default = None
+        self.get("_i=0;WHILE(IAND(TreeClose(),1)) _i++;_i", cache=False)
 
     def closeTree(self, tree, shot):
         """Close an MDSplus tree on the remote server
@@ -272,7 +1383,10 @@ class Connection(object):
         @type shot: int
         @rtype: None
         """
-        _exc.checkStatus(self.get("TreeClose($,$)", arglist=(tree, shot)))
+        conn = self.conn
+        conn._tree = conn._default = None
+        _exc.checkStatus(self.get("TreeClose($,$)", arglist=(tree, shot),
+                                  cache=False))
 
     def getMany(self):
         """Return instance of a connection.GetMany class. See the connection.GetMany documentation for further information."""
@@ -286,7 +1400,10 @@ class Connection(object):
         @type shot: int
         @rtype: None
         """
-        _exc.checkStatus(self.get("TreeOpen($,$)", tree, shot))
+        conn = self.conn
+        conn._tree = conn._default = None
+        _exc.checkStatus(self.get("TreeOpen($,$)", tree, shot, cache=False))
+        conn._tree = (str(tree), int(shot))
 
     def put(self, node, exp, *args):
         """Put data into a node in an MDSplus tree
@@ -300,7 +1417,7 @@ class Connection(object):
         """
         pexp = 'TreePut($,$%s)' % (',$'*len(args),)
         pargs = [node, exp] + list(args)
-        _exc.checkStatus(self.get(pexp, arglist=pargs))
+        _exc.checkStatus(self.get(pexp, arglist=pargs, cache=False))
 
     def putMany(self, value=None):
         """Return an instance of a connection.PutMany class. See the connection.PutMany documentation for further information."""
@@ -312,11 +1429,222 @@ class Connection(object):
         @type exp: str
         @param args: optional arguments to be inserted for the placeholders in the expression.
         @type args: Data
-        @param kwargs: Used for internal purposes
+        @param kwargs: Used for internal purposes, cache=False bypasses the cache
         @return: result of evaluating the expression on the remote server
         @rtype: Scalar or Array
         """
-        return self.conn.get(exp, *args, **kwargs)
+        if self.metrics is not None:
+            kwargs['metrics'] = self.metrics
+        cache = self.cache if kwargs.pop('cache', True) else None
+        if cache is None:
+            return self.conn.get(exp, *args, **kwargs)
+        conn = self.conn
+        key = cache.key(self.hostspec, conn._tree, conn._default, exp,
+                        kwargs.get('arglist', args))
+        if key is None:
+            return conn.get(exp, *args, **kwargs)
+        value = cache.get(key)
+        if value is None:
+            value = conn.get(exp, *args, **kwargs)
+            cache.put(key, value)
+        return value
+
+    def get_into(self, exp, out, *args, **kwargs):
+        """Evaluate an expression on the remote server and copy the answer
+        into an array instead of creating a new Array
+        @param exp: TDI expression to be evaluated
+        @type exp: str
+        @param out: numpy array of the dtype and size of the answer or a
+        BufferPool to take it from
+        @type out: numpy.ndarray or BufferPool
+        @param args: optional arguments to be inserted for the placeholders in the expression.
+        @type args: Data
+        @return: out or the array taken from the BufferPool
+        @rtype: numpy.ndarray
+        """
+        return self.conn.get_into(exp, out, args, kwargs.get('timeout', -1),
+                                  self.metrics)
+
+    _stream_ids = itertools.count(1)  # next() is atomic
+
+    def stream(self, exp, *args, **kwargs):
+        """Evaluate an expression on the remote server and fetch the result
+        in chunks of rows, i.e. slices along the first numpy axis.
+        If exp is the path of a segmented node the segments are read one at
+        a time and chunks do not span segments. This way neither the server
+        nor a message has to hold more than a segment, so records larger
+        than the 4GB limit of a single transfer can be read.
+        @param exp: TDI expression or path of a segmented node
+        @type exp: str
+        @param args: optional arguments to be inserted for the placeholders in the expression.
+        @type args: Data
+        @param chunk_bytes: maximum size of a chunk, None for whole segments
+        @type chunk_bytes: int
+        @param progress: called with (bytes done, bytes total) after each chunk,
+        total is None for segmented nodes
+        @type progress: callable
+        @param segments: True for a segmented node, None to detect it
+        @type segments: bool
+        @return: generator of numpy arrays
+        """
+        chunk_bytes = kwargs.get('chunk_bytes', 1 << 26)
+        progress = kwargs.get('progress', None)
+        segments = kwargs.get('segments', None)
+        var = '_stream_%x_%d' % (id(self), next(Connection._stream_ids))
+        if segments is None:
+            try:
+                segments = not args and int(self.get('GetNumSegments($)', exp)) > 0
+            except _exc.MDSplusException:
+                segments = False
+        if segments:
+            num = int(self.get('GetNumSegments($)', exp))
+            loads = (("%s=data(GetSegment($,$))" % var, (exp, idx))
+                     for idx in range(num))
+        else:
+            loads = iter((("%s=data(%s)" % (var, exp), args),))
+        return self._stream(var, loads, chunk_bytes, progress, not segments)
+
+    def _stream(self, var, loads, chunk_bytes, progress, total):
+        done = 0
+        try:
+            for load, args in loads:
+                info = self.get('%s;[len(%s),shape(%s)]' % (load, var, var),
+                                *args).data().tolist()
+                length, dims = info[0], info[1:]
+                if not dims:
+                    chunk = self.get(var).data()
+                    done += length
+                    if progress is not None:
+                        progress(done, done if total else None)
+                    yield chunk
+                    continue
+                rows, row_bytes = dims[-1], length
+                for dim in dims[:-1]:
+                    row_bytes *= dim
+                step = rows if not chunk_bytes or not row_bytes else max(
+                    1, chunk_bytes // row_bytes)
+                sub = '%s[%s%%d:%%d]' % (var, '*,'*(len(dims)-1))
+                for lo in range(0, rows, step):
+                    hi = min(rows, lo+step)
+                    chunk = self.get(sub % (lo, hi-1)).data()
+                    done += (hi-lo)*row_bytes
+                    if progress is not None:
+                        progress(done, rows*row_bytes if total else None)
+                    yield chunk
+        finally:
+            try:
+                self.get('deallocate($)', var, cache=False)
+            except Exception:
+                pass
+
+    _segment_times = ("_n=0;_s=*;_e=*;GetSegmentTimes($,_n,_s,_e);"
+                      "[data(_s),data(_e)]")
+    _segment = "serializeout(`(GetSegment($,$);))"
+    _segment_minmax = (
+        "serializeout(`(_s=GetSegment($,$);_d=data(_s);_t=data(dim_of(_s));"
+        "_n=min($,size(_d));_m=size(_d)/_n;"
+        "_r=set_range(_n,_m,_d[0:_n*_m-1]);"
+        "_t=set_range(_n,_m,_t[0:_n*_m-1]);"
+        "make_signal([minval(_r,0),maxval(_r,0)],*,minval(_t,0));))")
+
+    def iterSegments(self, tree, shot, node, t0=None, t1=None, decimate=None,
+                     window=4):
+        """Read the segments of a node lazily, keeping up to window requests
+        in flight. For tcp servers the requests are sent on a Pipeline, for
+        other protocols they are read one by one on a separate connection.
+        Neither changes the open trees of this connection.
+        @param tree: name of the tree
+        @type tree: str
+        @param shot: shot number
+        @type shot: int
+        @param node: path of the segmented node
+        @type node: str
+        @param t0: start of the time window, None for the first segment
+        @type t0: float
+        @param t1: end of the time window, None for the last segment
+        @type t1: float
+        @param decimate: number of samples reduced to a min/max pair on
+        the server, samples of an incomplete last block are dropped
+        @type decimate: int
+        @param window: number of segments requested ahead
+        @type window: int
+        @return: generator of Signals clipped to the time window, the data
+        of decimated ones is [min,max] per block
+        """
+        try:
+            requests = Pipeline(self.hostspec, depth=max(1, window))
+            request = requests.get
+        except MdsIpException:
+            requests = Connection(self.hostspec)
+
+            def request(exp, *args):
+                return _SerialResult(requests, exp, args)
+        try:
+            _exc.checkStatus(
+                request("TreeOpen($,$)", tree, shot).result())
+            times = request(self._segment_times, node).result().data()
+        except Exception:
+            self._closeRequests(requests)
+            raise
+        num = len(times)//2
+        start, end = times[:num], times[num:]
+        mask = numpy.ones(num, bool)
+        if t0 is not None:
+            mask &= end >= t0
+        if t1 is not None:
+            mask &= start <= t1
+        return self._iterSegments(requests, request, node, numpy.nonzero(mask)[0],
+                                  t0, t1, decimate, max(1, window))
+
+    def _iterSegments(self, requests, request, node, indices, t0, t1,
+                      decimate, window):
+        def send(idx):
+            if decimate:
+                return request(self._segment_minmax, node, int(idx),
+                               int(decimate))
+            return request(self._segment, node, int(idx))
+        pending = []
+        try:
+            indices = iter(indices)
+            for idx in indices:
+                pending.append(send(idx))
+                if len(pending) >= window:
+                    break
+            while pending:
+                sig = pending.pop(0).result().deserialize()
+                for idx in indices:
+                    pending.append(send(idx))
+                    break
+                yield self._clip(sig, t0, t1)
+        finally:
+            self._closeRequests(requests)
+
+    @staticmethod
+    def _closeRequests(requests):
+        if isinstance(requests, Pipeline):
+            requests.close()
+        else:
+            requests.disconnect()
+
+    @staticmethod
+    def _clip(sig, t0, t1):
+        if t0 is None and t1 is None:
+            return sig
+        dim = sig.dim_of().data()
+        mask = numpy.ones(dim.shape, bool)
+        if t0 is not None:
+            mask &= dim >= t0
+        if t1 is not None:
+            mask &= dim <= t1
+        if mask.all():
+            return sig
+        return _cmp.Signal(sig.data()[..., mask], None, dim[mask])
+
+    def pipeline(self, depth=64, timeout=None):
+        """Return a Pipeline to the same server, see Pipeline
+        @rtype: Pipeline
+        """
+        return Pipeline(self.hostspec, depth, timeout)
 
     def getObject(self, exp, *args, **kwargs):
         return self.get('serializeout(`(%s;))' % exp, *args, **kwargs).deserialize()
@@ -327,13 +1655,289 @@ class Connection(object):
         @type path: str
         @rtype: None
         """
-        _exc.checkStatus(self.get("TreeSetDefault($)", path))
+        conn = self.conn
+        _exc.checkStatus(self.get("TreeSetDefault($)", path, cache=False))
+        conn._default = str(path)
 
     def GetMany(self): return GetMany(self)
 
     def PutMany(self): return PutMany(self)
 
 
+class _PoolEntry(object):
+    """A pooled _SocketConnection and the server side state set through it"""
+
+    def __init__(self, hostspec):
+        self.conn = _SocketConnection(hostspec)
+        self.tree = None
+        self.default = None
+        self.last_used = time.time()
+
+
+class PooledConnection(Connection):
+    """Connection leased from a ConnectionPool.
+    All threads using this instance share its socket. Use it as a context
+    manager or call release() to return the socket to the pool."""
+
+    def __init__(self, pool, entry):
+        self.hostspec = pool.hostspec
+        self._pool = pool
+        self._entry = entry
+
+    @property
+    def _leased(self):
+        entry = self._entry
+        if entry is None:
+            raise MdsIpException("Connection has been released to the pool")
+        return entry
+
+    @property
+    def conn(self):
+        return self._leased.conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+    def __del__(self):
+        self.release()
+
+    def connect(self):
+        self.conn.connect()
+
+    def disconnect(self):
+        """Close the socket and drop it from the pool"""
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool._release(entry, discard=True)
+
+    def reconnect(self):
+        entry = self._leased
+        entry.conn.disconnect()
+        self._pool._restore(entry)
+
+    def release(self):
+        """Return the socket to the pool"""
+        entry, self._entry = getattr(self, '_entry', None), None
+        if entry is not None:
+            self._pool._release(entry)
+
+    def openTree(self, tree, shot):
+        super(PooledConnection, self).openTree(tree, shot)
+        entry = self._leased
+        entry.tree = (tree, int(shot))
+        entry.default = None
+
+    def closeTree(self, tree, shot):
+        entry = self._leased
+        entry.tree = entry.default = None
+        super(PooledConnection, self).closeTree(tree, shot)
+
+    def closeAllTrees(self):
+        entry = self._leased
+        entry.tree = entry.default = None
+        return super(PooledConnection, self).closeAllTrees()
+
+    def setDefault(self, path):
+        super(PooledConnection, self).setDefault(path)
+        self._leased.default = path
+
+
+class ConnectionPool(object):
+    """Pool of mdsip connections to one tcp server shared by threads.
+
+    pool = ConnectionPool('myserver', max_size=4)
+    with pool.lease(tree=('mytree', 123)) as con:
+        con.get('\\mytree::top:node')
+
+    The connections speak mdsip on their own sockets, see
+    _SocketConnection, as connections of the client library cannot be
+    passed between threads. Idle connections are checked with a trivial
+    request before they are leased again and reconnected if that fails. The open tree and default
+    node requested with lease() are only set if they differ from the state
+    the connection was left in.
+    """
+
+    def __init__(self, hostspec, max_size=8, idle_timeout=300., check_after=5.,
+                 check_timeout=2000):
+        """
+        @param hostspec: server to connect to
+        @type hostspec: str
+        @param max_size: maximum number of open connections
+        @type max_size: int
+        @param idle_timeout: idle connections are closed after that many seconds
+        @type idle_timeout: float
+        @param check_after: connections idle longer than that are checked on lease
+        @type check_after: float
+        @param check_timeout: timeout of the check in milliseconds
+        @type check_timeout: int
+        """
+        self.hostspec = hostspec
+        self.max_size = int(max_size)
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.check_timeout = check_timeout
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+        self._stats = dict.fromkeys((
+            'leases', 'created', 'reused', 'waits', 'checks', 'reconnects',
+            'restores', 'expired', 'discarded'), 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return 'ConnectionPool(%r, size=%d/%d, idle=%d)' % (
+            self.hostspec, self._size, self.max_size, len(self._idle))
+
+    def _count(self, key):
+        with self._cond:
+            self._stats[key] += 1
+
+    def stats(self):
+        """Return pool statistics
+        @rtype: dict
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['leased'] = self._size - len(self._idle)
+        return stats
+
+    def _expire(self, now):
+        """close idle connections beyond idle_timeout, call with lock held"""
+        if self.idle_timeout is None:
+            return []
+        expired = [e for e in self._idle if now - e.last_used > self.idle_timeout]
+        if expired:
+            self._idle = [e for e in self._idle if e not in expired]
+            self._size -= len(expired)
+            self._stats['expired'] += len(expired)
+        return expired
+
+    def _acquire(self, timeout):
+        deadline = None if timeout is None else time.time()+timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise MdsIpException("ConnectionPool has been closed")
+                expired = self._expire(time.time())
+                if self._idle:
+                    entry = self._idle.pop()  # most recently used first
+                    self._stats['reused'] += 1
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    entry = None
+                    break
+                self._stats['waits'] += 1
+                remaining = None if deadline is None else deadline-time.time()
+                if remaining is not None and remaining <= 0:
+                    raise MdsIpException(
+                        "Timeout waiting for a connection to %s" % (self.hostspec,))
+                self._cond.wait(remaining)
+            self._stats['leases'] += 1
+        for e in expired:
+            e.conn.disconnect()
+        if entry is None:
+            try:
+                entry = _PoolEntry(self.hostspec)
+                entry.conn.connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            self._count('created')
+        return entry
+
+    def _check(self, entry):
+        """make sure an idle connection is still alive"""
+        if time.time() - entry.last_used < self.check_after:
+            return
+        self._count('checks')
+        try:
+            entry.conn.get('1', timeout=self.check_timeout)
+        except Exception:
+            entry.conn.disconnect()
+            self._count('reconnects')
+            self._restore(entry)
+
+    def _restore(self, entry):
+        """reconnect and reapply the state of a broken connection"""
+        entry.conn.connect()
+        tree, default = entry.tree, entry.default
+        entry.tree = entry.default = None
+        if tree is not None:
+            self._count('restores')
+            self._setState(entry, tree, default)
+
+    def _setState(self, entry, tree, default):
+        con = PooledConnection(self, entry)
+        try:
+            if tree is not None and entry.tree != (tree[0], int(tree[1])):
+                con.openTree(*tree)
+            if default is not None and entry.default != default:
+                con.setDefault(default)
+        finally:
+            con._entry = None  # do not release the entry
+
+    def lease(self, tree=None, default=None, timeout=None):
+        """Lease a connection
+        @param tree: optional (tree, shot) that should be open on the connection
+        @type tree: tuple
+        @param default: optional default node path to set
+        @type default: str
+        @param timeout: seconds to wait for a free connection, None waits forever
+        @type timeout: float
+        @rtype: PooledConnection
+        """
+        entry = self._acquire(timeout)
+        try:
+            self._check(entry)
+            self._setState(entry, tree, default)
+        except Exception:
+            self._release(entry, discard=True)
+            raise
+        return PooledConnection(self, entry)
+
+    def get(self, exp, *args, **kwargs):
+        """Evaluate an expression on a leased connection"""
+        with self.lease() as con:
+            return con.get(exp, *args, **kwargs)
+
+    def _release(self, entry, discard=False):
+        entry.last_used = time.time()
+        with self._cond:
+            discard = discard or self._closed
+            if discard:
+                self._size -= 1
+                self._stats['discarded'] += 1
+            else:
+                self._idle.append(entry)
+            self._cond.notify()
+        if discard:
+            entry.conn.disconnect()
+
+    def close(self):
+        """Close all idle connections, leased ones are closed on release"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._closed = True
+            self._cond.notify_all()
+        for entry in idle:
+            entry.conn.disconnect()
+
+
 class GetMany(_apd.List):
     """Build a list of expressions to evaluate
 
@@ -359,13 +1963,15 @@ class GetMany(_apd.List):
     maximum size of the expression list with arguments and the result dictionary is approximately 4 gigatypes.
     """
 
+    _connection_class = Connection
+
     def __init__(self, connection):
         """Instance initialization"""
         super(GetMany, self).__init__()
-        if isinstance(connection, Connection):
+        if isinstance(connection, self._connection_class):
             self.connection = connection
         else:
-            self.connection = Connection(connection)
+            self.connection = self._connection_class(connection)
         self.result = None
 
     def append(self, name, exp, *args):
@@ -450,16 +2056,203 @@ class GetMany(_apd.List):
         raise MdsIpException("Item %s not found in list" % (name,))
 
 
+class _ServerWorker(threading.Thread):
+    """Thread owning the connection to one server of a MultiGetMany.
+    Connections of the client library are only valid in the thread that
+    opened them, so all requests to the server are made by this thread."""
+
+    def __init__(self, server, key):
+        super(_ServerWorker, self).__init__(name='MultiGetMany(%s)' % (key,))
+        self.daemon = True
+        self.server = server
+        self.key = key
+        self.jobs = _queue.Queue()
+
+    def run(self):
+        conn = None
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            if conn is None:
+                if isinstance(self.server, Connection):
+                    conn = self.server.conn  # this thread's connection
+                else:  # connects on first use
+                    conn = _Connection(self.server)
+            self._execute(conn, *job)
+        if isinstance(self.server, Connection):
+            del(self.server.conn)
+        elif conn is not None:
+            conn.disconnect()
+
+    def _execute(self, conn, lst, timeout, answers):
+        try:
+            ans = conn.get("GetManyExecute($)", lst,
+                           timeout=-1 if timeout is None else int(timeout*1000))
+            if isinstance(ans, str):
+                raise MdsIpException("Error fetching data: "+ans)
+            answers.put((self.key, ans.deserialize()))
+        except Exception as exc:
+            try:  # an answer may still be on its way
+                conn.disconnect()
+            except Exception:
+                pass
+            answers.put((self.key, exc))
+
+    def stop(self):
+        self.jobs.put(None)
+
+
+class MultiGetMany(object):
+    """GetMany spanning several mdsip servers.
+
+    mgm = MultiGetMany(timeout=10.)
+    mgm.append('server1', 'ip', '\\mytree::ip')
+    mgm.append('server2:8001', 'ne', '\\archive::ne')
+    mgm.execute()
+    ip = mgm.get('ip')
+
+    The expressions are grouped by server and each group is evaluated with
+    GetManyExecute by a worker thread of that server, which keeps its
+    connection open between calls of execute() until close(). Names must
+    be unique over all servers. If a server fails or does not answer within
+    timeout the entries of that server get an 'error' entry and the reason
+    is listed in errors. Servers given as Connection are reached through
+    the connection of the worker thread, i.e. server side state like open
+    trees set by the calling thread does not apply.
+    """
+
+    def __init__(self, timeout=None):
+        """
+        @param timeout: default timeout in seconds per server
+        @type timeout: float
+        """
+        self.timeout = timeout
+        self._servers = {}
+        self._workers = {}
+        self._lists = {}
+        self._hosts = {}
+        self._timeouts = {}
+        self.result = None
+        self.errors = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Stop the worker threads and close their connections"""
+        workers, self._workers = getattr(self, '_workers', {}), {}
+        for worker in workers.values():
+            worker.stop()
+
+    def _key(self, server):
+        if isinstance(server, Connection):
+            key = server.hostspec
+            self._servers.setdefault(key, server)
+        else:
+            key = server
+            self._servers.setdefault(key, key)
+        return key
+
+    def setTimeout(self, server, timeout):
+        """Set the timeout in seconds of one server"""
+        self._timeouts[self._key(server)] = timeout
+
+    def append(self, server, name, exp, *args):
+        """Append expression to the list of a server.
+        @param server: hostspec or Connection of the server
+        @type server: str or Connection
+        @param name: name to assign to the expression for identifying it in the result dictionary.
+        @type name: str
+        @param exp: expression to be evaluated with placeholders for optional arguments
+        @type exp: str
+        @param args: optional arguments to replace placeholders in the expression
+        @type args: Data
+        @rtype: None
+        """
+        name = str(name)
+        if name in self._hosts:
+            raise MdsIpException("Name %s is already in use" % (name,))
+        key = self._key(server)
+        if key not in self._lists:
+            self._lists[key] = _apd.List()
+        self._lists[key].append(_apd.Dictionary(
+            {'name': name, 'exp': str(exp), 'args': args}))
+        self._hosts[name] = key
+
+    def remove(self, name):
+        """Remove the expression identified by its name"""
+        key = self._hosts.pop(str(name), None)
+        if key is None:
+            raise MdsIpException("Item %s not found in list" % (name,))
+        lst = self._lists[key]
+        for item in lst:
+            if item['name'] == str(name):
+                lst.remove(item)
+                return
+
+    def execute(self):
+        """Evaluate the lists on all servers concurrently and return the merged answer as a dict instance."""
+        answers, pending = _queue.Queue(), 0
+        for key, lst in self._lists.items():
+            if not len(lst):
+                continue
+            worker = self._workers.get(key)
+            if worker is None:
+                worker = _ServerWorker(self._servers[key], key)
+                worker.start()
+                self._workers[key] = worker
+            worker.jobs.put((lst.serialize(),
+                             self._timeouts.get(key, self.timeout), answers))
+            pending += 1
+        answers = dict(answers.get() for _ in range(pending))
+        self.result, self.errors = _apd.Dictionary(), {}
+        for key, lst in self._lists.items():
+            ans = answers.get(key)
+            if isinstance(ans, Exception):
+                self.errors[key] = str(ans)
+                for item in lst:
+                    self.result[item['name']] = _apd.Dictionary(
+                        {'error': '%s: %s' % (key, ans)})
+            elif ans is not None:
+                for item in lst:
+                    self.result[item['name']] = ans[item['name']]
+        return self.result
+
+    def get(self, name):
+        """Get the result of an expression identified by name from the last invokation of the execute() method.
+        @param name: name associated with an expression.
+        @type name: str
+        @return: result of the expression evaluation.
+        @rtype: Scalar or Array
+        """
+        if self.result is None:
+            raise MdsIpException(
+                "MultiGetMany has not yet been executed. Use the execute() method on this object first.")
+        if 'value' in self.result[name]:
+            return self.result[name]['value']
+        else:
+            raise MdsIpException(self.result[name]['error'])
+
+
 class PutMany(_apd.List):
     """Build list of put instructions."""
 
+    _connection_class = Connection
+
     def __init__(self, connection):
         """Instance initialization"""
         super(PutMany, self).__init__()
-        if isinstance(connection, Connection):
+        if isinstance(connection, self._connection_class):
             self.connection = connection
         else:
-            self.connection = Connection(connection)
+            self.connection = self._connection_class(connection)
         self.result = None
 
     def append(self, node, exp, *args):
@@ -510,7 +2303,8 @@ class PutMany(_apd.List):
                     self.result[node] = str(exc)
             return self.result
         else:
-            ans = self.connection.get("PutManyExecute($)", self.serialize())
+            ans = self.connection.get("PutManyExecute($)", self.serialize(),
+                                      cache=False)
         if isinstance(ans, str):
             raise MdsIpException("Error putting any data: "+ans)
         self.result = ans.deserialize()
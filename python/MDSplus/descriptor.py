@@ -25,6 +25,7 @@
 
 
 import ctypes as _C
+import numpy as _N
 
 
 def _mimport(name, level=1):
@@ -181,12 +182,33 @@ class DescriptorS(Descriptor):
             return dtypeToClass[self.dtype].fromDescriptor(self)._setTree(self.tree)
 
 
-class DescriptorD(DescriptorS):
-    dclass_id = 2
+class _DynamicDescriptor(object):
+    """Descriptors owning dynamic memory allocated by MdsShr.
+    The memory is freed on garbage collection or deterministically with
+    release() or by using the descriptor as a context manager:
 
-    def __del__(self):
+    with DescriptorXD() as xd:
+        _exc.checkStatus(func(xd.ref))
+        value = xd.value
+    """
+
+    def release(self):
+        """Free the dynamic memory now. The descriptor can be reused."""
         _MdsShr.MdsFree1Dx(self.ptr, 0)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __del__(self):
+        self.release()
+
+
+class DescriptorD(_DynamicDescriptor, DescriptorS):
+    dclass_id = 2
+
 
 class DescriptorXS(DescriptorS):
     dclass_id = 193
@@ -217,13 +239,10 @@ class DescriptorXS(DescriptorS):
     def l_length(self, value): self._structure.l_length = value
 
 
-class DescriptorXD(DescriptorXS):
+class DescriptorXD(_DynamicDescriptor, DescriptorXS):
     dclass_id = 192
     dtype_dsc = 24
 
-    def __del__(self):
-        _MdsShr.MdsFree1Dx(self.ptr, 0)
-
 
 class DescriptorR(DescriptorS):
     dclass_id = 194
@@ -370,6 +389,31 @@ class DescriptorA(Descriptor):
     def size(self):
         return self._structure.arsize // self._structure.length
 
+    @property
+    def shape(self):
+        """numpy shape of the array (slowest varying dimension first)"""
+        if self.coeff:
+            return tuple(self.coeff_and_bounds[self.dimct-1::-1])
+        if self.length == 0:
+            return (0,)
+        return (self.arsize // self.length,)
+
+    def _as_numpy(self):
+        """Return a numpy view on the memory of the array without creating
+        an Array instance or None if the dtype has no native numpy type.
+        The view shares the buffer of the descriptor and must not be used
+        after the buffer has been freed."""
+        cls = dtypeToArrayClass.get(self.dtype, None)
+        ntype = getattr(cls, 'ntype', None)
+        if ntype is None or cls.ctype is None or not self.pointer:
+            return None
+        shape = self.shape
+        count = 1
+        for dim in shape:
+            count *= dim
+        buf = _C.cast(self.pointer, _C.POINTER(cls.ctype*count)).contents
+        return _N.ndarray(shape, ntype, buf)
+
 
 class DescriptorCA(DescriptorA):
     dclass_id = 195
@@ -31,11 +31,21 @@ def _mimport(name, level=1):
         return __import__(name, globals())
 
 
+import collections as _collections
+import errno as _errno
+import os as _os
 import time as _time
 import threading as _threading
 import ctypes as _C
 import numpy as _N
 import json
+import select as _select
+import socket as _socket
+import struct as _struct
+try:
+    import queue as _queue
+except ImportError:
+    import Queue as _queue
 
 _dat = _mimport('mdsdata')
 _arr = _mimport('mdsarray')
@@ -114,6 +124,7 @@ the e.join() would return exiting the problem.
 
 
 """
+    history = None
 
     def getData(self):
         """Return data transfered with the event.
@@ -178,28 +189,54 @@ the e.join() would return exiting the problem.
         if not ((status & 1) == 1):
             raise _exc.MDSplusException(status)
 
+    @staticmethod
+    def enableHistory(maxlen=64, max_names=256):
+        """Keep the latest occurrences of the events of this process
+        @param maxlen: number of occurrences kept per event name
+        @type maxlen: int
+        @param max_names: maximum number of tracked event names
+        @type max_names: int
+        @rtype: EventHistory
+        """
+        if Event.history is None:
+            Event.history = EventHistory(maxlen, max_names=max_names)
+        return Event.history
+
+    @staticmethod
+    def disableHistory():
+        if Event.history is not None:
+            Event.history.close()
+            Event.history = None
+
+    @staticmethod
+    def since(event, time=0):
+        """Occurrences of an event after time, requires enableHistory
+        @param event: event name
+        @type event: str
+        @param time: seconds since the epoch, as in EventMessage.time
+        @type time: float
+        @rtype: list of EventMessage
+        """
+        if Event.history is None:
+            raise MdsshrException("Event history is not enabled")
+        return Event.history.since(event, time)
+
     @staticmethod
     def wfeventRaw(event, timeout=0):
-        """Wait for an event
+        """Wait for an event, the data may be of any size
         @param event: event name
         @rtype: Data
         """
-        buffer = _N.uint8(0).repeat(repeats=4096)
-        numbytes = _C.c_int32(0)
-        status = _MdsShr.MDSWfeventTimed(_ver.tobytes(event),
-                                         _C.c_int32(len(buffer)),
-                                         _C.c_void_p(buffer.ctypes.data),
-                                         _C.pointer(numbytes),
-                                         _C.c_int32(timeout))
-        if (status & 1):
-            if numbytes.value == 0:
-                return _sca.Uint8([])
-            else:
-                return _arr.Uint8Array(buffer[0:numbytes.value])
-        elif (status == 0):
+        eventid = Event.queueEvent(event)
+        try:
+            raw = Event._getQueue(eventid, timeout)
+        except MdsTimeout:
             raise MdsTimeout("Event %s timed out." % (_ver.tostr(event),))
-        else:
-            raise _exc.MDSplusException(status)
+        finally:
+            _MdsShr.MDSEventCan(_C.c_int32(eventid))
+        if len(raw) == 0:
+            return _sca.Uint8([])
+        return raw
 
     @staticmethod
     def wfevent(event, timeout=0):
@@ -261,6 +298,13 @@ the e.join() would return exiting the problem.
         Event.seteventRaw(signal, _N.uint8(bytearray(payload, 'utf8')))
 
     def getQueue(self):
+        """Retrieve event occurrence.
+        @rtype: Uint8Array
+        """
+        return self._getQueue(self.eventid, self.timeout)
+
+    @staticmethod
+    def _getQueue(eventid, timeout):
         """Retrieve event occurrence.
         @param eventid: eventid returned from MDSQueueEvent function
         @type eventid: int
@@ -274,8 +318,8 @@ the e.join() would return exiting the problem.
         """
         dlen = _C.c_int32(0)
         bptr = _C.c_void_p(0)
-        status = _MdsShr.MDSGetEventQueue(_C.c_int32(self.eventid), _C.c_int32(
-            self.timeout), _C.pointer(dlen), _C.pointer(bptr))
+        status = _MdsShr.MDSGetEventQueue(_C.c_int32(eventid), _C.c_int32(
+            timeout), _C.pointer(dlen), _C.pointer(bptr))
         if status == 1:
             if dlen.value > 0:
                 ans = _arr.Uint8Array(_N.ndarray(shape=[dlen.value], buffer=_ver.buffer(
@@ -285,7 +329,7 @@ the e.join() would return exiting the problem.
             else:
                 return _arr.Uint8Array([])
         elif status == 0:
-            if self.timeout > 0:
+            if timeout > 0:
                 raise MdsTimeout("Timeout")
             else:
                 raise _exc.MdsNoMoreEvents("No more events")
@@ -323,7 +367,746 @@ the e.join() would return exiting the problem.
         self.exception = None
         self.timeout = timeout
         self.eventid = self.queueEvent(event)
+        if Event.history is not None:
+            Event.history.track(event)
         self.subclass_run = self.run
         self.run = self._event_run
         self.setDaemon(True)
         self.start()
+
+
+def _event_name(name):
+    """event names are case insensitive and ignore blanks"""
+    return _ver.tostr(name).replace(' ', '').upper()
+
+
+class _UdpSettings(object):
+    """Port and multicast addresses of UDP events as configured for MdsShr"""
+    _instance = None
+
+    def __init__(self):
+        port = _C.c_ushort(0)
+        _MdsShr.UdpEventGetPort(_C.byref(port))
+        self.port = port.value
+        fmt = _C.c_char_p()
+        arange = (_C.c_ubyte*2)()
+        _MdsShr.UdpEventGetAddress(_C.byref(fmt), arange)
+        self.address = _ver.tostr(fmt.value)
+        _MdsShr.MdsFree(_C.cast(fmt, _C.c_void_p))
+        self.lower, self.upper = arange[0], arange[1]
+        ttl = _C.c_ubyte(0)
+        self.ttl = ttl.value if _MdsShr.UdpEventGetTtl(_C.byref(ttl)) else None
+        loop = _C.c_ubyte(0)
+        self.loop = loop.value if _MdsShr.UdpEventGetLoop(
+            _C.byref(loop)) else None
+        interface = _C.c_void_p()
+        if _MdsShr.UdpEventGetInterface(_C.byref(interface)):
+            self.interface = _C.string_at(interface, 4)
+            _MdsShr.MdsFree(interface)
+        else:
+            self.interface = None
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def group(self, name):
+        """multicast address of an event, see getMulticastAddr in UdpEvents.c"""
+        name = _ver.tobytes(name)
+        total = 0
+        for c in bytearray(name):
+            total += c if c < 128 else c-256  # char is signed
+        total &= 0xffffffff
+        idx = int(self.lower + (total % 256)/256. *
+                  (self.upper-self.lower+1.))
+        return self.address % idx
+
+
+def _event_socket(port):
+    """UDP socket bound to the event port, shared with other receivers"""
+    sock = _socket.socket(_socket.AF_INET, _socket.SOCK_DGRAM)
+    sock.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEADDR, 1)
+    if hasattr(_socket, 'SO_REUSEPORT'):
+        try:
+            sock.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEPORT, 1)
+        except _socket.error:
+            pass
+    try:  # room for the fragments of large payloads, capped by the kernel
+        # e.g. at net.core.rmem_max on linux
+        sock.setsockopt(_socket.SOL_SOCKET, _socket.SO_RCVBUF, 1 << 20)
+    except _socket.error:
+        pass
+    sock.bind(('', port))
+    return sock
+
+
+def _membership(sock, group, add):
+    """join or leave the multicast group of an event"""
+    mreq = _struct.pack('4s4s', _socket.inet_aton(group),
+                        _socket.inet_aton('0.0.0.0'))
+    sock.setsockopt(
+        _socket.IPPROTO_IP,
+        _socket.IP_ADD_MEMBERSHIP if add else _socket.IP_DROP_MEMBERSHIP,
+        mreq)
+
+
+class _Memberships(object):
+    """Reference counted multicast memberships of a receiving socket.
+    Linux allows net.ipv4.igmp_max_memberships groups per socket, 20 by
+    default, and fails with ENOBUFS beyond. As memberships are held by the
+    host, the socket bound to the event port also receives the datagrams of
+    the groups joined by other sockets (IP_MULTICAST_ALL), so further groups
+    are joined on extra sockets that are never read."""
+
+    def __init__(self, sock):
+        self.socket = sock
+        self._extra = []
+        self._groups = {}  # group: [socket holding the membership, count]
+
+    def __len__(self):
+        return len(self._groups)
+
+    def _join(self, group):
+        for sock in [self.socket] + self._extra:
+            try:
+                _membership(sock, group, True)
+            except _socket.error as exc:
+                if exc.errno != _errno.ENOBUFS:
+                    raise
+            else:
+                return sock
+        sock = _socket.socket(_socket.AF_INET, _socket.SOCK_DGRAM)
+        try:
+            _membership(sock, group, True)
+        except Exception:
+            sock.close()
+            raise
+        self._extra.append(sock)
+        return sock
+
+    def add(self, group):
+        entry = self._groups.get(group)
+        if entry is None:
+            entry = self._groups[group] = [self._join(group), 0]
+        entry[1] += 1
+
+    def remove(self, group):
+        entry = self._groups.get(group)
+        if entry is None:  # closed
+            return
+        entry[1] -= 1
+        if entry[1]:
+            return
+        del(self._groups[group])
+        sock = entry[0]
+        _membership(sock, group, False)
+        if sock is not self.socket and not any(
+                other[0] is sock for other in self._groups.values()):
+            self._extra.remove(sock)
+            sock.close()
+
+    def close(self):
+        """forget the memberships and close the extra sockets, the
+        socket itself is closed by its owner"""
+        extra, self._extra, self._groups = self._extra, [], {}
+        for sock in extra:
+            sock.close()
+
+
+class _Assembler(object):
+    """Parses UdpEvents messages, unpacks batches and reassembles the
+    fragments of large payloads, see UdpEvents.c"""
+    _fragment_flag = 0x80000000
+    _batch_flag = 0x40000000
+    _max_event_len = 0x4000000
+    _max_assemblies = 4
+    _max_msg_len = 4096
+
+    def __init__(self):
+        self._pending = []
+
+    def parse(self, msg, sender):
+        """list of (name, payload) of the complete events in msg"""
+        if len(msg) < 8:
+            return []
+        namelen = _struct.unpack('!I', msg[:4])[0]
+        if namelen & self._batch_flag:
+            return self._unpack(msg, namelen & ~self._batch_flag)
+        fragment = namelen & self._fragment_flag
+        namelen &= ~self._fragment_flag
+        if len(msg) < namelen+8:
+            return []
+        name = _ver.tostr(msg[4:4+namelen])
+        buflen = _struct.unpack('!I', msg[4+namelen:8+namelen])[0]
+        if fragment:
+            if len(msg) < namelen+16:
+                return []
+            msgid, offset = _struct.unpack('!II', msg[8+namelen:16+namelen])
+            return self._add(name, sender, msgid, buflen, offset,
+                             self._max_msg_len-16-namelen, msg[16+namelen:])
+        if len(msg) != namelen+buflen+8:
+            return []
+        return [(name, msg[8+namelen:])]
+
+    def _unpack(self, msg, count):
+        events, pos = [], 4
+        for _ in range(count):
+            if len(msg) < pos+4:
+                break
+            namelen = _struct.unpack('!I', msg[pos:pos+4])[0]
+            pos += 4
+            if len(msg) < pos+namelen+4:
+                break
+            name = _ver.tostr(msg[pos:pos+namelen])
+            pos += namelen
+            buflen = _struct.unpack('!I', msg[pos:pos+4])[0]
+            pos += 4
+            if len(msg) < pos+buflen:
+                break
+            events.append((name, msg[pos:pos+buflen]))
+            pos += buflen
+        return events
+
+    def _add(self, name, sender, msgid, total, offset, size, fragment):
+        """fragments are size bytes long except the last one, duplicates
+        are ignored"""
+        length = len(fragment)
+        if (total > self._max_event_len or offset+length > total or
+                size <= 0 or offset % size or
+                (length != size and offset+length != total)):
+            return []
+        key = (sender, msgid)
+        for assembly in self._pending:
+            if assembly[0] == key:
+                break
+        else:
+            if len(self._pending) >= self._max_assemblies:
+                del(self._pending[0])
+            assembly = [key, bytearray(total), 0, set()]
+            self._pending.append(assembly)
+        if len(assembly[1]) != total or offset in assembly[3]:
+            return []
+        assembly[3].add(offset)
+        assembly[1][offset:offset+length] = fragment
+        assembly[2] += length
+        if assembly[2] < total:
+            return []
+        self._pending.remove(assembly)
+        return [(name, assembly[1])]
+
+
+class EventMessage(object):
+    """One occurrence of an event received by an EventHub, the data is
+    deserialized on first access and shared by all receivers. It provides
+    the accessors of Event so handlers can be passed either."""
+    __slots__ = ('name', 'raw', 'time', '_data', '_qtime')
+    _months = ('JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
+               'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC')
+    exception = None
+
+    def __init__(self, name, raw, time):
+        self.name = name
+        self.raw = raw
+        self.time = time
+        self._data = self
+        self._qtime = None
+
+    def __repr__(self):
+        return 'EventMessage(%r, %d bytes)' % (self.name, len(self.raw))
+
+    def getName(self):
+        """@rtype: str"""
+        return self.name
+
+    def getTime(self):
+        """time of reception in seconds since the epoch
+        @rtype: float
+        """
+        return self.time
+
+    @property
+    def event(self):
+        return self.name
+
+    @property
+    def qtime(self):
+        return self.getQTime()
+
+    def getQTime(self):
+        """quadword time of reception, to the second as Event.qtime
+        @rtype: Uint64
+        """
+        if self._qtime is None:
+            tm = _time.localtime(self.time)
+            self._qtime = _mds.DateToQuad('%02d-%s-%04d %02d:%02d:%02d' % (
+                tm.tm_mday, self._months[tm.tm_mon - 1], tm.tm_year,
+                tm.tm_hour, tm.tm_min, tm.tm_sec))
+        return self._qtime
+
+    def getRaw(self):
+        """@rtype: Uint8Array"""
+        return _arr.Uint8Array(self.raw)
+
+    def getData(self):
+        """Return data transfered with the event.
+        @rtype: Data
+        """
+        if self._data is self:
+            if len(self.raw) == 0:
+                self._data = None
+            else:
+                self._data = self.getRaw().deserialize()
+        return self._data
+
+
+class EventHub(_threading.Thread):
+    """Receive any number of UDP events on one socket in one thread.
+
+    hub = EventHub()
+    hub.subscribe('shot_done', lambda msg: print(msg.name, msg.getData()))
+    frames = hub.queue('camera_frame', maxsize=16)
+    msg = frames.get()
+    hub.close()
+
+    In contrast to Event, which costs a thread and a socket in MdsShr per
+    instance, the hub joins the multicast group of each event name once on
+    a shared socket, see _Memberships for the limit of memberships per
+    socket, and dispatches the messages by name. Callbacks run in
+    the thread of the hub and should return quickly, the last exception
+    raised by a callback is kept in exception. Events forwarded by an
+    mds_event_server are not received.
+    """
+    _recv_size = 1 << 16
+
+    def __init__(self):
+        super(EventHub, self).__init__(name='EventHub')
+        self.daemon = True
+        self._settings = _UdpSettings.get()
+        self._subscribers = {}
+        self._lock = _threading.Lock()
+        self._closed = False
+        self.received = 0
+        self.dispatched = 0
+        self.exception = None
+        self._socket = _event_socket(self._settings.port)
+        self._groups = _Memberships(self._socket)
+        self._assembler = _Assembler()
+        self.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __len__(self):
+        """number of subscribed event names"""
+        return len(self._subscribers)
+
+    def subscribe(self, event, callback):
+        """Call callback(EventMessage) on each occurrence of event
+        @param event: name of the event
+        @type event: str
+        @param callback: function called in the thread of the hub
+        @type callback: callable
+        @return: callback, to be passed to unsubscribe
+        """
+        name = _event_name(event)
+        group = self._settings.group(name)
+        with self._lock:
+            if self._closed:
+                raise MdsshrException("EventHub is closed")
+            self._groups.add(group)
+            self._subscribers.setdefault(name, []).append(callback)
+        return callback
+
+    def unsubscribe(self, event, callback):
+        name = _event_name(event)
+        group = self._settings.group(name)
+        with self._lock:
+            callbacks = self._subscribers.get(name, [])
+            callbacks.remove(callback)
+            if not callbacks:
+                del(self._subscribers[name])
+            self._groups.remove(group)
+
+    def queue(self, event, maxsize=0):
+        """Return a queue.Queue receiving the EventMessages of event.
+        Messages are dropped while the queue is full.
+        @rtype: queue.Queue
+        """
+        events = _queue.Queue(maxsize)
+
+        def put(msg):
+            try:
+                events.put_nowait(msg)
+            except _queue.Full:
+                pass
+        events.callback = self.subscribe(event, put)
+        return events
+
+    def close(self):
+        """Stop the hub and close its socket"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self.is_alive() and _threading.current_thread() is not self:
+            self.join()
+        with self._lock:
+            self._groups.close()
+        self._socket.close()
+
+    def _dispatch(self, name, raw):
+        with self._lock:
+            callbacks = list(self._subscribers.get(name, ()))
+        if not callbacks:
+            return
+        msg = EventMessage(name, _N.frombuffer(raw, _N.uint8), _time.time())
+        for callback in callbacks:
+            try:
+                callback(msg)
+            except Exception as exc:
+                self.exception = exc
+        self.dispatched += 1
+
+    def run(self):
+        while not self._closed:
+            try:
+                ready = _select.select([self._socket], [], [], .1)[0]
+                if not ready:
+                    continue
+                msg, sender = self._socket.recvfrom(self._recv_size)
+            except (_socket.error, ValueError):
+                if self._closed:
+                    return
+                continue
+            self.received += 1
+            for name, raw in self._assembler.parse(msg, sender):
+                self._dispatch(name, raw)
+
+
+class EventHistory(object):
+    """Keep the latest occurrences of events to replay them to late
+    subscribers.
+
+    history = Event.enableHistory(maxlen=16)
+    history.track('shot_done')
+    ...
+    for msg in Event.since('shot_done', last_time):
+        last_time = msg.time
+
+    Occurrences are recorded by an EventHub from the time a name is
+    tracked. Event instances created while Event.history is enabled and
+    calls of since and wait track their names. Beyond max_names tracked
+    names the least recently used ones are untracked, unless a wait is
+    pending for them. Events forwarded by an mds_event_server are not
+    recorded.
+    """
+
+    def __init__(self, maxlen=64, hub=None, max_names=256):
+        """
+        @param maxlen: number of occurrences kept per event name
+        @type maxlen: int
+        @param hub: hub to receive the events, by default an own one
+        @type hub: EventHub
+        @param max_names: maximum number of tracked names, 0 for no limit
+        @type max_names: int
+        """
+        self.maxlen = maxlen
+        self.max_names = max_names
+        self._own_hub = hub is None
+        self._hub = EventHub() if hub is None else hub
+        self._history = _collections.OrderedDict()
+        self._waiting = {}
+        self._lock = _threading.Lock()
+        self._cond = _threading.Condition(self._lock)
+
+    def __len__(self):
+        """number of tracked event names"""
+        return len(self._history)
+
+    def track(self, event):
+        """Start recording the occurrences of event, or mark it as recently
+        used if it is tracked already"""
+        name = _event_name(event)
+        with self._lock:
+            history = self._history.pop(name, None)
+            if history is not None:
+                self._history[name] = history  # most recently used
+                return
+            self._history[name] = _collections.deque(maxlen=self.maxlen)
+            evicted = []
+            if self.max_names:
+                excess = len(self._history) - self.max_names
+                for old in self._history:
+                    if excess <= 0:
+                        break
+                    if old != name and old not in self._waiting:
+                        evicted.append(old)
+                        excess -= 1
+                for old in evicted:
+                    del self._history[old]
+        self._hub.subscribe(name, self._record)
+        for old in evicted:
+            self._hub.unsubscribe(old, self._record)
+
+    def untrack(self, event):
+        """Stop recording and forget the occurrences of event"""
+        name = _event_name(event)
+        with self._lock:
+            if self._history.pop(name, None) is None:
+                return
+        self._hub.unsubscribe(name, self._record)
+
+    def _record(self, msg):
+        with self._lock:
+            history = self._history.get(msg.name)
+            if history is not None:
+                history.append(msg)
+                self._cond.notify_all()
+
+    def since(self, event, time=0):
+        """Occurrences of event after time, the oldest first. Starts tracking
+        event if it was not tracked.
+        @param time: seconds since the epoch, as in EventMessage.time
+        @type time: float
+        @rtype: list of EventMessage
+        """
+        name = _event_name(event)
+        self.track(name)
+        with self._lock:
+            return [msg for msg in self._history.get(name, ())
+                    if msg.time > time]
+
+    def wait(self, event, time=0, timeout=None):
+        """First occurrence of event after time, waits for it if none was
+        recorded yet. Starts tracking event if it was not tracked.
+        @param time: seconds since the epoch, as in EventMessage.time
+        @type time: float
+        @param timeout: seconds to wait, None to wait forever
+        @type timeout: float
+        @rtype: EventMessage or None on timeout
+        """
+        name = _event_name(event)
+        self.track(name)
+        if timeout is not None:
+            timeout += _time.time()
+        with self._cond:
+            self._waiting[name] = self._waiting.get(name, 0) + 1
+            try:
+                while True:
+                    for msg in self._history.get(name, ()):
+                        if msg.time > time:
+                            return msg
+                    if timeout is None:
+                        self._cond.wait()
+                    else:
+                        remaining = timeout - _time.time()
+                        if remaining <= 0:
+                            return None
+                        self._cond.wait(remaining)
+            finally:
+                if self._waiting[name] == 1:
+                    del self._waiting[name]
+                else:
+                    self._waiting[name] -= 1
+
+    def latest(self, event):
+        """Last recorded occurrence of event or None
+        @rtype: EventMessage
+        """
+        with self._lock:
+            history = self._history.get(_event_name(event))
+            return history[-1] if history else None
+
+    def close(self):
+        """Stop recording all events"""
+        with self._lock:
+            names, self._history = list(self._history), _collections.OrderedDict()
+        for name in names:
+            self._hub.unsubscribe(name, self._record)
+        if self._own_hub:
+            self._hub.close()
+
+
+class EventPublisher(_threading.Thread):
+    """Publish events of high rate producers in batches.
+
+    publisher = EventPublisher(window=.02)
+    for block in blocks:
+        publisher.publish('block_done', Int32(block))
+    publisher.close()
+
+    Events published within window seconds are sent together: events that
+    map to the same multicast group share a datagram and, with coalesce,
+    only the latest value of each name is sent. max_rate limits the number
+    of datagrams sent per second. Batches are unpacked by the receivers of
+    MdsShr, EventHub and the asyncio receivers. Payloads that do not fit
+    into a datagram and events forwarded to an mds_event_target are sent
+    with Event.seteventRaw.
+    """
+    _max_msg_len = 4096
+
+    def __init__(self, window=.01, coalesce=True, max_rate=0):
+        """
+        @param window: seconds to collect events before sending them
+        @type window: float
+        @param coalesce: send only the latest value of each name per window
+        @type coalesce: bool
+        @param max_rate: maximum datagrams per second, 0 for no limit
+        @type max_rate: float
+        """
+        super(EventPublisher, self).__init__(name='EventPublisher')
+        self.daemon = True
+        self.window = window
+        self.coalesce = coalesce
+        self.max_rate = max_rate
+        self.published = 0
+        self.coalesced = 0
+        self.datagrams = 0
+        self.exception = None
+        self._pending = []
+        self._index = {}
+        self._lock = _threading.Lock()
+        self._wakeup = _threading.Event()
+        self._closed = False
+        self._next = 0.
+        self._settings = _UdpSettings.get()
+        if _os.getenv('mds_event_target'):
+            self._socket = None
+        else:
+            self._socket = self._sender()
+        self.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _sender(self):
+        sock = _socket.socket(_socket.AF_INET, _socket.SOCK_DGRAM)
+        settings = self._settings
+        if settings.ttl is not None:
+            sock.setsockopt(_socket.IPPROTO_IP, _socket.IP_MULTICAST_TTL,
+                            settings.ttl)
+        if settings.loop is not None:
+            sock.setsockopt(_socket.IPPROTO_IP, _socket.IP_MULTICAST_LOOP,
+                            settings.loop)
+        if settings.interface is not None:
+            sock.setsockopt(_socket.IPPROTO_IP, _socket.IP_MULTICAST_IF,
+                            settings.interface)
+        return sock
+
+    def publish(self, event, data=None):
+        """Queue an event for the next batch
+        @param event: event name
+        @type event: str
+        @param data: data to pass with event
+        @type data: Data
+        """
+        if data is None:
+            self.publishRaw(event, None)
+        else:
+            self.publishRaw(event, _dat.Data(data).serialize())
+
+    def publishRaw(self, event, buffer=None):
+        """Queue an event for the next batch
+        @param event: event name
+        @type event: str
+        @param buffer: data buffer
+        @type buffer: numpy.uint8 array
+        """
+        name = _ver.tobytes(_event_name(event))
+        if buffer is None:
+            raw = b''
+        else:
+            if isinstance(buffer, _dat.Data):
+                buffer = buffer.data()
+            raw = _N.ascontiguousarray(buffer).view(_N.uint8).tobytes()
+        with self._lock:
+            if self._closed:
+                raise MdsshrException("EventPublisher is closed")
+            self.published += 1
+            if self.coalesce and name in self._index:
+                self._pending[self._index[name]] = (name, raw)
+                self.coalesced += 1
+            else:
+                self._index[name] = len(self._pending)
+                self._pending.append((name, raw))
+        self._wakeup.set()
+
+    def close(self):
+        """Send the pending events and stop the publisher"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wakeup.set()
+        if self.is_alive() and _threading.current_thread() is not self:
+            self.join()
+        if self._socket is not None:
+            self._socket.close()
+
+    def _throttle(self):
+        if not self.max_rate:
+            return
+        now = _time.time()
+        if now < self._next:
+            _time.sleep(self._next - now)
+        self._next = max(now, self._next) + 1. / self.max_rate
+
+    def _send(self, group, entries):
+        if len(entries) == 1:
+            msg = entries[0]
+        else:
+            msg = _struct.pack('!I', _Assembler._batch_flag | len(entries))
+            msg += b''.join(entries)
+        self._throttle()
+        self._socket.sendto(msg, (group, self._settings.port))
+        self.datagrams += 1
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending, self._index = self._pending, [], {}
+        groups, order = {}, []
+        for name, raw in pending:
+            entry = (_struct.pack('!I', len(name)) + name +
+                     _struct.pack('!I', len(raw)) + raw)
+            if self._socket is None or len(entry)+4 > self._max_msg_len:
+                self._throttle()
+                Event.seteventRaw(name, _N.frombuffer(raw, _N.uint8))
+                self.datagrams += 1
+                continue
+            group = self._settings.group(name)
+            if group not in groups:
+                groups[group] = []
+                order.append(group)
+            groups[group].append(entry)
+        for group in order:
+            batch, size = [], 4
+            for entry in groups[group]:
+                if batch and size+len(entry) > self._max_msg_len:
+                    self._send(group, batch)
+                    batch, size = [], 4
+                batch.append(entry)
+                size += len(entry)
+            self._send(group, batch)
+
+    def run(self):
+        while True:
+            self._wakeup.wait()
+            if not self._closed:
+                _time.sleep(self.window)
+            self._wakeup.clear()
+            try:
+                self._flush()
+            except Exception as exc:
+                self.exception = exc
+            if self._closed:
+                with self._lock:
+                    if not self._pending:
+                        return
@@ -27,6 +27,8 @@ from MDSplus import Tree, getenv, setenv, tcl, Connection
 from MDSplus import checkStatus, TreeWRITEFIRST, TreeNOT_OPEN
 import traceback
 import threading
+import socket
+import struct
 import re
 import gc
 import os
@@ -370,6 +372,121 @@ class MdsIp(object):
         return mdsip, log
 
 
+class MdsIpStandIn(threading.Thread):
+    """Minimal mdsip server on localhost for client side tests.
+    It answers each request with its first argument, or with the expression
+    if there is none. Answers are delayed by latency seconds to simulate a
+    slow link, requests keep flowing in while answers are delayed."""
+    header = struct.Struct('<iiHBBBBbB8i')
+
+    def __init__(self, latency=0.):
+        super(MdsIpStandIn, self).__init__(name='MdsIpStandIn')
+        self.daemon = True
+        self.latency = latency
+        self.requests = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(8)
+        self.hostspec = '127.0.0.1:%d' % self.sock.getsockname()[1]
+        self.conns = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stop(self):
+        for sock in [self.sock]+self.conns:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+            sock.close()
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except Exception:
+                return
+            self.conns.append(conn)
+            thread = threading.Thread(target=self._serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    @staticmethod
+    def _recv(conn, num):
+        buf = b''
+        while len(buf) < num:
+            data = conn.recv(num-len(buf))
+            if not data:
+                raise EOFError
+            buf += data
+        return buf
+
+    def _message(self, conn):
+        header = list(self.header.unpack(
+            self._recv(conn, self.header.size)))
+        return header, self._recv(conn, header[0]-self.header.size)
+
+    def _reply(self, header, body, status, message_id):
+        header = list(header)
+        header[0] = self.header.size+len(body)
+        header[1] = status
+        header[3] = header[4] = 0
+        header[5] = message_id
+        header[7] = 2  # IEEE_CLIENT
+        return self.header.pack(*header)+body
+
+    def _serve(self, conn):
+        replies = []
+        cond = threading.Condition()
+
+        def sender():
+            while True:
+                with cond:
+                    while not replies:
+                        cond.wait()
+                    due, data = replies.pop(0)
+                if data is None:
+                    return
+                delay = due-time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    conn.sendall(data)
+                except Exception:
+                    return
+
+        def put(data):
+            with cond:
+                replies.append((time.time()+self.latency, data))
+                cond.notify()
+        thread = threading.Thread(target=sender)
+        thread.daemon = True
+        thread.start()
+        try:
+            header, body = self._message(conn)  # login
+            header[8], header[9] = 1, 3
+            conn.sendall(self._reply(header, b'', 1, header[5]))
+            while True:
+                header, body = self._message(conn)
+                nargs, message_id = header[3], header[5]
+                answer = header, body
+                for idx in range(1, nargs):
+                    arg = self._message(conn)
+                    if idx == 1:
+                        answer = arg
+                self.requests += 1
+                put(self._reply(answer[0], answer[1], 1, message_id))
+        except Exception:
+            pass
+        finally:
+            put(None)
+
+
 class TreeTests(Tests):
     lock = threading.RLock()
     shotinc = 1
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""requests per second of Pipeline against sequential Connection.get and
+of concurrent AsyncConnection.get on two servers, on links with latency
+served by the stand-in mdsip server of the tests
+
+usage: python connection_benchmark.py [count [latency]]
+"""
+
+import sys
+import time
+
+from MDSplus import Connection, Pipeline, Int32
+
+import _common
+
+
+def pipeline(count=100, latency=.01):
+    with _common.MdsIpStandIn(latency) as server:
+        connection = Connection(server.hostspec)
+        start = time.time()
+        for i in range(count):
+            connection.get('$', Int32(i))
+        sequential = count / (time.time()-start)
+        connection.disconnect()
+        start = time.time()
+        with Pipeline(server.hostspec, depth=32) as pipe:
+            results = [pipe.get('$', Int32(i)) for i in range(count)]
+            for r in results:
+                r.result()
+        pipelined = count / (time.time()-start)
+    sys.stdout.write('get at %dms latency: %.0f/s sequential, %.0f/s pipelined\n' % (
+        latency*1000, sequential, pipelined))
+
+
+def aio(count=200, latency=.01):
+    import asyncio
+    from MDSplus import AsyncConnection
+    with _common.MdsIpStandIn(latency) as server1, \
+            _common.MdsIpStandIn(latency) as server2:
+        cons = [AsyncConnection(server1.hostspec),
+                AsyncConnection(server2.hostspec)]
+        loop = asyncio.new_event_loop()
+        try:
+            start = time.time()
+            loop.run_until_complete(asyncio.gather(
+                *(cons[i % 2].get('$', Int32(i)) for i in range(count))))
+            duration = time.time()-start
+            for con in cons:
+                loop.run_until_complete(con.close())
+        finally:
+            loop.close()
+    sys.stdout.write('%d gets on 2 servers at %dms latency in %.3fs, %.0f/s\n' % (
+        count, latency*1000, duration, count/duration))
+
+
+if __name__ == '__main__':
+    args = [int(sys.argv[1])] if len(sys.argv) > 1 else []
+    args += [float(arg) for arg in sys.argv[2:3]]
+    pipeline(*args)
+    if sys.version_info >= (3, 5):
+        aio(*args)
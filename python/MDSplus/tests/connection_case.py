@@ -26,11 +26,14 @@
 import os
 import shutil
 import subprocess
+import sys
 import tempfile
 import time
+import unittest
 
-from MDSplus import Connection, GetMany
-from MDSplus import Int32, Float32, ADD, Range, setenv, Tree, TreeNNF
+from MDSplus import Connection, ConnectionPool, GetMany, MultiGetMany
+from MDSplus import Pipeline, BufferPool, ResultCache, Event, MdsIpException
+from MDSplus import Int32, Int32Array, Float32, Float32Array, Float64Array, ADD, Range, setenv, Tree, TreeNNF
 
 
 def _mimport(name, level=1):
@@ -47,7 +50,9 @@ class Tests(_common.TreeTests, _common.MdsIp):
     trees = ["consub"]
     tree = "con"
     treesub = "consub"
-    TESTS = {'io', 'thick', 'thread', 'tunnel', 'tcp', 'write'}
+    TESTS = {'io', 'thick', 'thread', 'tunnel', 'tcp', 'write', 'pool',
+             'pipeline', 'pipeline_mdsip', 'aio', 'get_into', 'compression',
+             'multi', 'stream', 'segments', 'cache', 'metrics'}
 
     def thick(self):
         def testnci(thick, local, con, nci):
@@ -167,6 +172,183 @@ class Tests(_common.TreeTests, _common.MdsIp):
         self.assertEqual(g.get('b'), 2)
         self.assertEqual(g.get('c'), 3)
 
+    def compression(self):
+        import numpy
+        zeros = Int32Array(numpy.zeros(1 << 16, numpy.int32))
+        level = 'MdsIpShr->GetCompressionLevel()'
+        connection = Connection("thread://compression", compression=6)
+        try:
+            self.assertEqual(connection.get(level), 6)
+            self.assertEqual(connection.get('$', zeros).tolist(),
+                             zeros.tolist())
+            stats = connection.compressionStats()
+            self.assertEqual(stats['raw_sent'], 4 << 16)
+            self.assertEqual(stats['raw_received'], 4+(4 << 16))
+        finally:
+            connection.get('MdsSetCompression(0)')
+            connection.disconnect()
+        # auto mode compresses requests only and keeps the server level
+        connection = Connection("thread://compression", compression='auto')
+        for _ in range(3):
+            self.assertEqual(connection.get('$', zeros).tolist(),
+                             zeros.tolist())
+        self.assertEqual(connection.get(level), 0)
+        stats = connection.compressionStats()
+        self.assertEqual(stats['raw_sent'], 3*(4 << 16))
+        self.assertEqual(stats['estimate_received'],
+                         stats['raw_received'])
+        connection.disconnect()
+        with self.assertRaises(Exception):
+            Connection("thread://compression").compressionStats()
+
+    def multi(self):
+        connection = Connection("thread://multi3")
+        with MultiGetMany(timeout=10.) as mgm:
+            mgm.append("thread://multi1", 'a', '1')
+            mgm.append("thread://multi2", 'b', '$+1', 2)
+            mgm.append(connection, 'c', '_x=$', 5)
+            mgm.append("tcp://127.0.0.1:1", 'd', '1')
+            with self.assertRaises(Exception):
+                mgm.append("thread://multi2", 'a', '2')
+            mgm.execute()
+            self.assertEqual(mgm.get('a'), 1)
+            self.assertEqual(mgm.get('b'), 3)
+            self.assertEqual(mgm.get('c'), 5)
+            with self.assertRaises(Exception):
+                mgm.get('d')
+            self.assertEqual(list(mgm.errors.keys()), ["tcp://127.0.0.1:1"])
+            mgm.remove('d')
+            # the worker of a server keeps its connection between executes
+            mgm.remove('c')
+            mgm.append(connection, 'c', '_x')
+            mgm.execute()
+            self.assertEqual(mgm.errors, {})
+            self.assertEqual(mgm.get('c'), 5)
+        connection.disconnect()
+
+    def stream(self):
+        import numpy
+        array = numpy.arange(3000.).reshape(1000, 3)
+        connection = Connection("thread://stream")
+        reports = []
+        chunks = list(connection.stream(
+            '$', Float64Array(array), chunk_bytes=2400,
+            progress=lambda done, total: reports.append((done, total))))
+        self.assertEqual([c.shape for c in chunks], [(100, 3)]*10)
+        self.assertEqual(numpy.concatenate(chunks).tolist(), array.tolist())
+        self.assertEqual(reports[-1], (24000, 24000))
+        chunks = list(connection.stream('zero(1000,0)', chunk_bytes=3000))
+        self.assertEqual([len(c) for c in chunks], [750, 250])
+        self.assertEqual(list(connection.stream('5')), [5])
+        connection.disconnect()
+
+    def segments(self):
+        import numpy
+        with Tree(self.tree, self.shot, 'NEW') as ptree:
+            ptree.addNode('SIG', 'SIGNAL')
+            ptree.write()
+        ptree.normal()
+        node = ptree.SIG
+        for i in range(5):
+            dim = Float64Array(numpy.arange(100.)+100*i)
+            node.makeSegment(dim[0], dim[-1], dim, Float32Array(dim))
+        ptree.close()
+        connection = Connection("thread://segments")
+        sigs = list(connection.iterSegments(
+            self.tree, self.shot, 'SIG', 150., 349., window=2))
+        self.assertEqual([len(sig.data()) for sig in sigs], [50, 100, 50])
+        self.assertEqual(numpy.concatenate([sig.data() for sig in sigs]).tolist(),
+                         list(range(150, 350)))
+        self.assertEqual(sigs[0].dim_of().data().tolist(),
+                         list(range(150, 200)))
+        sigs = list(connection.iterSegments(
+            self.tree, self.shot, 'SIG', decimate=10))
+        self.assertEqual(len(sigs), 5)
+        minmax = sigs[1].data()
+        self.assertEqual(minmax.shape, (2, 10))
+        self.assertEqual(minmax[0].tolist(), list(range(100, 200, 10)))
+        self.assertEqual(minmax[1].tolist(), list(range(109, 200, 10)))
+        self.assertEqual(sigs[1].dim_of().data().tolist(),
+                         list(range(100, 200, 10)))
+        connection.disconnect()
+
+    def cache(self):
+        with Tree(self.tree, self.shot, 'NEW') as ptree:
+            ptree.addNode('VAL', 'NUMERIC').record = 1
+            ptree.write()
+        directory = tempfile.mkdtemp()
+        try:
+            connection = Connection("thread://cache")
+            cache = connection.enableCache(max_entries=1, directory=directory)
+            connection.openTree(self.tree, self.shot)
+            self.assertEqual(connection.get('VAL'), 1)
+            self.assertEqual(connection.get('VAL'), 1)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            self.assertEqual(connection.get('$+VAL', 1), 2)
+            self.assertEqual(connection.get('$+VAL', 2), 3)
+            self.assertEqual(len(cache), 1)
+            self.assertEqual(connection.get('_x=VAL'), 1)
+            self.assertEqual((cache.hits, cache.misses), (1, 3))
+            # calls with side effects always reach the server
+            for exp in ('TreePut("VAL",$)', 'treeopen($,$)', 'Tcl("dir")',
+                        'MdsSetCompression(0)', 'setenv("a=b")', '1+Spawn("ls")'):
+                self.assertEqual(cache.key(connection.hostspec, (self.tree, self.shot),
+                                           None, exp, ()), None)
+            self.assertNotEqual(cache.key(connection.hostspec, (self.tree, self.shot),
+                                          None, 'GetNci(VAL,"LENGTH")', ()), None)
+            ptree.normal()
+            ptree.VAL.record = 5
+            self.assertEqual(connection.get('VAL'), 1)  # from disk
+            cache.invalidate(self.tree, self.shot)
+            self.assertEqual(connection.get('VAL'), 5)
+            self.assertEqual(connection.get('$+VAL', 2), 7)
+            self.assertEqual(len(os.listdir(directory)), 2)
+            # a new cache on the same directory starts warm
+            cache = connection.enableCache(directory=directory)
+            self.assertEqual(connection.get('$+VAL', 2), 7)
+            self.assertEqual(cache.hits, 1)
+            event = 'cache_%d' % self.shot
+            cache.invalidateOn(event)
+            Event.setevent(event, Int32(self.shot))
+            for _ in range(50):
+                if not os.listdir(directory):
+                    break
+                time.sleep(.1)
+            self.assertEqual(len(cache), 0)
+            self.assertEqual(os.listdir(directory), [])
+            connection.disconnect()
+        finally:
+            shutil.rmtree(directory)
+
+    def metrics(self):
+        connection = Connection("thread://metrics")
+        stats = connection.enableMetrics(maxlen=10)
+        exported = []
+        stats.addHook(exported.append)
+        for i in range(20):
+            self.assertEqual(connection.get('$+1', Int32(i)), i+1)
+        with self.assertRaises(Exception):
+            connection.get('undefined_function_xyz()')
+        self.assertEqual((stats.count, stats.errors), (21, 1))
+        self.assertEqual(len(stats), 10)
+        self.assertEqual(len(exported), 21)
+        metrics = exported[0]
+        self.assertEqual(metrics.expression, '$+1')
+        self.assertEqual(metrics.request_bytes, 3+2*48+4)
+        self.assertEqual(metrics.response_bytes, 4+48)
+        self.assertTrue(metrics.total >= metrics.send+metrics.wait)
+        self.assertTrue(exported[-1].error is not None)
+        percentiles = stats.percentiles('total')
+        self.assertEqual(sorted(percentiles), [50, 90, 99])
+        self.assertTrue(percentiles[50] <= percentiles[99])
+        summary = stats.summary()
+        self.assertEqual(summary['count'], 21)
+        self.assertTrue(summary['wait']['p50'] <= summary['wait']['max'])
+        connection.disableMetrics()
+        connection.get('1')
+        self.assertEqual(stats.count, 21)
+        connection.disconnect()
+
     def _thread_test(self, server):
         def requests(self, c, idx):
             args = [Int32(i+idx+10) for i in range(10)]
@@ -197,6 +379,187 @@ class Tests(_common.TreeTests, _common.MdsIp):
     def tunnel(self):
         self._thread_test('local://threads')
 
+    def pool(self):
+        def requests(self, pool, idx):
+            for i in range(20):
+                with pool.lease() as c:
+                    self.assertEqual(c.get("$+1", Int32(idx+i)), idx+i+1)
+
+        test_port_offset = 0
+        if 'TEST_PORT_OFFSET' in os.environ:
+            test_port_offset = int(os.environ['TEST_PORT_OFFSET'])
+
+        # See testing/ports.csv
+        server, server_port = self._setup_mdsip('ACTION_SERVER', 'ACTION_PORT', 8019 + test_port_offset, True)
+        svr, svr_log = self._start_mdsip(server, server_port, 'pool')
+        try:
+            with ConnectionPool(server, max_size=2) as pool:
+                _common.TestThread.assertRun(100, *(
+                    _common.TestThread("T%d" % idx, requests, self, pool, idx)
+                    for idx in range(5)
+                ))
+                stats = pool.stats()
+                self.assertEqual(stats['leases'], 100)
+                self.assertTrue(stats['created'] <= 2)
+                self.assertEqual(stats['leased'], 0)
+                # state is kept on the connection and only set when it differs
+                with pool.lease() as c:
+                    c.get("_pool_var=123")
+                    sock = c.conn._sock
+                with pool.lease() as c:
+                    self.assertTrue(c.conn._sock is sock)
+                    self.assertEqual(c.get("_pool_var"), 123)
+                # idle connections are checked before they are leased again
+                pool.check_after = 0
+                with pool.lease() as c:
+                    self.assertEqual(c.get("_pool_var"), 123)
+                stats = pool.stats()
+                self.assertEqual(stats['checks'], 1)
+                self.assertEqual(stats['reconnects'], 0)
+                # a connection leased in one thread serves another one
+                con = pool.lease()
+                _common.TestThread.assertRun(10, _common.TestThread(
+                    "lease", lambda: self.assertEqual(con.get("_pool_var"), 123)))
+                con.release()
+                # a released connection refuses further use
+                self.assertRaises(MdsIpException, con.reconnect)
+                self.assertRaises(MdsIpException, con.closeAllTrees)
+                self.assertRaises(MdsIpException, con.closeTree, 'pool', 1)
+        finally:
+            if svr_log:
+                svr_log.close()
+            self._stop_mdsip((svr, server))
+
+    def pipeline(self):
+        count, latency = 100, .01
+        with _common.MdsIpStandIn(latency) as server:
+            with Pipeline(server.hostspec, depth=32) as pipe:
+                results = [pipe.get('$', Int32(i)) for i in range(count)]
+                self.assertEqual([r.result() for r in results],
+                                 list(range(count)))
+                array = Float64Array([1., 2., 3.])
+                self.assertEqual(pipe.get('$', array).result().tolist(),
+                                 array.tolist())
+                self.assertEqual(str(pipe.get('text').result()), 'text')
+            # more requests than the pipeline depth still come back in order
+            with Pipeline(server.hostspec, depth=4) as pipe:
+                results = [pipe.get('$', Int32(i)) for i in range(count)]
+                for i, r in enumerate(results):
+                    self.assertEqual(r.result(), i)
+
+    def pipeline_mdsip(self):
+        import numpy
+        test_port_offset = 0
+        if 'TEST_PORT_OFFSET' in os.environ:
+            test_port_offset = int(os.environ['TEST_PORT_OFFSET'])
+
+        # See testing/ports.csv
+        server, server_port = self._setup_mdsip('ACTION_SERVER', 'ACTION_PORT', 8020 + test_port_offset, True)
+        svr, svr_log = self._start_mdsip(server, server_port, 'pipeline')
+        try:
+            with Pipeline(server) as pipe:
+                self.assertEqual(pipe.get('$+1', Int32(1)).result(), 2)
+                # the server compresses the answers after MdsSetCompression
+                pipe.get('MdsSetCompression(6)').result()
+                try:
+                    zeros = pipe.get('zero(65536,0)')
+                    out = numpy.ones(1 << 16, numpy.int32)
+                    into = pipe.get_into('zero(65536,0)', out)
+                    error = pipe.get('zero(65536,0)+"a"')
+                    self.assertEqual(zeros.result().tolist(), [0]*(1 << 16))
+                    self.assertTrue(into.result() is out)
+                    self.assertEqual(out.tolist(), [0]*(1 << 16))
+                    self.assertTrue(error.exception() is not None)
+                    self.assertEqual(pipe.get('$', Int32(3)).result(), 3)
+                finally:
+                    pipe.get('MdsSetCompression(0)').result()
+            if sys.version_info >= (3, 5):
+                import asyncio
+                from MDSplus import AsyncConnection
+                loop = asyncio.new_event_loop()
+                con = AsyncConnection(server)
+                try:
+                    loop.run_until_complete(con.get('MdsSetCompression(6)'))
+                    self.assertEqual(loop.run_until_complete(
+                        con.get('zero(65536,0)')).tolist(), [0]*(1 << 16))
+                    gm = con.getMany()
+                    self.assertTrue(gm.connection is con)
+                    gm.append('a', 'zero(65536,0)')
+                    gm.append('b', '$+1', Int32(1))
+                    loop.run_until_complete(gm.execute())
+                    self.assertEqual(gm.get('a').tolist(), [0]*(1 << 16))
+                    self.assertEqual(gm.get('b'), 2)
+                    loop.run_until_complete(con.get('MdsSetCompression(0)'))
+                finally:
+                    loop.run_until_complete(con.close())
+                    loop.close()
+        finally:
+            if svr_log:
+                svr_log.close()
+            self._stop_mdsip((svr, server))
+
+    @unittest.skipUnless(sys.version_info >= (3, 5), "requires asyncio")
+    def aio(self):
+        import asyncio
+        from MDSplus import AsyncConnection
+        count, latency = 200, .01
+        with _common.MdsIpStandIn(latency) as server1, \
+                _common.MdsIpStandIn(latency) as server2:
+            cons = [AsyncConnection(server1.hostspec),
+                    AsyncConnection(server2.hostspec)]
+            loop = asyncio.new_event_loop()
+            try:
+                values = loop.run_until_complete(asyncio.gather(
+                    *(cons[i % 2].get('$', Int32(i)) for i in range(count))))
+                self.assertEqual([int(v) for v in values], list(range(count)))
+                self.assertEqual(server1.requests+server2.requests, count)
+                array = Float64Array([1., 2., 3.])
+                self.assertEqual(loop.run_until_complete(
+                    cons[0].get('$', array)).tolist(), array.tolist())
+                self.assertEqual(str(loop.run_until_complete(
+                    cons[1].get('text'))), 'text')
+                for con in cons:
+                    loop.run_until_complete(con.close())
+            finally:
+                loop.close()
+
+    def get_into(self):
+        import numpy
+        frame = Float64Array(numpy.arange(12.).reshape(3, 4))
+        with _common.MdsIpStandIn() as server:
+            connection = Connection(server.hostspec)
+            try:
+                out = numpy.zeros((3, 4), numpy.float64)
+                self.assertTrue(connection.get_into('$', out, frame) is out)
+                self.assertEqual(out.tolist(), frame.tolist())
+                pool = BufferPool(max_buffers=1)
+                first = connection.get_into('$', pool, frame)
+                self.assertEqual(first.shape, (3, 4))
+                self.assertEqual(first.tolist(), frame.tolist())
+                pool.give(first)
+                self.assertEqual(len(pool), 1)
+                second = connection.get_into('$', pool, Int32(7))
+                self.assertEqual(int(second), 7)
+                self.assertEqual(len(pool), 1)
+                again = connection.get_into('$', pool, frame)
+                self.assertEqual(len(pool), 0)
+                self.assertEqual(again.ctypes.data, first.ctypes.data)
+                with self.assertRaises(Exception):
+                    connection.get_into('$', numpy.zeros(5), frame)
+                # the connection is still in sync after a mismatch
+                self.assertEqual(int(connection.get('$', Int32(3))), 3)
+            finally:
+                connection.disconnect()
+            with Pipeline(server.hostspec) as pipe:
+                out = numpy.zeros((3, 4), numpy.float64)
+                bad = pipe.get_into('$', numpy.zeros(3, numpy.int32), frame)
+                result = pipe.get_into('$', out, frame)
+                text = pipe.get('text')
+                self.assertTrue(result.result() is out)
+                self.assertEqual(out.tolist(), frame.tolist())
+                self.assertTrue(bad.exception() is not None)
+                self.assertEqual(str(text.result()), 'text')
+
     def thread(self):
         self._thread_test('thread://threads')
 
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""cpu and memory per subscription of EventHub and Event, and events/s
+and MB/s of fragmented payloads received by an EventHub
+
+usage: python event_benchmark.py [hub_scaling [count ...]]
+       python event_benchmark.py payload_rate [size ...]
+"""
+
+import os
+import resource
+import sys
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy
+from MDSplus import Event, EventHub
+
+
+def _usage():
+    """cpu seconds and max resident set in kB of the process"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+
+def hub_scaling(counts=(10, 100, 1000)):
+    prefix = 'scale_%d_' % os.getpid()
+    for count in counts:
+        cpu, mem = _usage()
+        with EventHub() as hub:
+            for i in range(count):
+                hub.subscribe(prefix + str(i), lambda msg: None)
+            time.sleep(1)
+            hub_cpu, hub_mem = _usage()
+        events = [Event(prefix + str(i)) for i in range(count)]
+        time.sleep(1)
+        evt_cpu, evt_mem = _usage()
+        for event in events:
+            event.cancel()
+        sys.stdout.write(
+            '%5d subscriptions: EventHub %.3fs %dkB, Event %.3fs %dkB\n' % (
+                count, hub_cpu - cpu, hub_mem - mem,
+                evt_cpu - hub_cpu, evt_mem - hub_mem))
+
+
+def payload_rate(sizes=(100, 4000, 16000, 100000, 1000000)):
+    name = 'rate_%d' % os.getpid()
+    with EventHub() as hub:
+        events = hub.queue(name)
+        time.sleep(.1)
+        for size in sizes:
+            payload = numpy.zeros(size, numpy.uint8)
+            count = max(10, 10000000 // size)
+            start = time.time()
+            for i in range(count):
+                Event.seteventRaw(name, payload)
+            received = 0
+            try:
+                while received < count:
+                    events.get(timeout=1)
+                    received += 1
+            except queue.Empty:
+                pass
+            duration = time.time() - start
+            sys.stdout.write(
+                '%7d bytes: %d of %d events, %.0f events/s, %.1f MB/s\n' % (
+                    size, received, count, received / duration,
+                    received * size / duration / 1e6))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    bench = hub_scaling
+    if args and args[0] in ('hub_scaling', 'payload_rate'):
+        bench = globals()[args.pop(0)]
+    if args:
+        bench([int(arg) for arg in args])
+    else:
+        bench()
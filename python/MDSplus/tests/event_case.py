@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import os
+import struct
+import sys
+import threading
+import time
+import unittest
+
+from MDSplus import Event, EventHub, EventHistory, EventPublisher, MdsshrException, Int32
+
+
+def _mimport(name, level=1):
+    try:
+        return __import__(name, globals(), level=level)
+    except:
+        return __import__(name, globals())
+
+
+_common = _mimport("_common")
+
+
+class Tests(_common.Tests):
+    TESTS = {'hub', 'aio', 'large', 'publisher', 'history', 'wsgi'}
+
+    def hub(self):
+        prefix = 'hub_%d_' % os.getpid()
+        threads = threading.active_count()
+        with EventHub() as hub:
+            self.assertEqual(threading.active_count(), threads + 1)
+            queues = [hub.queue(prefix + str(i)) for i in range(200)]
+            self.assertEqual(len(hub), 200)
+            # beyond the 20 memberships per socket of a default linux
+            self.assertTrue(len(hub._groups) > 20)
+            self.assertEqual(threading.active_count(), threads + 1)
+            received = []
+            hub.subscribe(prefix + '7', received.append)
+            time.sleep(.1)
+            for i in (0, 7, 199):
+                Event.setevent(prefix + str(i), Int32(i))
+            for i in (0, 7, 199):
+                msg = queues[i].get(timeout=5)
+                self.assertEqual(msg.name, (prefix + str(i)).upper())
+                self.assertEqual(msg.getData(), Int32(i))
+            self.assertEqual(len(received), 1)
+            self.assertTrue(queues[1].empty())
+            hub.unsubscribe(prefix + '7', queues[7].callback)
+            Event.setevent(prefix + '7', Int32(8))
+            time.sleep(.5)
+            self.assertTrue(queues[7].empty())
+            self.assertEqual(len(received), 2)
+        self.assertFalse(hub.is_alive())
+
+    @unittest.skipUnless(sys.version_info >= (3, 5), "requires asyncio")
+    def aio(self):
+        import asyncio
+        from MDSplus import EventStream, wait_event, MdsTimeout
+        prefix = 'aio_%d_' % os.getpid()
+        threads = threading.active_count()
+        loop = asyncio.new_event_loop()
+        try:
+            stream = EventStream([prefix + 'a', prefix + 'b'])
+            loop.run_until_complete(stream.open())
+            waiters = [loop.create_task(wait_event(prefix + 'a', 5))
+                       for i in range(2000)]
+            loop.run_until_complete(asyncio.sleep(.5))
+            self.assertEqual(threading.active_count(), threads)
+            Event.setevent(prefix + 'a', Int32(1))
+            Event.setevent(prefix + 'b', Int32(2))
+            msgs = loop.run_until_complete(asyncio.wait_for(
+                asyncio.gather(*waiters), 5))
+            self.assertEqual(len(msgs), 2000)
+            self.assertTrue(all(msg is msgs[0] for msg in msgs))
+            self.assertEqual(msgs[0].getData(), Int32(1))
+            first = loop.run_until_complete(stream.__anext__())
+            second = loop.run_until_complete(stream.__anext__())
+            self.assertEqual(first.name, (prefix + 'a').upper())
+            self.assertEqual(second.getData(), Int32(2))
+            stream.close()
+            with self.assertRaises(StopAsyncIteration):
+                loop.run_until_complete(stream.__anext__())
+            with self.assertRaises(MdsTimeout):
+                loop.run_until_complete(wait_event(prefix + 'c', .2))
+        finally:
+            loop.close()
+        # the event hub of a loop does not keep it alive
+        import gc
+        import weakref
+        del waiters, stream
+        ref = weakref.ref(loop)
+        del loop
+        gc.collect()
+        self.assertTrue(ref() is None)
+
+    def large(self):
+        import numpy
+        prefix = 'large_%d_' % os.getpid()
+        payload = numpy.arange(100000, dtype=numpy.uint8)
+        timer = threading.Timer(
+            .5, Event.seteventRaw, (prefix + 'wait', payload))
+        timer.start()
+        try:
+            raw = Event.wfeventRaw(prefix + 'wait', 5)
+        finally:
+            timer.join()
+        self.assertEqual(raw.data().tolist(), payload.tolist())
+        with EventHub() as hub:
+            events = hub.queue(prefix + 'hub')
+            time.sleep(.1)
+            Event.seteventRaw(prefix + 'hub', payload)
+            self.assertEqual(events.get(timeout=5).raw.tolist(),
+                             payload.tolist())
+        # duplicated fragments do not complete a payload with holes
+        from MDSplus.event import _Assembler
+        name = b'DUP'
+        size = _Assembler._max_msg_len - 16 - len(name)
+        data = bytes(bytearray(i % 251 for i in range(2 * size + 10)))
+
+        def fragment(offset):
+            return struct.pack('!I', len(name) | _Assembler._fragment_flag) + \
+                name + struct.pack('!III', len(data), 1, offset) + \
+                data[offset:offset + size]
+        assembler = _Assembler()
+        self.assertEqual(assembler.parse(fragment(0), 'sender'), [])
+        self.assertEqual(assembler.parse(fragment(0), 'sender'), [])
+        self.assertEqual(assembler.parse(fragment(2 * size), 'sender'), [])
+        events = assembler.parse(fragment(size), 'sender')
+        self.assertEqual(len(events), 1)
+        self.assertEqual(bytes(events[0][1]), data)
+
+    def publisher(self):
+        name = 'publisher_%d' % os.getpid()
+        with EventHub() as hub:
+            events = hub.queue(name)
+            time.sleep(.1)
+            with EventPublisher(window=.2, coalesce=False) as publisher:
+                for i in range(100):
+                    publisher.publish(name, Int32(i))
+            self.assertEqual(
+                [int(events.get(timeout=5).getData()) for i in range(100)],
+                list(range(100)))
+            self.assertTrue(publisher.datagrams < 10)
+            self.assertTrue(hub.received < 10)
+            sys.stdout.write('100 events in %d datagrams\n' %
+                             publisher.datagrams)
+            with EventPublisher(window=.2) as publisher:
+                for i in range(100):
+                    publisher.publish(name, Int32(i))
+            self.assertEqual(events.get(timeout=5).getData(), Int32(99))
+            self.assertEqual(publisher.coalesced, 99)
+            self.assertEqual(publisher.datagrams, 1)
+            time.sleep(.5)
+            self.assertTrue(events.empty())
+
+        def publish():
+            with EventPublisher(coalesce=False) as publisher:
+                for i in range(3):
+                    publisher.publish(name, Int32(i))
+        timer = threading.Timer(.5, publish)
+        timer.start()
+        try:
+            self.assertEqual(Event.wfevent(name, 5), Int32(0))
+        finally:
+            timer.join()
+
+    def history(self):
+        name = 'history_%d' % os.getpid()
+        self.assertRaises(MdsshrException, Event.since, name)
+        history = Event.enableHistory(maxlen=3)
+        try:
+            self.assertTrue(Event.enableHistory() is history)
+            history.track(name)
+            time.sleep(.1)
+            for i in range(5):
+                Event.setevent(name, Int32(i))
+                time.sleep(.05)
+            time.sleep(.5)
+            missed = Event.since(name)
+            self.assertEqual([int(msg.getData()) for msg in missed], [2, 3, 4])
+            self.assertEqual(
+                [int(msg.getData()) for msg in Event.since(name, missed[1].time)],
+                [4])
+            self.assertEqual(int(history.latest(name).getData()), 4)
+            history.untrack(name)
+            self.assertEqual(len(history), 0)
+            self.assertEqual(history.latest(name), None)
+        finally:
+            Event.disableHistory()
+        self.assertEqual(Event.history, None)
+        # least recently used names are untracked unless they are waited for
+        names = ['%s_%d' % (name, i) for i in range(5)]
+        with EventHub() as hub:
+            capped = EventHistory(hub=hub, max_names=2)
+            try:
+                result = []
+                waiter = threading.Thread(target=lambda: result.append(
+                    capped.wait(names[0], time.time(), 5)))
+                waiter.start()
+                time.sleep(.1)
+                for other in names[1:]:
+                    capped.track(other)
+                self.assertEqual(len(capped), 2)
+                self.assertEqual(len(hub), 2)
+                time.sleep(.1)
+                Event.setevent(names[0], Int32(7))
+                waiter.join()
+                self.assertEqual(int(result[0].getData()), 7)
+            finally:
+                capped.close()
+
+    @staticmethod
+    def _doEvent():
+        # load wsgi/doEvent.py without the wsgi package and its web deps
+        path = os.path.join(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))), 'wsgi', 'doEvent.py')
+        try:
+            from importlib.util import spec_from_file_location, module_from_spec
+        except ImportError:
+            import imp
+            return imp.load_source('_doEvent', path).doEvent
+        spec = spec_from_file_location('_doEvent', path)
+        module = module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module.doEvent
+
+    def wsgi(self):
+        name = 'wsgi_%d' % os.getpid()
+        doEvent = self._doEvent()
+
+        class request(object):
+            def __init__(self, **args):
+                self.path_parts = ['event', name]
+                self.args = dict((k, [str(v)]) for k, v in args.items())
+
+        def timestamp(output):
+            return float(output.split('<timestamp>')[1].split('<')[0])
+        history = Event.enableHistory()
+        try:
+            start = time.time()
+            self.assertEqual(history.wait(name, start, .2), None)
+            self.assertEqual(doEvent(request(timeout=1))[0], '204 NO_CONTENT')
+            threading.Timer(.3, Event.setevent, (name, Int32(1))).start()
+            status, headers, output = doEvent(request(timeout=5))
+            self.assertEqual(status, '200 OK')
+            first = timestamp(output)
+            Event.setevent(name, Int32(2))
+            msg = history.wait(name, first, 5)
+            self.assertEqual(int(msg.getData()), 2)
+            self.assertTrue(msg.getQTime() is msg.qtime)
+            self.assertEqual(msg.exception, None)
+            # replay from the history in order, each occurrence once
+            status, headers, output = doEvent(request(since=start))
+            self.assertEqual(timestamp(output), first)
+            status, headers, output = doEvent(request(since=first))
+            self.assertEqual(timestamp(output), msg.time)
+            status, headers, output = doEvent(
+                request(since=msg.time, timeout=1))
+            self.assertEqual(status, '204 NO_CONTENT')
+        finally:
+            Event.disableHistory()
+
+
+Tests.main()
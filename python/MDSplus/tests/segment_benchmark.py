@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Massachusetts Institute of Technology All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""throughput of TreeNode.getSegments against reading segment by segment
+and latency of TreeNode.getSegmentLimits with and without the gc.collect
+it used to do on every call
+
+usage: python segment_benchmark.py [numsegs [seglen]]
+"""
+
+import gc
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy
+from MDSplus import Tree, Float64Array, Int32Array, Int64Array, setenv
+
+
+def _tree(shot):
+    """new tree with one segmented node S in a temporary directory"""
+    tmpdir = tempfile.mkdtemp()
+    setenv('segbench_path', tmpdir)
+    with Tree('segbench', shot, 'NEW') as tree:
+        tree.addNode('S')
+        tree.write()
+    tree.normal()
+    return tree, tmpdir
+
+
+def get_segments(numsegs=200, seglen=100):
+    tree, tmpdir = _tree(1)
+    try:
+        node = tree.S
+        for i in range(numsegs):
+            d = numpy.arange(i*seglen, (i+1)*seglen, dtype=numpy.float64)
+            node.makeSegment(d[0], d[-1], Float64Array(d), Int32Array(d))
+        out = numpy.zeros(numsegs*seglen, numpy.int32), numpy.zeros(
+            numsegs*seglen, numpy.float64)
+        t0 = time.time()
+        for i in range(numsegs):
+            seg = node.getSegment(i)
+            seg.data()
+            seg.dim_of().data()
+        t1 = time.time()
+        node.getSegments(out=out)
+        t2 = time.time()
+        sys.stdout.write(
+            'getSegment loop: %.1f segments/s, getSegments: %.1f segments/s\n' % (
+                numsegs/max(t1-t0, 1e-9), numsegs/max(t2-t1, 1e-9)))
+    finally:
+        del tree
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def limits_latency(numsegs=100):
+    tree, tmpdir = _tree(2)
+    try:
+        node = tree.S
+        for i in range(numsegs):
+            d = numpy.arange(i*10, i*10+10, dtype=numpy.int64)
+            node.makeSegment(d[0], d[9], Int64Array(d), Int32Array(d))
+        # garbage to make a full collection as expensive as in a real session
+        garbage = [[i] for i in range(100000)]
+        t0 = time.time()
+        for i in range(numsegs):
+            node.getSegmentLimits(i)
+            gc.collect()
+        t1 = time.time()
+        for i in range(numsegs):
+            node.getSegmentLimits(i)
+        t2 = time.time()
+        del garbage
+        sys.stdout.write(
+            'getSegmentLimits: %.1f us/call with gc.collect, %.1f us/call without\n' % (
+                (t1-t0)*1e6/numsegs, (t2-t1)*1e6/numsegs))
+    finally:
+        del tree
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    get_segments(*args)
+    limits_latency(*args[:1])
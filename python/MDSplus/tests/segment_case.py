@@ -26,7 +26,7 @@
 import os
 import numpy
 from MDSplus import Int32, Int64, Float32
-from MDSplus import DateToQuad, Float32Array, Int16Array, Int32Array, Int64Array
+from MDSplus import DateToQuad, Float32Array, Float64Array, Int16Array, Int32Array, Int64Array
 from MDSplus import Tree, Dimension, Range, Window, DIVIDE, ADD, MULTIPLY, ZERO
 from MDSplus import set_default_resample_mode, Opaque, tdi, TreeBUFFEROVF
 
@@ -41,11 +41,12 @@ _common = _mimport("_common")
 
 
 class Tests(_common.TreeTests):
-    shotinc = 12
+    shotinc = 17
     tree = 'segment'
     TESTS = {
         'dim_order', 'block_rows', 'write', 'opaque', 'update',
         'time_context', 'scaled', 'dimless', 'compress', 'compress_ts',
+        'get_segments', 'segment_index', 'limits_loop', 'writer',
     }
 
 
@@ -472,5 +473,160 @@ class Tests(_common.TreeTests):
         self.assertEqual(True, (before.dim_of().data() == after.dim_of(
         ).data()).all(), "%r != %r" % (before.dim_of(), after.dim_of()))
 
+    def get_segments(self):
+        with Tree(self.tree, self.shot+12, 'NEW') as ptree:
+            ptree.addNode('S')
+            ptree.addNode('TS')
+            ptree.addNode('SC')
+            ptree.write()
+        ptree.normal()
+        numsegs, seglen = 200, 100
+        node = ptree.S
+        for i in range(numsegs):
+            d = numpy.arange(i*seglen, (i+1)*seglen, dtype=numpy.float64)
+            node.makeSegment(d[0], d[-1], Float64Array(d), Int32Array(d))
+        data, time_ = node.getSegments()
+        self.assertEqual(data.dtype, numpy.int32)
+        self.assertEqual(data.tolist(), list(range(numsegs*seglen)))
+        self.assertEqual(time_.tolist(), list(range(numsegs*seglen)))
+        data, time_ = node.getSegments(2, 3)
+        self.assertEqual(data.tolist(), list(range(2*seglen, 4*seglen)))
+        # reuse buffers
+        out = numpy.zeros(numsegs*seglen, numpy.int32), numpy.zeros(
+            numsegs*seglen, numpy.float64)
+        data, time_ = node.getSegments(-2, -1, out=out)
+        self.assertEqual(data.base is out[0] or data is out[0], True)
+        self.assertEqual(out[0][:2*seglen].tolist(),
+                         list(range((numsegs-2)*seglen, numsegs*seglen)))
+        # timestamped and scaled segments
+        node = ptree.TS
+        node.makeTimestampedSegment(Int64Array([1, 2, 3]), Int16Array([1, 2, 3]))
+        node.makeTimestampedSegment(Int64Array([4, 5]), Int16Array([4, 5]))
+        data, time_ = node.getSegments()
+        self.assertEqual(data.tolist(), [1, 2, 3, 4, 5])
+        self.assertEqual(time_.dtype, numpy.int64)
+        node.setSegmentScale(Int64(2))
+        self.assertEqual(node.getSegments()[0].tolist(), [2, 4, 6, 8, 10])
+        node = ptree.SC
+        node.makeSegment(0, 9, Range(0, 9, 1), Int32Array(range(10)))
+        self.assertEqual(node.getSegments()[1].tolist(), list(range(10)))
+        # same result as reading segment by segment
+        node = ptree.S
+        data, time_ = node.getSegments(out=out)
+        for i in range(numsegs):
+            seg = node.getSegment(i)
+            self.assertEqual(data[i*seglen:(i+1)*seglen].tolist(),
+                             seg.data().tolist())
+            self.assertEqual(time_[i*seglen:(i+1)*seglen].tolist(),
+                             seg.dim_of().data().tolist())
+
+    def segment_index(self):
+        with Tree(self.tree, self.shot+13, 'NEW') as ptree:
+            ptree.addNode('S')
+            ptree.write()
+        ptree.normal()
+        node = ptree.S
+        self.assertEqual(node.getSegmentRange(0, 10), None)
+        for i in range(10):
+            d = Int64Array(range(i*10, i*10+10))
+            node.makeSegment(d[0], d[9], d, Int32Array(d))
+        index = node.getSegmentIndex()
+        self.assertEqual(len(index), 10)
+        self.assertEqual(index.rows.tolist(), [10]*10)
+        self.assertEqual(index.offset.tolist(), list(range(0, 100, 10)))
+        self.assertEqual(node.getSegmentRange(25, 44), (2, 4))
+        self.assertEqual(node.getSegmentRange(None, 5), (0, 0))
+        self.assertEqual(node.getSegmentRange(95, None), (9, 9))
+        self.assertEqual(node.getSegmentRange(200, 300), None)
+        self.assertEqual(node.getSegmentsInRange(25, 34)[0].tolist(),
+                         list(range(20, 40)))
+        # incremental refresh picks up appended and growing segments
+        self.assertIs(node.getSegmentIndex(False), index)
+        d = Int64Array(range(100, 110))
+        node.beginSegment(d[0], d[9], d, Int32Array(d))
+        node.putSegment(Int32Array([100, 101]))
+        self.assertEqual(node.getSegmentRange(105, 106), (10, 10))
+        self.assertEqual(index.rows.tolist()[-1], 2)
+        node.putSegment(Int32Array([102]))
+        index.refresh()
+        self.assertEqual(index.rows.tolist()[-1], 3)
+        self.assertEqual(index.offset.tolist()[-1], 100)
+        # changed limits of the first segment trigger a rebuild
+        node.updateSegmentLimits(-10, 9, 0)
+        self.assertEqual(node.getSegmentRange(-5, -1), (0, 0))
+        self.assertEqual(index.start.tolist()[:2], [-10, 10])
+        # the index belongs to the shot that was open
+        with Tree(self.tree, self.shot+16, 'NEW') as ptree2:
+            ptree2.addNode('S')
+            ptree2.write()
+        ptree.open(shot=self.shot+16)
+        node = ptree.S
+        self.assertEqual(node.getSegmentRange(0, 10), None)
+        d = Int64Array(range(1000, 1010))
+        node.makeSegment(d[0], d[9], d, Int32Array(d))
+        self.assertIsNot(node.getSegmentIndex(), index)
+        self.assertEqual(node.getSegmentRange(1000, 1005), (0, 0))
+
+    def limits_loop(self):
+        with Tree(self.tree, self.shot+14, 'NEW') as ptree:
+            ptree.addNode('S')
+            ptree.write()
+        ptree.normal()
+        node = ptree.S
+        numsegs = 100
+        for i in range(numsegs):
+            d = Int64Array(range(i*10, i*10+10))
+            node.makeSegment(d[0], d[9], d, Int32Array(d))
+        for i in range(numsegs):
+            self.assertEqual(node.getSegmentLimits(i), (i*10, i*10+9))
+
+    def writer(self):
+        from time import sleep
+        from MDSplus import SegmentWriter
+        with Tree(self.tree, self.shot+15, 'NEW') as ptree:
+            ptree.addNode('S')
+            ptree.addNode('L')
+            ptree.addNode('M')
+            ptree.addNode('R')
+            ptree.addNode('RES')
+            ptree.write()
+        ptree.normal()
+        node = ptree.S
+        with SegmentWriter(node, segment_rows=10, num_buffers=2) as writer:
+            for i in range(25):
+                writer.putRow(numpy.int32([i, -i]), i*10)
+        self.assertEqual(node.getNumSegments(), 3)
+        self.assertEqual(node.getSegmentInfo(2)[2], 5)
+        self.assertEqual(node.record.data()[:, 0].tolist(), list(range(25)))
+        self.assertEqual(node.record.dim_of().data().tolist(),
+                         list(range(0, 250, 10)))
+        # partial blocks are written after max_latency
+        node = ptree.L
+        writer = SegmentWriter(node, segment_rows=1000, max_latency=.1)
+        writer.putRows(numpy.arange(3, dtype=numpy.float32), [1, 2, 3])
+        for _ in range(50):
+            if node.getNumSegments() > 0:
+                break
+            sleep(.1)
+        self.assertEqual(node.getNumSegments(), 1)
+        writer.close()
+        # queued complete segments
+        node = ptree.M
+        with SegmentWriter(node) as writer:
+            buf = numpy.arange(10, dtype=numpy.int16)
+            writer.makeSegment(0, 9, Range(0, 9, 1), buf)
+            buf[:] = 0  # the writer must have copied the buffer
+        self.assertEqual(node.record.data().tolist(), list(range(10)))
+        # resampled segments as written by streaming devices
+        node = ptree.R
+        with SegmentWriter(node, num_buffers=1) as writer:
+            for i in range(3):
+                buf = numpy.arange(i*10, i*10+10, dtype=numpy.float32)
+                writer.makeSegmentResampled(i*10, i*10+9, Range(i*10, i*10+9, 1),
+                                            buf, ptree.RES, 5)
+        self.assertEqual(node.getNumSegments(), 3)
+        self.assertEqual(node.record.data().tolist(), list(range(30)))
+        self.assertEqual(ptree.RES.getNumSegments(), 3)
+
 
 Tests.main()
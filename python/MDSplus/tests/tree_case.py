@@ -25,8 +25,8 @@
 
 import os
 import numpy
-from MDSplus import Tree, TreeNode, Data, Array, Signal, Range, Device, Int32, Float32Array
-from MDSplus import TreeNOEDIT, ADD, COMPILE, mdsrecord
+from MDSplus import Tree, TreeNode, ShotIndex, Data, Array, Signal, Range, Device, Int32, Float32Array, Int32Array, Uint8Array
+from MDSplus import TreeNOEDIT, TreeNNF, ADD, COMPILE, mdsrecord, Nci, Flags
 
 
 def _mimport(name, level=1):
@@ -45,10 +45,12 @@ att3 = 'this is plasma current'
 
 class Tests(_common.TreeTests):
     trees = ['pytree', 'pytreesub']
-    shotinc = 11
+    shotinc = 18
     TESTS = {
         'attr', 'open', 'node', 'find', 'default', 'linkage',
-        'nci', 'data', 'xysignal', 'compression', 'records'
+        'nci', 'data', 'xysignal', 'compression', 'records', 'nci_bulk',
+        'nci_snapshot', 'node_cache', 'lazy_devices', 'snapshot',
+        'shotdb'
     }
 
     def attr(self):
@@ -454,5 +456,191 @@ class Tests(_common.TreeTests):
         self.assertEqual(cls._parts_str.filter, mdsrecord.str)
         self.assertEqual(cls._parts_int_list.filter, mdsrecord.int_list)
 
+    def nci_bulk(self):
+        shot = self.shot + 11
+        with Tree('pytree', shot, 'new') as pytree:
+            for i in range(20):
+                pytree.addNode('sig%02d' % (i,), 'signal')
+                pytree.addNode('num%02d' % (i,), 'numeric')
+            pytree.write()
+        pytree.readonly()
+        nodes = pytree.getNodeWild('***')
+        nci = pytree.getNciBulk(nodes, ('fullpath', 'usage', 'length',
+                                        'get_flags', 'node_name'))
+        self.assertEqual(nci.shape, (len(nodes),))
+        self.assertEqual(nci.nid.tolist(), nodes._value.tolist())
+        for i, node in enumerate(nodes):
+            self.assertEqual(nci.fullpath[i].decode(), node.fullpath)
+            self.assertEqual(nci.node_name[i].decode(), node.node_name)
+            self.assertEqual(nci.usage[i], node._getNci(Nci.USAGE))
+            self.assertEqual(nci.length[i], node.length)
+            self.assertEqual(nci.get_flags[i], node.get_flags)
+        self.assertEqual(nodes.usage.dtype_id, Uint8Array.dtype_id)
+        self.assertEqual(nodes.usage.tolist(),
+                         [node._getNci(Nci.USAGE) for node in nodes])
+        self.assertEqual(nodes.usage_str.tolist(),
+                         [node.usage_str for node in nodes])
+        self.assertEqual(nodes.depth.dtype_id, Int32Array.dtype_id)
+        self.assertTrue((nodes.fullpath == Array(
+            [node.fullpath for node in nodes])).all())
+        self.assertEqual(list(nodes.length.data()),
+                         [node.length for node in nodes])
+        self.assertEqual(len(pytree.getNciBulk([], ('path',))), 0)
+        with self.assertRaises(KeyError):
+            pytree.getNciBulk(nodes, ('member_nids',))
+
+    def nci_snapshot(self):
+        shot = self.shot + 12
+        with Tree('pytree', shot, 'new') as pytree:
+            sig = pytree.addNode('sig', 'signal')
+            pytree.write()
+        pytree.normal()
+        sig = pytree.getNode('sig')
+        sig.record = Signal(Int32(range(10)), None, Range(1., 10.))
+        snap = sig.nci_snapshot()
+        self.assertEqual(snap.length, sig.length)
+        self.assertEqual(snap.rlength, sig.rlength)
+        self.assertEqual(snap.usage_str, sig.usage_str)
+        self.assertEqual(snap.fullpath, sig.fullpath)
+        self.assertEqual(snap.node_name, 'SIG')
+        self.assertEqual(snap.flags.state, sig.on)
+        self.assertTrue('length' in snap)
+        self.assertFalse('member_nids' in snap)
+        with self.assertRaises(AttributeError):
+            snap.length = 0
+        snap = sig.nci_snapshot(('length', 'parent'))
+        self.assertEqual(len(snap), 2)
+        self.assertEqual(snap.parent, pytree.top)
+        with self.assertRaises(AttributeError):
+            snap.usage_str
+        with sig.nci_snapshot(('length', 'get_flags')) as snap:
+            sig.record = Int32(range(100))  # snapshot is not updated
+            self.assertEqual(sig.length, snap.length)
+        self.assertNotEqual(sig.length, snap.length)
+
+    def node_cache(self):
+        shot = self.shot + 13
+        with Tree('pytree', shot, 'new') as pytree:
+            cache = pytree.enableNodeCache(maxsize=4)
+            struct = pytree.addNode('struct', 'structure')
+            sig = struct.addNode('sig', 'signal')
+            self.assertEqual(pytree.getNode('struct:sig'), sig)
+            self.assertEqual(pytree.getNode('struct:sig'), sig)
+            self.assertEqual(struct.SIG, sig)
+            self.assertEqual(struct.SIG, sig)
+            self.assertEqual((cache.hits, cache.misses), (2, 2))
+            # edits invalidate the cache
+            sig.rename('sig2')
+            self.assertEqual(len(cache), 0)
+            with self.assertRaises(TreeNNF):
+                pytree.getNode('struct:sig')
+            self.assertEqual(pytree.getNode('struct:sig2'), sig)
+            sig2 = pytree.addNode('struct:sig', 'signal')
+            self.assertEqual(pytree.getNode('struct:sig'), sig2)
+            # lookups relative to the default node
+            pytree.setDefault(struct)
+            self.assertEqual(pytree.getNode('sig'), sig2)
+            pytree.setDefault(pytree.top)
+            with self.assertRaises(TreeNNF):
+                pytree.getNode('sig')
+            pytree.deleteNode('struct:sig')
+            with self.assertRaises(TreeNNF):
+                pytree.getNode('struct:sig')
+            # least recently used entries are dropped
+            for i in range(8):
+                pytree.addNode('num%d' % i, 'numeric')
+            for i in range(8):
+                pytree.getNode('num%d' % i)
+            self.assertEqual(len(cache), 4)
+            pytree.disableNodeCache()
+            self.assertEqual(pytree.node_cache, None)
+            pytree.write()
+
+    def lazy_devices(self):
+        shot = self.shot + 14
+        with Tree('pytree', shot, 'new') as pytree:
+            pytree.addDevice('DEV', 'TestDevice')
+            pytree.addNode('NUM', 'numeric')
+            pytree.write()
+        pytree.normal()
+        cls = Device.PyDevice('TestDevice')
+        self.assertEqual(pytree.DEV.__class__, cls)
+        pytree.lazy_devices = True
+        node = pytree.getNode('DEV')
+        self.assertEqual(node.__class__, TreeNode)
+        for dev in pytree.getNodeWild('***', 'DEVICE'):
+            self.assertEqual(dev.__class__, TreeNode)
+        # plain child access does not upgrade the handle
+        self.assertEqual(node.ACTIONSERVER.nid, node.nid+1)
+        self.assertTrue(node._lazy)
+        self.assertTrue(pytree.copy().lazy_devices)
+        # device specific attributes upgrade the handle on demand
+        self.assertEqual(node.part_dict, cls.part_dict)
+        self.assertEqual(node.done, 0)
+        self.assertEqual(node.upgrade().__class__, cls)
+        num = pytree.getNode('NUM')
+        self.assertTrue(num.upgrade() is num)
+        with self.assertRaises(AttributeError):
+            num.part_dict
+
+    def snapshot(self):
+        shot = self.shot + 15
+        with Tree('pytree', shot, 'new') as pytree:
+            for i in range(3):
+                struct = pytree.addNode('struct%d' % i, 'structure')
+                for j in range(4):
+                    struct.addNode('sig%d' % j, 'signal')
+                    struct.addNode('num%d' % j, 'numeric')
+            pytree.STRUCT1.SIG2.tag = 'MYSIG'
+            pytree.STRUCT2.NUM3.write_once = True
+            pytree.write()
+        pytree.readonly()
+        snap = pytree.snapshot(chunk=7)
+        nodes = pytree.getNodeWild('***')
+        self.assertEqual(len(snap), len(set(nodes._value.tolist()) | {0}))
+        self.assertEqual(snap.parent[0], -1)
+        top = pytree.top
+        self.assertEqual(sorted(snap.children(0).tolist()),
+                         sorted(top.children_nids._value.tolist()))
+        struct = pytree.STRUCT1
+        self.assertEqual(sorted(snap.members(struct.nid).tolist()),
+                         sorted(struct.member_nids._value.tolist()))
+        sigs = snap.query(path='\\PYTREE::TOP.*:SIG*')
+        self.assertEqual(len(sigs), 12)
+        self.assertEqual(len(snap.query(path='**:SIG1')), 3)
+        self.assertEqual(len(snap.query(regex='STRUCT[01]:NUM')), 8)
+        self.assertEqual(len(snap.query(usage='signal')), 12)
+        self.assertEqual(len(snap.query(usage=('signal', 'numeric'),
+                                        under=struct)), 8)
+        self.assertEqual(snap.query(flags=Flags.WRITE_ONCE)._value.tolist(),
+                         [pytree.STRUCT2.NUM3.nid])
+        self.assertEqual(snap.query(tag='mysig')._value.tolist(),
+                         [pytree.STRUCT1.SIG2.nid])
+        walk = list(snap.walk(struct.nid))
+        self.assertEqual(len(walk), 9)
+        self.assertEqual(walk[0], (struct.nid, 0))
+        lines = [line.strip() for line in snap.dump(struct.nid).split('\n')]
+        self.assertEqual(lines[0], '.STRUCT1')
+        self.assertEqual(sorted(lines[1:]), sorted(
+            [':NUM%d' % j for j in range(4)]+[':SIG%d' % j for j in range(4)]))
+
+    def shotdb(self):
+        shot = self.shot + 16
+        with Tree('pytree', shot, 'new') as pytree:
+            pytree.write()
+        path = self.tmpdir
+        shots = Tree.getShotDB('pytree', lower=shot, upper=shot+1)
+        self.assertEqual(shots.tolist(), [shot])
+        index = ShotIndex.get('pytree', path)
+        self.assertEqual(index.range(shot, shot).tolist(), [shot])
+        self.assertEqual(index.nearest(shot+1)[0].tolist(), [shot])
+        with Tree('pytree', shot+1, 'new') as pytree:
+            pytree.write()
+        index.mtime = None  # do not depend on the mtime resolution
+        shots = Tree.getShotDB('pytree', path, lower=shot)
+        self.assertEqual(shots.tolist(), [shot, shot+1])
+        below, above = ShotIndex.get('pytree', path).nearest(shot, 2)
+        self.assertEqual(above.tolist(), [shot, shot+1])
+
 
 Tests.main()
@@ -34,10 +34,15 @@ def _mimport(name, level=1):
 import ctypes as _C
 import numpy as _N
 import threading as _threading
-import gc as _gc
 import os as _os
 import sys as _sys
 import time as _time
+import collections as _collections
+import re as _re
+try:
+    import queue as _queue
+except ImportError:
+    import Queue as _queue
 #### Load base python modules referenced ###
 #
 _ver = _mimport('version')
@@ -326,6 +331,30 @@ class Nci(object):
             super(Nci._nci_item, self).__init__(buflen, code,
                                                 pointer, _C.pointer(_C.c_int32(0)), 0, 0, 0, 0)
 
+    class _nci_itm(_C.Structure):
+        """single entry of a NCI_ITM list, terminated by an entry with code 0"""
+        _fields_ = [("buflen", _C.c_ushort),
+                    ("code",   _C.c_ushort),
+                    ("pointer", _C.c_void_p),
+                    ("retlen", _C.c_void_p)]
+
+    _bulk_ntype = {_C.c_uint8: _N.uint8, _C.c_uint16: _N.uint16,
+                   _C.c_uint32: _N.uint32, _C.c_int32: _N.int32,
+                   _C.c_uint64: _N.uint64}
+
+    @classmethod
+    def _bulkInfo(cls, name):
+        """Return (info, numpy dtype) of an item that fits a record array field"""
+        info = getattr(cls, str(name).upper(), None)
+        if not isinstance(info, tuple) or len(info) != 4:
+            raise KeyError('Unknown nci item "%s"' % (name,))
+        code, ctype, buflen, rtype = info
+        if ctype is _C.c_char_p:
+            return info, _N.dtype(('S', buflen))
+        if ctype in cls._bulk_ntype:
+            return info, _N.dtype(cls._bulk_ntype[ctype])
+        raise KeyError('nci item "%s" is not supported in bulk queries' % (name,))
+
     @staticmethod
     def _nciProp(info, doc=None):
         if isinstance(info, tuple):
@@ -335,18 +364,214 @@ class Nci(object):
             def getter(self):
                 return (int(self.get_flags) & info) != 0
         return property(getter, doc=doc)
+
+
+class NciSnapshot(object):
+    """Immutable set of node characteristics read with a single TreeGetNci
+    call, see TreeNode.nci_snapshot. Items are accessible as attributes,
+    e.g. snap.length, snap.usage_str or snap.flags. Used as a context
+    manager it serves the nci properties of its node until the block exits.
+    """
+    __slots__ = ('_node', '_values', '_prev')
+
+    DEFAULT_ITEMS = ('time_inserted', 'owner_id', 'class', 'dtype', 'length',
+                     'status', 'conglomerate_elt', 'get_flags', 'node_name',
+                     'path', 'depth', 'parent_relationship', 'fullpath',
+                     'minpath', 'usage', 'rlength', 'number_of_elts',
+                     'number_of_members', 'number_of_children',
+                     'data_in_nci', 'error_on_put', 'dtype_str', 'usage_str',
+                     'class_str', 'compression_method',
+                     'compression_method_str')
+
+    def __init__(self, node, values):
+        object.__setattr__(self, '_node', node)
+        object.__setattr__(self, '_values', values)
+        object.__setattr__(self, '_prev', None)
+
+    @staticmethod
+    def _info(name):
+        info = getattr(Nci, str(name).upper(), None)
+        if not isinstance(info, tuple) or len(info) != 4:
+            raise KeyError('Unknown nci item "%s"' % (name,))
+        return info
+
+    def __getattr__(self, name):
+        if name == 'flags':
+            return Flags(self['get_flags'])
+        if name == 'nid':
+            return self._node.nid
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, name):
+        return self._values[self._info(name)]
+
+    def __contains__(self, name):
+        try:
+            return self._info(name) in self._values
+        except KeyError:
+            return False
+
+    def __setattr__(self, name, value):
+        raise AttributeError('NciSnapshot is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('NciSnapshot is immutable')
+
+    def __len__(self):
+        return len(self._values)
+
+    def __enter__(self):
+        object.__setattr__(self, '_prev', self._node._nci_snapshot)
+        self._node._nci_snapshot = self
+        return self
+
+    def __exit__(self, *exc):
+        self._node._nci_snapshot = self._prev
+        object.__setattr__(self, '_prev', None)
+
+    def __repr__(self):
+        names = dict((v, k.lower()) for k, v in Nci.__dict__.items()
+                     if isinstance(v, tuple))
+        return 'NciSnapshot(%s, %s)' % (self._node, ', '.join(
+            '%s=%r' % (names[k], v) for k, v in self._values.items()))
+
+
+class NodeCache(object):
+    """LRU cache of path to nid lookups of a Tree, see Tree.enableNodeCache.
+    Entries are keyed on the nid the path is resolved from and the path.
+    @ivar hits: number of lookups served from the cache
+    @ivar misses: number of lookups that had to be resolved by TreeShr
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = int(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._nids = _collections.OrderedDict()
+        self._lock = _threading.Lock()
+
+    def __len__(self):
+        return len(self._nids)
+
+    def __repr__(self):
+        return 'NodeCache(size=%d/%d, hits=%d, misses=%d)' % (
+            len(self), self.maxsize, self.hits, self.misses)
+
+    def get(self, key):
+        """Return cached nid of key or None"""
+        with self._lock:
+            nid = self._nids.pop(key, None)
+            if nid is None:
+                self.misses += 1
+            else:
+                self._nids[key] = nid  # most recently used
+                self.hits += 1
+            return nid
+
+    def put(self, key, nid):
+        with self._lock:
+            self._nids[key] = nid
+            while len(self._nids) > self.maxsize:
+                self._nids.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries, the counters are kept"""
+        with self._lock:
+            self._nids.clear()
 #
 #################################################################
 
 
+class ShotIndex(object):
+    """Sorted shot numbers of the tree files of an experiment in a directory.
+    Instances are kept per (expt, directory) for the lifetime of the process
+    and rescan the directory only if its modification time changed.
+    """
+    _indexes = {}
+    _lock = _threading.Lock()
+    # directories modified within this many seconds of a scan are rescanned
+    # on the next refresh as the mtime resolution may hide later changes
+    mtime_margin = 2.
+
+    @classmethod
+    def get(cls, expt, path):
+        """Return the refreshed index of expt in path
+        @rtype: ShotIndex
+        """
+        key = (str(expt).lower(), _os.path.realpath(path))
+        with cls._lock:
+            index = cls._indexes.get(key, None)
+            if index is None:
+                index = cls._indexes[key] = cls(*key)
+        return index.refresh()
+
+    def __init__(self, expt, path):
+        self.expt = str(expt).lower()
+        self.path = path
+        self.mtime = None
+        self.shots = _N.zeros((0,), _N.int32)
+        self.scans = 0
+        self._lock = _threading.Lock()
+        self._regex = _re.compile(
+            r'^%s_(-?\d+)\.tree$' % _re.escape(self.expt), _re.M)
+
+    def __len__(self):
+        return self.shots.size
+
+    def __repr__(self):
+        return 'ShotIndex(%r, %r, shots=%d)' % (self.expt, self.path, len(self))
+
+    def refresh(self):
+        """Rescan the directory if it has been modified since the last scan
+        @rtype: ShotIndex
+        """
+        with self._lock:
+            mtime = _os.stat(self.path).st_mtime
+            if mtime == self.mtime:
+                return self
+            now = _time.time()
+            names = '\n'.join(_os.listdir(self.path))
+            shots = _N.array(self._regex.findall(names), _N.int32)
+            shots.sort()
+            self.shots = shots
+            self.scans += 1
+            self.mtime = None if now - mtime < self.mtime_margin else mtime
+        return self
+
+    def range(self, lower=None, upper=None):
+        """Return shots in [lower, upper]
+        @rtype: numpy.ndarray
+        """
+        shots = self.shots
+        beg = 0 if lower is None else _N.searchsorted(shots, int(lower), 'left')
+        end = shots.size if upper is None else _N.searchsorted(shots, int(upper), 'right')
+        return shots[beg:end]
+
+    def nearest(self, shot, count=1):
+        """Return up to count shots below and from shot on
+        @rtype: tuple of numpy.ndarray
+        """
+        shots = self.shots
+        idx = _N.searchsorted(shots, int(shot), 'left')
+        return shots[max(0, idx-count):idx], shots[idx:idx+count]
+
+
 class Tree(object):
     """Open an MDSplus Data Storage Hierarchy"""
 
     _lock = _threading.RLock()
+    _node_cache = None
+    # if True TreeNode instances of DEVICE nodes are only upgraded to their
+    # device class once a device specific attribute is accessed
+    lazy_devices = False
     public = False
     _id = 0
     path = None
     _ctx = None
+    _segment_indexes = None
 
     @property
     def pctx(self):
@@ -394,10 +619,7 @@ class Tree(object):
                     upper = "*"
                 # fetch data from server
                 return _con.Connection(server).get('getShotDb("%s",%s,%s,%s)' % (expt, path, str(lower), str(upper)),).data().tolist()
-            start = expt+'_'
-            files = [f[len(expt):-5].split('_') for f in _os.listdir(expt_path)
-                     if f.endswith('.tree') and f.startswith(start)]
-            return [int(f[1]) for f in files if len(f) == 2 and f[1] != 'model']
+            return ShotIndex.get(expt, expt_path).range(lower, upper)
         """The path argument is interpreted"""
         # try to convert to native datatype
         if isinstance(path, _dat.Data):
@@ -407,24 +629,23 @@ class Tree(object):
             path = getTreePath()[path]
         if isinstance(path, _ver.basestring):
             # path is str and used as path
-            shots = getshots(path, lower, upper)
+            shots = [getshots(path, lower, upper)]
         else:
             # path is undefined and the total list will be collected
             shots = []
             for expt_path in getTreePath():
                 try:
-                    shots += getshots(expt_path, lower, upper)
+                    shots.append(getshots(expt_path, lower, upper))
                 except:
                     pass  # may happen if path not reachable
         """filter result by upper and lower limits"""
-        if lower is not None or upper is not None:
-            if lower is None:
-                shots = _N.array(filter(lambda x: x <= int(upper), shots))
-            elif upper is None:
-                shots = _N.array(filter(lambda x: x >= int(lower), shots))
-            else:
-                shots = _N.array(filter(lambda x: x >= int(
-                    lower) and x <= int(upper), shots))
+        shots = _N.concatenate(
+            [_N.asarray(s, _N.int32).reshape(-1) for s in shots]
+            + [_N.zeros((0,), _N.int32)])
+        if lower is not None:
+            shots = shots[shots >= int(lower)]
+        if upper is not None:
+            shots = shots[shots <= int(upper)]
         shots.sort()
         return shots
 
@@ -492,7 +713,9 @@ class Tree(object):
         @type mode: str
         @rtype: Tree
         """
-        return Tree(self.tree, self.shot, mode)
+        tree = Tree(self.tree, self.shot, mode)
+        tree.lazy_devices = self.lazy_devices
+        return tree
 
     def readonly(self, shot=None):
         self.open('READONLY', shot)
@@ -506,6 +729,8 @@ class Tree(object):
     def open(self, mode='NORMAL', shot=None):
         if shot is not None:
             self.shot = shot
+        self._invalidateNodeCache()
+        self._segment_indexes = None
         try:
             env_name = '%s_path' % self.tree.lower()
 
@@ -594,14 +819,73 @@ class Tree(object):
         @rtype: None
         """
         with self._lock:
+            self._invalidateNodeCache()
             _exc.checkStatus(_TreeShr._TreeQuitTree(self.pctx, 0, 0))
 
     def close(self):
         """Close tree.
         @rtype: None
         """
+        self._invalidateNodeCache()
         _exc.checkStatus(_TreeShr._TreeClose(self.pctx, 0, 0))
 
+    def enableNodeCache(self, maxsize=1024):
+        """Cache path lookups of getNode and attribute style node access.
+        The cache is cleared by addNode, addDevice, deleteNode, rename, move,
+        setDefault, tag changes and by reopening the tree. Changes made
+        through other means, e.g. TCL, require node_cache.clear().
+        @param maxsize: maximum number of cached paths
+        @type maxsize: int
+        @rtype: NodeCache
+        """
+        self._node_cache = NodeCache(maxsize)
+        return self._node_cache
+
+    def disableNodeCache(self):
+        """Stop caching path lookups"""
+        self._node_cache = None
+
+    @property
+    def node_cache(self):
+        "NodeCache of this instance or None if not enabled"
+        return self._node_cache
+
+    def _invalidateNodeCache(self):
+        cache = self._node_cache
+        if cache is not None:
+            cache.clear()
+
+    def _findNode(self, path, start=None):
+        """Return nid of path relative to start nid or to the default node"""
+        path = str(path)
+        cache = self._node_cache
+        if cache is not None:
+            if start is None:
+                default = _C.c_int32(0)
+                _exc.checkStatus(
+                    _TreeShr._TreeGetDefaultNid(self.ctx, _C.byref(default)))
+                key = (default.value, path)
+            else:
+                key = (start, path)
+            nid = cache.get(key)
+            if nid is not None:
+                return nid
+        nid = _C.c_int32(0)
+        if start is None:
+            _exc.checkStatus(
+                _TreeShr._TreeFindNode(self.ctx,
+                                       _ver.tobytes(path),
+                                       _C.byref(nid)))
+        else:
+            _exc.checkStatus(
+                _TreeShr._TreeFindNodeRelative(self.ctx,
+                                               _ver.tobytes(path),
+                                               _C.c_int32(start),
+                                               _C.byref(nid)))
+        if cache is not None:
+            cache.put(key, nid.value)
+        return nid.value
+
     def _getDbi(self, info):
         """Return dbi data"""
         code, rtype, buflen = info
@@ -744,6 +1028,7 @@ class Tree(object):
         """
         nid = _C.c_int32(0)
         with self._lock:
+            self._invalidateNodeCache()
             _exc.checkStatus(
                 _TreeShr._TreeAddConglom(self.ctx,
                                          _ver.tobytes(nodename),
@@ -767,6 +1052,7 @@ class Tree(object):
             raise UsageError(usage)
         usagenum = 1 if usage_idx == 11 else usage_idx
         with self._lock:
+            self._invalidateNodeCache()
             _exc.checkStatus(
                 _TreeShr._TreeAddNode(self.ctx,
                                       _ver.tobytes(nodename),
@@ -812,6 +1098,7 @@ class Tree(object):
                                                        reset))
             _exc.checkStatus(
                 _TreeShr._TreeDeleteNodeExecute(self.ctx))
+            self._invalidateNodeCache()
 
     def deletePulse(self, shot):
         """Delete pulse.
@@ -902,12 +1189,7 @@ class Tree(object):
         if isinstance(name, (int, _scr.Int32)):
             ans = TreeNode(name, self)
         else:
-            nid = _C.c_int32(0)
-            _exc.checkStatus(
-                _TreeShr._TreeFindNode(self.ctx,
-                                       _ver.tobytes(str(name)),
-                                       _C.byref(nid)))
-            return TreeNode(int(nid.value), self)
+            return TreeNode(self._findNode(name), self)
         return ans
 
     def _getNodeWildIter(self, name, *usage):
@@ -957,6 +1239,64 @@ class Tree(object):
         """
         return TreeNodeArray([nid for nid in self._getNodeWildIter(name, *usage)], self)
 
+    def getNciBulk(self, nids, items=('path', 'usage', 'length', 'get_flags')):
+        """Return node characteristics of many nodes as a numpy record array.
+        The record array has one row per nid and one field per item plus the
+        field 'nid'. Each node is queried with one TreeGetNci call that fills
+        all requested items straight into its row.
+        @param nids: nodes to query
+        @type nids: TreeNodeArray, list or ndarray of int
+        @param items: nci item names, e.g. 'fullpath', 'usage', 'length', 'get_flags'
+        @type items: tuple of str
+        @rtype: numpy.recarray
+        """
+        if isinstance(nids, TreeNodeArray):
+            nids = nids._value
+        nids = _N.asarray(nids, _N.int32).reshape(-1)
+        items = [str(item).lower() for item in items]
+        infos, fields = [], [('nid', _N.int32)]
+        for item in items:
+            info, ntype = Nci._bulkInfo(item)
+            infos.append(info)
+            fields.append((item, ntype))
+        ans = _N.zeros((nids.size,), _N.dtype(fields))
+        ans['nid'] = nids
+        if nids.size == 0 or not items:
+            return ans.view(_N.recarray)
+        num = len(infos)
+        # one item list per node, pointers are computed vectorized
+        itm = _N.zeros((nids.size, num+1), _N.dtype(Nci._nci_itm))
+        retlen = _N.zeros((nids.size, num), _N.int32)
+        base = ans.__array_interface__['data'][0]
+        rows = _N.arange(nids.size, dtype=_N.uint64)
+        rlbase = retlen.__array_interface__['data'][0]
+        for i, (info, item) in enumerate(zip(infos, items)):
+            itm['code'][:, i] = info[0]
+            itm['buflen'][:, i] = ans.dtype[item].itemsize
+            itm['pointer'][:, i] = base + rows*ans.itemsize + \
+                ans.dtype.fields[item][1]
+            itm['retlen'][:, i] = rlbase + rows*retlen.strides[0] + \
+                i*retlen.strides[1]
+        itmbase = itm.__array_interface__['data'][0]
+        stride = itm.strides[0]
+        ctx = self.ctx
+        getnci = _TreeShr._TreeGetNci
+        for row in _ver.xrange(nids.size):
+            _exc.checkStatus(getnci(ctx, _C.c_int32(int(nids[row])),
+                                    _C.c_void_p(itmbase + row*stride)))
+        for item in items:
+            if ans.dtype[item].kind == 'S':
+                ans[item] = _N.char.rstrip(ans[item])
+        return ans.view(_N.recarray)
+
+    def snapshot(self, chunk=4096):
+        """Load the node table of the tree into a TreeSnapshot.
+        @param chunk: number of nodes queried per getNciBulk call
+        @type chunk: int
+        @rtype: TreeSnapshot
+        """
+        return TreeSnapshot(self, chunk)
+
     @classmethodX
     def getTimeContext(self):
         """Get time context for retrieving segmented records (begin,end,delta)
@@ -1033,6 +1373,7 @@ class Tree(object):
             _exc.checkStatus(
                 _TreeShr._TreeRemoveTag(self.ctx,
                                         _C.c_char_p(_ver.tobytes(tag))))
+            self._invalidateNodeCache()
 
     @classmethodX
     def setCurrent(self, tree=None, shot=None):
@@ -1062,6 +1403,7 @@ class Tree(object):
             raise TypeError('default node must be a TreeNode')
         if not node.ctx.value == self.ctx.value:
             raise TypeError('TreeNode must be in same tree')
+        self._invalidateNodeCache()
         _exc.checkStatus(
             _TreeShr._TreeSetDefaultNid(self.ctx,
                                         node._nid))
@@ -1198,6 +1540,9 @@ class TreeNode(_dat.TreeRef, _dat.Data):
     _validation = None
     _nid = None
     _path = None
+    _nci_snapshot = None
+    _lazy = False
+    _device = None
 
     @property
     def ctx(self): return _C.c_void_p(_TreeShr.TreeDbid()
@@ -1217,13 +1562,33 @@ class TreeNode(_dat.TreeRef, _dat.Data):
         head = nid._head if isinstance(nid, TreeNode) else head
         if not isinstance(head, (Device,)) and type(node) is TreeNode:
             TreeNode.__init__(node, nid, tree, head, *a, **kw)
-            try:
-                if str(node.usage) == "DEVICE":
-                    return node.record.getDevice(node, head=0)
-            except(_exc.TreeNODATA, _exc.DevNOT_A_PYDEVICE, _exc.DevPYDEVICE_NOT_FOUND):
-                pass
+            if node.tree.lazy_devices:
+                node._lazy = True
+                return node
+            device = node._getDevice()
+            if device is not None:
+                return device
         return node
 
+    def _getDevice(self):
+        """Return device instance if this is the head of a python device"""
+        try:
+            if str(self.usage) == "DEVICE":
+                return self.record.getDevice(self, head=0)
+        except(_exc.TreeNODATA, _exc.DevNOT_A_PYDEVICE, _exc.DevPYDEVICE_NOT_FOUND):
+            pass
+        return None
+
+    def upgrade(self):
+        """Return the device instance of a node created with
+        Tree.lazy_devices enabled, or the node itself if it is no device head.
+        @rtype: TreeNode
+        """
+        if self._lazy:
+            self._lazy = False
+            self._device = self._getDevice()
+        return self if self._device is None else self._device
+
     def __init__(self, nid, tree=None, head=None, *a, **kw):
         """Initialze TreeNode
         @param nid: Index of the node in the tree.
@@ -1316,6 +1681,9 @@ class TreeNode(_dat.TreeRef, _dat.Data):
 
     def _getNci(self, info):
         """Return nci data"""
+        snap = self._nci_snapshot
+        if snap is not None and info in snap._values:
+            return snap._values[info]
         code, ctype, buflen, rtype = info
         if ctype is _C.c_char_p:
             ans = ctype((b' ')*buflen)
@@ -1336,6 +1704,47 @@ class TreeNode(_dat.TreeRef, _dat.Data):
             return TreeNodeArray([int(ans[i]) for i in _ver.xrange(retlen//4)], self.tree)
         return rtype(ans.value)
 
+    def nci_snapshot(self, items=None):
+        """Read several nci items with a single TreeGetNci call.
+        The returned NciSnapshot may be used as a context manager in which
+        case the nci properties of this node are served from the snapshot:
+            with node.nci_snapshot():
+                print(node.usage, node.length, node.on)
+        @param items: nci item names, defaults to NciSnapshot.DEFAULT_ITEMS
+        @type items: tuple of str
+        @rtype: NciSnapshot
+        """
+        if items is None:
+            items = NciSnapshot.DEFAULT_ITEMS
+        infos = [NciSnapshot._info(item) for item in items]
+        itm = (Nci._nci_itm*(len(infos)+1))()
+        bufs, retlens = [], (_C.c_int32*len(infos))()
+        for i, (code, ctype, buflen, rtype) in enumerate(infos):
+            if ctype is _C.c_char_p:
+                buf = _C.create_string_buffer(buflen)
+            else:
+                buf = ctype()
+            bufs.append(buf)
+            itm[i].buflen = buflen
+            itm[i].code = code
+            itm[i].pointer = _C.addressof(buf)
+            itm[i].retlen = _C.addressof(retlens) + i*_C.sizeof(_C.c_int32)
+        _exc.checkStatus(_TreeShr._TreeGetNci(self.ctx, self._nid, itm))
+        values = {}
+        for info, buf, retlen in zip(infos, bufs, retlens):
+            code, ctype, buflen, rtype = info
+            if rtype is str:
+                values[info] = _ver.tostr(buf.raw[0:retlen].rstrip())
+            elif rtype is None:
+                if ctype is _C.c_int32:
+                    values[info] = TreeNode(int(buf.value), self.tree)
+                else:
+                    values[info] = TreeNodeArray(
+                        [int(buf[i]) for i in _ver.xrange(retlen//4)], self.tree)
+            else:
+                values[info] = rtype(buf.value)
+        return NciSnapshot(self, values)
+
     def _setNci(self, code, setting):
         pointer = _C.cast(_C.pointer(_C.c_uint32(setting)), _C.c_char_p)
         _exc.checkStatus(_TreeShr._TreeSetNci(
@@ -1633,10 +2042,17 @@ class TreeNode(_dat.TreeRef, _dat.Data):
             not name.endswith('__') and
                 name[2:].upper() == name[2:]):
             return self.getExtendedAttribute(name[2:])
+        if self._device is not None and not name.startswith('__'):
+            return getattr(self._device, name)
         try:
             return _getNodeByAttr(self, name)
         except (_exc.TreeNNF, _exc.TreePARSEERR):
             pass
+        # lazy handles only pay for the upgrade if no node matched
+        if self._lazy and not name.startswith('__'):
+            device = self.upgrade()
+            if device is not self:
+                return getattr(device, name)
         return super(TreeNode, self).__getattr__(name)
         # if name=='length':
         #    raise AttributeError
@@ -1730,6 +2146,7 @@ class TreeNode(_dat.TreeRef, _dat.Data):
         @type tag: str
         @rtype: None
         """
+        self.tree._invalidateNodeCache()
         _exc.checkStatus(
             _TreeShr._TreeAddTag(self.ctx,
                                  self._nid,
@@ -2140,13 +2557,7 @@ class TreeNode(_dat.TreeRef, _dat.Data):
         if isinstance(path, (int, _scr.Int32)):
             ans = TreeNode(path, self.tree)
         else:
-            nidout = _C.c_int32(0)
-            _exc.checkStatus(
-                _TreeShr._TreeFindNodeRelative(self.ctx,
-                                               _ver.tobytes(str(path)),
-                                               _C.c_int32(self.nid),
-                                               _C.byref(nidout)))
-            return TreeNode(int(nidout.value), self.tree)
+            return TreeNode(self.tree._findNode(path, self.nid), self.tree)
         return ans
 
     def getNodeName(self):
@@ -2266,24 +2677,177 @@ class TreeNode(_dat.TreeRef, _dat.Data):
         @return: Data segment
         @rtype: Signal | None
         """
-        val = _dsc.DescriptorXD()._setTree(self.tree)
-        dim = _dsc.DescriptorXD()._setTree(self.tree)
+        with _dsc.DescriptorXD()._setTree(self.tree) as val_xd, \
+                _dsc.DescriptorXD()._setTree(self.tree) as dim_xd:
+            try:
+                _exc.checkStatus(
+                    _TreeShr._TreeGetSegment(self.ctx,
+                                             self._nid,
+                                             _C.c_int32(int(idx)),
+                                             val_xd.ref,
+                                             dim_xd.ref))
+            except _exc.TreeNOSEGMENTS:
+                return None
+            val, dim = val_xd.value, dim_xd.value
         try:
+            scl = self.getSegmentScale()
+        except:
+            scl = None
+        if scl is None:
+            return _cmp.Signal(val, None, dim)
+        return _cmp.Signal(scl, val, dim)
+
+    def getSegmentInfo(self, idx):
+        """Return the shape information of a segment
+        @param idx: The index of the segment to query. Indexes start with 0.
+        @type idx: int
+        @return: A Tuple of (dtype, shape, rows_filled) where shape is the
+                 numpy shape of the allocated segment, i.e. rows first
+        @rtype: Tuple(int, tuple, int)
+        """
+        dtype = _C.c_byte(0)
+        dimct = _C.c_byte(0)
+        dims = (_C.c_int32*8)()
+        next_row = _C.c_int32(0)
+        _exc.checkStatus(
+            _TreeShr._TreeGetSegmentInfo(self.ctx,
+                                         self._nid,
+                                         _C.c_int32(int(idx)),
+                                         _C.byref(dtype),
+                                         _C.byref(dimct),
+                                         dims,
+                                         _C.byref(next_row)))
+        shape = tuple(dims[dimct.value-1::-1]) if dimct.value > 0 else ()
+        return dtype.value & 0xff, shape, next_row.value
+
+    def getSegments(self, first=0, last=-1, out=None):
+        """Read a range of segments into one contiguous data and time array.
+        The segments are copied straight from the segment buffers; no Signal
+        or Data instance is built per segment. Pass the arrays returned by a
+        previous call as out to read repeatedly without allocation.
+        @param first: index of the first segment to read, negative counts from the end
+        @type first: int
+        @param last: index of the last segment to read (inclusive), negative counts from the end
+        @type last: int
+        @param out: optional (data, time) buffers; either may be None.
+                    The first dimension must hold at least the total number of rows.
+        @type out: tuple(ndarray, ndarray)
+        @return: views on the filled rows (data, time); time is None for dimensionless segments
+        @rtype: tuple(ndarray, ndarray)
+        """
+        num = self.getNumSegments()
+        if first < 0:
+            first += num
+        if last < 0:
+            last += num
+        if first < 0 or last >= num or first > last:
+            raise IndexError('segment range %d..%d not in 0..%d' %
+                             (first, last, num-1))
+        data_out, time_out = (None, None) if out is None else out
+        rows = []
+        dtype, shape = None, None
+        for idx in _ver.xrange(first, last+1):
+            dtype, shape, filled = self.getSegmentInfo(idx)
+            rows.append(filled)
+        total = sum(rows)
+        ntype = getattr(_dsc.dtypeToArrayClass.get(dtype), 'ntype', None)
+        if ntype is None:
+            raise TypeError('Segments of dtype %d are unsupported.' % dtype)
+        try:
+            scl = self.getSegmentScale()
+        except _exc.MDSplusException:
+            scl = None
+        if scl is not None or data_out is None or data_out.dtype != ntype:
+            # read raw values first, scaled or casted copy is done at the end
+            data = _N.empty((total,)+tuple(shape[1:]), ntype)
+        else:
+            data = data_out
+        if data.shape[0] < total or data.shape[1:] != tuple(shape[1:]):
+            raise ValueError('data buffer of shape %s cannot hold %d rows of shape %s' %
+                             (data.shape, total, tuple(shape[1:])))
+        time = time_out
+        val = _dsc.DescriptorXD()
+        dim = _dsc.DescriptorXD()
+        row = 0
+        for idx, filled in zip(_ver.xrange(first, last+1), rows):
             _exc.checkStatus(
                 _TreeShr._TreeGetSegment(self.ctx,
                                          self._nid,
-                                         _C.c_int32(int(idx)),
+                                         _C.c_int32(idx),
                                          val.ref,
                                          dim.ref))
-        except _exc.TreeNOSEGMENTS:
+            try:
+                seg = self._segment_array(val)
+                data[row:row+filled] = seg[:filled]
+                if dim.pointer:
+                    seg = self._segment_array(dim)
+                    if time is None:
+                        time = _N.empty((total,), seg.dtype)
+                    time[row:row+filled] = seg[:filled]
+            finally:
+                val.release()
+                dim.release()
+            row += filled
+        direct = data is data_out
+        data = data[:total]
+        if scl is not None:
+            data = _cmp.Signal(scl, _arr.Array(data), None).data()
+        if data_out is not None and not direct:
+            data_out[:total] = data
+            data = data_out[:total]
+        if time is not None:
+            time = time[:total]
+        return data, time
+
+    def _segment_array(self, xd):
+        """numpy view on an array in xd, evaluates expressions like Range"""
+        desc = _C.cast(xd.pointer, _dsc.DescriptorA.PTR).contents
+        if desc.dclass == _dsc.DescriptorA.dclass_id:
+            arr = _dsc.DescriptorA(desc)._as_numpy()
+            if arr is not None:
+                return arr
+        return _N.asarray(xd._setTree(self.tree).value.data())
+
+    def getSegmentIndex(self, refresh=True):
+        """Return the cached segment index of this node
+        @param refresh: synchronize the index with the node before returning it
+        @type refresh: bool
+        @rtype: SegmentIndex
+        """
+        with self._lock:
+            cache = self.tree._segment_indexes
+            if cache is None:
+                cache = self.tree._segment_indexes = {}
+            index = cache.get(self.nid, None)
+            if index is None:
+                index = cache[self.nid] = SegmentIndex(self)
+        if refresh:
+            index.refresh()
+        return index
+
+    def getSegmentRange(self, startTime=None, endTime=None):
+        """Return the index range of the segments overlapping a time window.
+        Uses the cached segment index, see getSegmentIndex.
+        @param startTime: start of the time window, None for open
+        @param endTime: end of the time window, None for open
+        @return: (first, last) segment index or None if no segment overlaps
+        @rtype: tuple
+        """
+        return self.getSegmentIndex(False).find(startTime, endTime)
+
+    def getSegmentsInRange(self, startTime=None, endTime=None, out=None):
+        """Read all segments overlapping a time window, see getSegments.
+        Only the overlapping segments are read, their data is not trimmed.
+        @param startTime: start of the time window, None for open
+        @param endTime: end of the time window, None for open
+        @param out: optional (data, time) buffers
+        @return: (data, time) or None if no segment overlaps
+        @rtype: tuple(ndarray, ndarray)
+        """
+        rng = self.getSegmentRange(startTime, endTime)
+        if rng is None:
             return None
-        try:
-            scl = self.getSegmentScale()
-        except:
-            scl = None
-        if scl is None:
-            return _cmp.Signal(val.value, None, dim.value)
-        return _cmp.Signal(scl, val.value, dim.value)
+        return self.getSegments(rng[0], rng[1], out=out)
 
     def getSegmentDim(self, idx):
         """Return dimension of segment
@@ -2292,17 +2856,17 @@ class TreeNode(_dat.TreeRef, _dat.Data):
         @return: Segment dimension
         @rtype: Dimension
         """
-        dim = _dsc.DescriptorXD()._setTree(self.tree)
-        try:
-            _exc.checkStatus(
-                _TreeShr._TreeGetSegment(self.ctx,
-                                         self._nid,
-                                         _C.c_int32(int(idx)),
-                                         None,
-                                         dim.ref))
-        except _exc.TreeNOSEGMENTS:
-            return None
-        return dim.value
+        with _dsc.DescriptorXD()._setTree(self.tree) as dim:
+            try:
+                _exc.checkStatus(
+                    _TreeShr._TreeGetSegment(self.ctx,
+                                             self._nid,
+                                             _C.c_int32(int(idx)),
+                                             None,
+                                             dim.ref))
+            except _exc.TreeNOSEGMENTS:
+                return None
+            return dim.value
 
     def getSegmentLimits(self, idx):
         """Return the start and end times of a given segment
@@ -2311,16 +2875,15 @@ class TreeNode(_dat.TreeRef, _dat.Data):
         @return: A Tuple of (startTime, endTime)
         @rtype: Tuple(Data, Data)
         """
-        start = _dsc.DescriptorXD()._setTree(self.tree)
-        end = _dsc.DescriptorXD()._setTree(self.tree)
-        _exc.checkStatus(
-            _TreeShr._TreeGetSegmentLimits(self.ctx,
-                                           self._nid,
-                                           _C.c_int32(int(idx)),
-                                           start.ref,
-                                           end.ref))
-        start, end = start.value, end.value
-        _gc.collect()
+        with _dsc.DescriptorXD()._setTree(self.tree) as start_xd, \
+                _dsc.DescriptorXD()._setTree(self.tree) as end_xd:
+            _exc.checkStatus(
+                _TreeShr._TreeGetSegmentLimits(self.ctx,
+                                               self._nid,
+                                               _C.c_int32(int(idx)),
+                                               start_xd.ref,
+                                               end_xd.ref))
+            start, end = start_xd.value, end_xd.value
         if start is not None or end is not None:
             return (start, end)
 
@@ -2345,24 +2908,24 @@ class TreeNode(_dat.TreeRef, _dat.Data):
         """sets the scale expression of a segmetned Node
         @rtype: expression for the data field; should contain $VALUE
         """
-        xd = _dsc.DescriptorXD()._setTree(self.tree)
-        _exc.checkStatus(
-            _TreeShr._TreeGetSegmentScale(self.ctx,
-                                          self._nid,
-                                          xd.ref))
-        return xd.value
+        with _dsc.DescriptorXD()._setTree(self.tree) as xd:
+            _exc.checkStatus(
+                _TreeShr._TreeGetSegmentScale(self.ctx,
+                                              self._nid,
+                                              xd.ref))
+            return xd.value
 
     def getSegmentTimes(self):
         num = _C.c_int32(0)
-        start = _dsc.DescriptorXD()._setTree(self.tree)
-        end = _dsc.DescriptorXD()._setTree(self.tree)
-        _exc.checkStatus(
-            _TreeShr._TreeGetSegmentTimesXd(self.ctx,
-                                            self._nid,
-                                            _C.byref(num),
-                                            start.ref,
-                                            end.ref))
-        return num.value, start.value, end.value
+        with _dsc.DescriptorXD()._setTree(self.tree) as start, \
+                _dsc.DescriptorXD()._setTree(self.tree) as end:
+            _exc.checkStatus(
+                _TreeShr._TreeGetSegmentTimesXd(self.ctx,
+                                                self._nid,
+                                                _C.byref(num),
+                                                start.ref,
+                                                end.ref))
+            return num.value, start.value, end.value
 
     def getSegmentEnd(self, idx):
         """return end of segment
@@ -2699,6 +3262,7 @@ class TreeNode(_dat.TreeRef, _dat.Data):
             _TreeShr._TreeRenameNode(self.ctx,
                                      self._nid,
                                      _ver.tobytes(newpath)))
+        self.tree._invalidateNodeCache()
 
     def putData(self, value):
         """Store data
@@ -3277,13 +3841,34 @@ class TreeNodeArray(_dat.TreeRef, _arr.Int32Array):  # HINT: TreeNodeArray begin
         return self
 
     def getUsage(self):
-        """Get usage of nodes
+        """Get usage codes of nodes, names are in usage_str
         @return: Usage
-        @rtype: StringArray
+        @rtype: Uint8Array
         """
         return self.usage
 
+    _nci_bulk = set(('path', 'fullpath', 'minpath', 'node_name',
+                     'original_part_name', 'usage', 'usage_str', 'dtype_str',
+                     'class_str', 'length', 'rlength', 'get_flags', 'depth',
+                     'status', 'owner_id', 'number_of_children',
+                     'number_of_members', 'number_of_elts', 'version'))
+
+    # getnci returns these as DTYPE_L while the nci buffers are unsigned
+    _nci_signed = set(('depth', 'number_of_children', 'number_of_members',
+                       'number_of_elts'))
+
+    def _getNciBulk(self, name):
+        """column of Tree.getNciBulk typed like getnci($,name)"""
+        ans = self.tree.getNciBulk(self, (name,))[name]
+        if ans.dtype.kind == 'S':
+            return _arr.StringArray(ans)
+        if name in TreeNodeArray._nci_signed:
+            ans = ans.astype(_N.int32)
+        return _arr.Array(ans)
+
     def __getattr__(self, name):
+        if name in TreeNodeArray._nci_bulk:
+            return self._getNciBulk(name)
         try:
             return self.tree.tdiExecute('getnci($,$)', self._value, name)
         except:
@@ -3299,6 +3884,577 @@ class TreeNodeArray(_dat.TreeRef, _arr.Int32Array):  # HINT: TreeNodeArray begin
                 return _apd.List(*ans)
 
 
+class TreeSnapshot(object):
+    """In-memory copy of the node table of a tree, see Tree.snapshot.
+    Nodes are stored in rows sorted by nid. The link arrays parent, child,
+    brother and member hold nids, -1 if there is no such node.
+    Queries are answered from the arrays without native calls.
+    """
+    _items = ('parent', 'child', 'brother', 'member', 'parent_relationship',
+              'node_name', 'fullpath', 'usage', 'get_flags', 'depth')
+
+    def __init__(self, tree, chunk=4096):
+        self.tree = tree
+        nids = _N.unique(_N.array(
+            [0]+list(tree._getNodeWildIter('\\%s::TOP***' % tree.tree)),
+            _N.int32))
+        num = nids.size
+        self.nid = nids
+        self.parent = _N.empty((num,), _N.int32)
+        self.child = _N.empty((num,), _N.int32)
+        self.brother = _N.empty((num,), _N.int32)
+        self.member = _N.empty((num,), _N.int32)
+        self.is_member = _N.empty((num,), _N.bool_)
+        self.name = _N.empty((num,), 'S12')
+        self.usage = _N.empty((num,), _N.uint8)
+        self.flags = _N.empty((num,), _N.uint32)
+        self.depth = _N.empty((num,), _N.uint32)
+        paths = []
+        for beg in _ver.xrange(0, num, chunk):
+            end = min(beg+chunk, num)
+            nci = tree.getNciBulk(nids[beg:end], self._items)
+            for link in ('parent', 'child', 'brother', 'member'):
+                getattr(self, link)[beg:end] = nci[link]
+            self.is_member[beg:end] = \
+                nci['parent_relationship'] == Nci._IS_MEMBER
+            self.name[beg:end] = nci['node_name']
+            self.usage[beg:end] = nci['usage']
+            self.flags[beg:end] = nci['get_flags']
+            self.depth[beg:end] = nci['depth']
+            paths.extend(_ver.tostr(path) for path in nci['fullpath'])
+        # TreeGetNci does not touch the buffer of missing links, i.e. 0
+        for link in (self.child, self.brother, self.member):
+            link[link == 0] = -1
+        self.parent[self.parent == nids] = -1
+        self.path = _N.array(paths, 'S')
+        self._text = '\n'.join(paths)+'\n'
+        self._starts = _N.cumsum(
+            [0]+[len(path)+1 for path in paths[:-1]]).astype(_N.int64)
+        self._parent_row = self.index(self.parent)
+        tags, tag_nids = [], []
+        nid = _C.c_int32(0)
+        tagctx = _C.c_void_p(0)
+        _TreeShr._TreeFindTagWild.restype = _C.c_char_p
+        try:
+            while True:
+                tag_ptr = _TreeShr._TreeFindTagWild(tree.ctx,
+                                                    _C.c_char_p(b'***'),
+                                                    _C.byref(nid),
+                                                    _C.byref(tagctx))
+                if tag_ptr is None:
+                    break
+                tags.append(tag_ptr.rstrip())
+                tag_nids.append(nid.value)
+        finally:
+            _TreeShr.TreeFindTagEnd(_C.byref(tagctx))
+        self.tag_names = _N.array(tags, 'S')
+        self.tag_nids = _N.array(tag_nids, _N.int32)
+
+    def __len__(self):
+        return self.nid.size
+
+    def __repr__(self):
+        return 'TreeSnapshot(%s, nodes=%d, tags=%d)' % (
+            self.tree, len(self), self.tag_nids.size)
+
+    def index(self, nids):
+        """Return the rows of nids, -1 for unknown nids"""
+        nids = _N.asarray(nids, _N.int32)
+        rows = _N.searchsorted(self.nid, nids)
+        rows[rows == self.nid.size] = 0
+        return _N.where(self.nid[rows] == nids, rows, -1)
+
+    def _matchRows(self, regex):
+        pos = _N.array([m.start() for m in regex.finditer(self._text)],
+                       _N.int64)
+        return _N.searchsorted(self._starts, pos, 'right')-1
+
+    @staticmethod
+    def _glob(pattern):
+        """'*' and '%' match within a node name, '**' across delimiters"""
+        parts = _re.split(r'(\*\*|\*|%|\?)', pattern.upper())
+        rx = {'**': '[^\n]*', '*': '[^.:\n]*', '%': '[^.:\n]', '?': '[^.:\n]'}
+        return ''.join(rx.get(part, _re.escape(part)) for part in parts)
+
+    def mask(self, path=None, regex=None, usage=None, flags=0, noflags=0,
+             under=None, tag=None):
+        """Return boolean mask of the rows matching all given criteria
+        @param path: glob on the full path, e.g. '\\PYTREE::TOP.**:SIG*'
+        @type path: str
+        @param regex: regular expression searched in the full path
+        @type regex: str or compiled pattern
+        @param usage: usage names or codes the node must have
+        @type usage: str or list
+        @param flags: flag mask that must be set (see Flags)
+        @type flags: int
+        @param noflags: flag mask that must be cleared
+        @type noflags: int
+        @param under: only descendants of this node
+        @type under: TreeNode or int
+        @param tag: glob on the tagnames of the node
+        @type tag: str
+        @rtype: numpy.ndarray
+        """
+        mask = _N.ones((len(self),), _N.bool_)
+        if path is not None:
+            sel = _N.zeros_like(mask)
+            sel[self._matchRows(_re.compile(
+                '^%s$' % self._glob(path), _re.M))] = True
+            mask &= sel
+        if regex is not None:
+            if isinstance(regex, _ver.basestring):
+                regex = _re.compile(regex)
+            sel = _N.zeros_like(mask)
+            sel[self._matchRows(_re.compile(
+                '^[^\n]*?(?:%s)' % regex.pattern, regex.flags | _re.M))] = True
+            mask &= sel
+        if usage is not None:
+            if isinstance(usage, (_ver.basestring, int)):
+                usage = (usage,)
+            codes = []
+            for u in usage:
+                if isinstance(u, _ver.basestring):
+                    try:
+                        u = _usage_table[u.upper()]
+                    except KeyError:
+                        raise UsageError(u)
+                codes.append(u)
+            mask &= _N.in1d(self.usage, codes)
+        if flags:
+            mask &= (self.flags & flags) == flags
+        if noflags:
+            mask &= (self.flags & noflags) == 0
+        if under is not None:
+            mask &= self._under(int(under))
+        if tag is not None:
+            rx = _re.compile('^%s$' % self._glob(tag).replace('[^.:\n]', '.'),
+                             _re.I)
+            nids = [nid for name, nid in zip(self.tag_names, self.tag_nids)
+                    if rx.match(_ver.tostr(name)) or
+                    rx.match(_ver.tostr(name).split('::')[-1])]
+            sel = _N.zeros_like(mask)
+            rows = self.index(nids)
+            sel[rows[rows >= 0]] = True
+            mask &= sel
+        return mask
+
+    def _under(self, nid):
+        """mask of all descendants of nid"""
+        root = self.index(nid)
+        mask = _N.zeros((len(self),), _N.bool_)
+        if root < 0:
+            return mask
+        cur = self._parent_row
+        while True:
+            mask |= cur == root
+            valid = cur >= 0
+            if not valid.any():
+                return mask
+            cur = _N.where(valid, self._parent_row[cur], -1)
+
+    def query(self, *args, **kwargs):
+        """Return the nodes matching all criteria, see mask
+        @rtype: TreeNodeArray
+        """
+        return TreeNodeArray(self.nid[self.mask(*args, **kwargs)], self.tree)
+
+    def children(self, nid):
+        """nids of the children of nid"""
+        return self.nid[(self.parent == int(nid)) & ~self.is_member]
+
+    def members(self, nid):
+        """nids of the members of nid"""
+        return self.nid[(self.parent == int(nid)) & self.is_member]
+
+    def _walk(self, nid):
+        """Yield (row, level) of the subtree of nid, members before children"""
+        member = self.index(self.member).tolist()
+        child = self.index(self.child).tolist()
+        brother = self.index(self.brother).tolist()
+        root = int(self.index(nid))
+        stack = [(root, 0)] if root >= 0 else []
+        while stack:
+            row, level = stack.pop()
+            yield row, level
+            sub = []
+            for link in (member[row], child[row]):
+                while link >= 0:
+                    sub.append((link, level+1))
+                    link = brother[link]
+            stack.extend(reversed(sub))
+
+    def walk(self, nid=0):
+        """Yield (nid, level) of the subtree of nid in traverser order"""
+        nids = self.nid.tolist()
+        for row, level in self._walk(nid):
+            yield nids[row], level
+
+    def dump(self, nid=0, indent='  '):
+        """Return the subtree of nid as text, one node name per line"""
+        names = [_ver.tostr(name).rstrip() for name in self.name]
+        is_member = self.is_member.tolist()
+        return '\n'.join('%s%s%s' % (
+            indent*level, ':' if is_member[row] else '.', names[row])
+            for row, level in self._walk(nid))
+
+
+class SegmentIndex(object):
+    """Cached index of the segments of a node.
+
+    Holds start time, end time, number of rows and row offset of every
+    segment so that time windows can be resolved by binary search instead of
+    querying the limits of each segment. The index is built once and then
+    refreshed incrementally: a refresh only re-reads the last known segment,
+    which may still be filling, and the segments appended since. The index
+    is rebuilt if the number of segments shrank or the limits of the first
+    or the last complete segment changed; other rewrites of segments in
+    place are not detected.
+    Use TreeNode.getSegmentIndex() to obtain the cached instance of a node.
+    """
+
+    def __init__(self, node):
+        self.node = node
+        self.start = _N.empty((0,), _N.float64)
+        self.end = _N.empty((0,), _N.float64)
+        self._rows = _N.empty((0,), _N.int64)
+        self._offset = None
+
+    def __len__(self):
+        return self.start.size
+
+    @staticmethod
+    def _limit(value):
+        if value is None:
+            return _N.nan
+        return _dat.Data(value).data()
+
+    @classmethod
+    def _limits(cls, values):
+        """convert the List returned by getSegmentTimes in one go"""
+        limits = _N.array(values._value.tolist())
+        if limits.ndim != 1 or limits.dtype == object:
+            # missing or non scalar limits
+            limits = _N.array([cls._limit(value) for value in values])
+        return limits
+
+    def _changed(self, idx):
+        limits = self.node.getSegmentLimits(idx) or (None, None)
+        for value, cached in zip(limits, (self.start[idx], self.end[idx])):
+            value = self._limit(value)
+            if value != cached and not (value != value and cached != cached):
+                return True
+        return False
+
+    def refresh(self):
+        """Synchronize the index with the segments stored in the node
+        @return: number of segments
+        @rtype: int
+        """
+        node = self.node
+        with node._lock:
+            num = node.getNumSegments()
+            known = len(self)
+            if num < known or known > 0 and (
+                    self._changed(0) or known > 1 and self._changed(known-2)):
+                known = 0  # node was rewritten
+            if known == 0 and num > 0:
+                _, start, end = node.getSegmentTimes()
+                start = self._limits(start)
+                end = self._limits(end)
+                rows = _N.full((num,), -1, _N.int64)
+            elif num > 0:
+                first = known-1  # last known segment may have grown
+                limits = [node.getSegmentLimits(idx) or (None, None)
+                          for idx in _ver.xrange(first, num)]
+                start = _N.concatenate((self.start[:first], _N.array(
+                    [self._limit(lim[0]) for lim in limits])))
+                end = _N.concatenate((self.end[:first], _N.array(
+                    [self._limit(lim[1]) for lim in limits])))
+                rows = _N.concatenate((self._rows[:first], _N.full(
+                    (num-first,), -1, _N.int64)))
+            else:
+                start = end = _N.empty((0,), _N.float64)
+                rows = _N.empty((0,), _N.int64)
+            self.start, self.end, self._rows = start, end, rows
+            self._offset = None
+        return num
+
+    @property
+    def rows(self):
+        """number of rows filled in each segment"""
+        with self.node._lock:
+            missing = _N.nonzero(self._rows < 0)[0]
+            if missing.size:
+                for idx in missing:
+                    self._rows[idx] = self.node.getSegmentInfo(int(idx))[2]
+                self._offset = None
+            return self._rows
+
+    @property
+    def offset(self):
+        """row offset of each segment in the concatenated record"""
+        with self.node._lock:
+            if self._offset is None:
+                rows = self.rows
+                self._offset = _N.zeros((rows.size,), _N.int64)
+                _N.cumsum(rows[:-1], out=self._offset[1:])
+            return self._offset
+
+    def find(self, t0=None, t1=None, refresh=True):
+        """Return the index range of the segments overlapping [t0, t1]
+        @param t0: start of the time window, None for open
+        @param t1: end of the time window, None for open
+        @param refresh: synchronize with the node before searching
+        @type refresh: bool
+        @return: (first, last) segment index or None if no segment overlaps
+        @rtype: tuple
+        """
+        if refresh:
+            self.refresh()
+        num = len(self)
+        first = 0 if t0 is None else int(
+            _N.searchsorted(self.end, self._limit(t0), 'left'))
+        last = num-1 if t1 is None else int(
+            _N.searchsorted(self.start, self._limit(t1), 'right'))-1
+        if first > last or first >= num or last < 0:
+            return None
+        return first, last
+
+
+class SegmentWriter(object):
+    """Buffered writer for segmented nodes.
+
+    Rows are collected in a set of preallocated numpy blocks. Each full block
+    is handed to a background thread which stores it with a single
+    makeTimestampedSegment call, so the producer pays neither the per row
+    conversion of putRow nor the write latency. Complete segments can be
+    queued with makeSegment, makeSegmentResampled and makeSegmentMinMax,
+    which have the signatures of the TreeNode methods.
+
+    writer = SegmentWriter(node, segment_rows=10000, max_latency=.5)
+    for timestamp, row in acquisition:
+        writer.putRow(row, timestamp)
+    writer.close()  # returns after everything has been stored
+
+    A block that has been pending longer than max_latency seconds is written
+    as a shorter segment. When all num_buffers blocks are in flight putRow
+    blocks until the writer has caught up (backpressure), or raises
+    TreeNodeException if a timeout was given. Likewise at most num_buffers
+    complete segments are queued. Errors of the background
+    thread are raised by the next call.
+    """
+
+    def __init__(self, node, segment_rows=1024, dtype=None, row_shape=(),
+                 max_latency=1., num_buffers=4, timeout=None):
+        """
+        @param node: segmented node to write to
+        @type node: TreeNode
+        @param segment_rows: number of rows per segment
+        @type segment_rows: int
+        @param dtype: numpy dtype of the rows, by default taken from the first row
+        @param row_shape: shape of a row, by default taken from the first row
+        @type row_shape: tuple
+        @param max_latency: maximum time in seconds a row is buffered, None to disable
+        @type max_latency: float
+        @param num_buffers: number of blocks that may be in flight
+        @type num_buffers: int
+        @param timeout: how long putRow waits for a free block, None waits forever
+        @type timeout: float
+        """
+        self.node = node
+        self.segment_rows = int(segment_rows)
+        self.max_latency = max_latency
+        self.timeout = timeout
+        self._dtype = None if dtype is None else _N.dtype(dtype)
+        self._row_shape = tuple(row_shape)
+        self._num_buffers = int(num_buffers)
+        self._empty = _queue.Queue()
+        self._full = _queue.Queue()
+        self._slots = _queue.Queue()
+        for _ in _ver.xrange(self._num_buffers):
+            self._slots.put(True)
+        self._lock = _threading.Lock()
+        self._allocated = False
+        self._block = None
+        self._filled = 0
+        self._since = None
+        self._exception = None
+        self._closed = False
+        self._thread = _threading.Thread(
+            target=self._run, name='SegmentWriter(%s)' % (node,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _check(self):
+        if self._exception is not None:
+            exc, self._exception = self._exception, None
+            raise exc
+        if self._closed:
+            raise TreeNodeException("SegmentWriter is closed")
+
+    def _allocate(self, row):
+        self._allocated = True
+        if self._dtype is None:
+            self._dtype = row.dtype
+            self._row_shape = row.shape
+        shape = (self.segment_rows,) + self._row_shape
+        for _ in _ver.xrange(self._num_buffers):
+            self._empty.put((_N.empty((self.segment_rows,), _N.int64),
+                             _N.empty(shape, self._dtype)))
+
+    def _take(self, pool):
+        try:
+            return pool.get(timeout=self.timeout)
+        except _queue.Empty:
+            raise TreeNodeException(
+                "SegmentWriter of %s cannot keep up" % (self.node,))
+
+    def _next_block(self):
+        if self._block is None:
+            self._block = self._take(self._empty)
+            self._filled = 0
+            self._since = _time.time()
+        return self._block
+
+    def _queue_block(self):
+        """hand the current block to the writer thread, lock must be held"""
+        if self._block is not None and self._filled > 0:
+            self._full.put((self._block, self._filled))
+            self._block = None
+
+    def putRow(self, data, timestamp):
+        """Buffer one row of a timestamped segment
+        @param data: row data
+        @type data: ndarray or scalar
+        @param timestamp: timestamp of this row
+        @type timestamp: int
+        """
+        self._check()
+        row = _N.asarray(data.data() if isinstance(data, _dat.Data) else data)
+        with self._lock:
+            if not self._allocated:
+                self._allocate(row)
+            times, block = self._next_block()
+            times[self._filled] = int(timestamp)
+            block[self._filled] = row
+            self._filled += 1
+            if self._filled == self.segment_rows:
+                self._queue_block()
+
+    def putRows(self, data, timestamps):
+        """Buffer a number of rows of a timestamped segment
+        @param data: rows, first dimension is the row index
+        @type data: ndarray
+        @param timestamps: timestamps of the rows
+        @type timestamps: ndarray
+        """
+        for row, timestamp in zip(data, timestamps):
+            self.putRow(row, timestamp)
+
+    def _queue_segment(self, method, args):
+        """queue a complete segment after the pending rows"""
+        self._check()
+        args = list(args)
+        if isinstance(args[3], _N.ndarray):
+            args[3] = _N.array(args[3])  # the caller may reuse its buffer
+        with self._lock:
+            self._queue_block()
+            self._take(self._slots)
+            self._full.put(((method, args), None))
+
+    def makeSegment(self, start, end, dim, array, idx=-1, rows_filled=-1):
+        """Queue a complete segment, see TreeNode.makeSegment.
+        The array is copied so the caller may reuse its buffer right away."""
+        self._queue_segment('makeSegment',
+                            (start, end, dim, array, idx, rows_filled))
+
+    def makeSegmentResampled(self, start, end, dim, array, resNode, resFactor,
+                             idx=-1, rows_filled=-1):
+        """Queue a complete segment, see TreeNode.makeSegmentResampled"""
+        self._queue_segment('makeSegmentResampled',
+                            (start, end, dim, array, resNode, resFactor,
+                             idx, rows_filled))
+
+    def makeSegmentMinMax(self, start, end, dim, array, resNode, resFactor,
+                          idx=-1, rows_filled=-1):
+        """Queue a complete segment, see TreeNode.makeSegmentMinMax"""
+        self._queue_segment('makeSegmentMinMax',
+                            (start, end, dim, array, resNode, resFactor,
+                             idx, rows_filled))
+
+    def flush(self):
+        """Queue the pending rows and wait until everything queued has been stored"""
+        self._check()
+        with self._lock:
+            self._queue_block()
+        self._full.join()
+        if self._exception is not None:
+            self._check()
+
+    def close(self):
+        """Store all pending rows and stop the writer thread"""
+        if self._closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._closed = True
+            self._full.put(None)
+            self._thread.join()
+
+    def _write(self, node, job):
+        block, filled = job
+        if filled is None:  # complete segment
+            method, args = block
+            try:
+                getattr(node, method)(*args)
+            finally:
+                self._slots.put(True)
+            return
+        times, data = block
+        try:
+            node.makeTimestampedSegment(times[:filled], data[:filled])
+        finally:
+            self._empty.put(block)
+
+    def _expire(self):
+        """queue the current block if it exceeded max_latency"""
+        if self.max_latency is None:
+            return
+        # never wait here: a producer holding the lock may be waiting for us
+        if not self._lock.acquire(False):
+            return
+        try:
+            if self._block is not None and \
+                    _time.time() - self._since >= self.max_latency:
+                self._queue_block()
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        while True:
+            try:
+                job = self._full.get(timeout=self.max_latency)
+            except _queue.Empty:
+                job = False
+            if job is not False:
+                try:
+                    if job is None:
+                        return
+                    self._write(self.node, job)
+                except Exception as exc:
+                    self._exception = exc
+                finally:
+                    self._full.task_done()
+            self._expire()
+
+
 class cached_property(object):
     """ converts to property with cache
     cache_on_set: controls if setter will set or clear cache
@@ -23,7 +23,8 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
-from MDSplus import Event
+from MDSplus import Event, EventMessage
+import os
 import time
 
 example = '/event/myevent?timeout=3'
@@ -41,6 +42,18 @@ class myevent(Event):
         self.cancel()
 
 
+def live(event, timeout):
+    """Wait for event through MdsShr, which also receives the events
+    forwarded by an mds_event_server"""
+    e = myevent(event, timeout)
+    e.join()
+    if e.exception is not None:
+        if 'Timeout' in str(e.exception):
+            return None
+        raise e.exception
+    return EventMessage(e.event, e.raw.data().tobytes(), e.time)
+
+
 def doEvent(self):
     status = '200 OK'
     response_headers = list()
@@ -50,12 +63,17 @@ def doEvent(self):
         event = self.path_parts[1]
     except:
         raise Exception(
-            "No event string provided, use: /event/event-name-to-waitfor[?timeout=n-secs[&handler=handler]]")
+            "No event string provided, use: /event/event-name-to-waitfor[?timeout=n-secs[&since=timestamp][&handler=handler]]")
     timeout = 60
     try:
         timeout = int(self.args['timeout'][-1])
     except:
         pass
+    since = None
+    try:
+        since = float(self.args['since'][-1])
+    except:
+        pass
     if 'handler' in self.args:
         specialHandler = __import__(self.args['handler'][-1])
         if hasattr(specialHandler, 'handler'):
@@ -64,9 +82,21 @@ def doEvent(self):
             raise Exception("No handler function found in handler module")
     else:
         specialHandler = None
-    e = myevent(event, timeout)
-    e.join()
-    if e.exception is None:
+    history = Event.enableHistory()
+    if os.getenv('mds_event_server'):
+        # the history does not receive forwarded events, it only replays
+        e = None
+        if since is not None:
+            missed = history.since(event, since)
+            if missed:
+                e = missed[0]
+        if e is None:
+            e = live(event, timeout)
+    else:
+        if since is None:
+            since = time.time()
+        e = history.wait(event, since, timeout or None)
+    if e is not None:
         if specialHandler is not None:
             status, sresponse_headers, output = specialHandler(e)
             for h in sresponse_headers:
@@ -76,8 +106,9 @@ def doEvent(self):
             data = e.getRaw()
             response_headers.append(('Content-type', 'text/xml'))
             output = '<?xml version="1.0" encoding="ISO-8859-1" ?>' + \
-                "<event><name>%s</name><time>%s</time>" % (event, t)
-            if data is not None:
+                "<event><name>%s</name><time>%s</time><timestamp>%r</timestamp>" % (
+                    event, t, e.time)
+            if len(data):
                 dtext = ""
                 for c in data:
                     dtext = dtext+chr(int(c))
@@ -86,8 +117,5 @@ def doEvent(self):
             output += "</event>"
             status = '200 OK'
     else:
-        if 'Timeout' in str(e.exception):
-            status = '204 NO_CONTENT'
-        else:
-            raise e.exception
+        status = '204 NO_CONTENT'
     return status, response_headers, output